@@ -1,9 +1,13 @@
 # app/app.py
+import time
+_import_start = time.perf_counter()
+
 import streamlit as st
 import pandas as pd
 import numpy as np
 
-# Import modules from the app package
+# Import modules from the app package. None of them imports faiss or torch:
+# the index and the embedding model are loaded in the background (see below).
 import data_manager
 import search_engine
 import visualization_engine
@@ -16,27 +20,58 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Per-phase startup timings; only the first (cold) run of each phase is recorded
+startup_timer = data_manager.startup_timer()
+startup_timer.record("import app modules", time.perf_counter() - _import_start)
+
 # --- Load Configuration and Data ---
-# This section attempts to load all necessary data at the start.
+# This section loads what the map needs before rendering. The FAISS index and the
+# embedding model are only needed for search, so they load in a background thread.
 # Errors during loading are handled by data_manager and will show up as st.error.
 
-config = data_manager.load_config()
+with startup_timer.phase("load config"):
+    config = data_manager.load_config()
 
 if config is None:
     st.stop() # Stop execution if config fails to load
 
+# Started first so the index and model load while the records are read and the map is drawn
+search_resources = data_manager.start_search_resources(config)
+
 # Load data using functions from data_manager
 # These functions use Streamlit's caching
-df_articles = data_manager.load_processed_records(config['paths']['processed_data'])
-faiss_index = data_manager.load_faiss_index(config)
-embedding_model = data_manager.load_embedding_model(config)
+lazy_details = config['app_settings'].get('lazy_details', False)
+with startup_timer.phase("load records"):
+    df_articles = data_manager.load_processed_records(
+        config['paths']['processed_data'], resident_only=lazy_details,
+        dataset_key=data_manager.dataset_version(config['paths']['processed_data'])
+    )
+# Abstracts/authors are read per article from disk when only the resident columns are loaded
+with startup_timer.phase("open detail store"):
+    detail_store = data_manager.load_detail_store(config, data_manager.dataset_version(config['paths']['processed_data'])) if lazy_details else None
+with startup_timer.phase("map embeddings"):
+    stored_embeddings = data_manager.load_embeddings_mmap(config) # Memory-mapped, used for "find similar"
+query_cache = data_manager.load_query_cache(config) # Shared across sessions
 # full_embeddings = data_manager.load_embeddings_array(config) # Optional, if needed
 
-# Check if essential data loaded successfully
-if df_articles.empty or faiss_index is None or embedding_model is None:
-    st.error("Essential data (articles, index, or model) could not be loaded. Please check the logs and ensure preprocessing was successful.")
+# Check if essential data loaded successfully. The map only needs the articles;
+# search is enabled once the background loader has the index and the model.
+if df_articles.empty:
+    st.error("Essential data (articles) could not be loaded. Please check the logs and ensure preprocessing was successful.")
     st.stop()
 
+# BM25 index for hybrid search (None: vector search only). Memory-mapped, so opening it is cheap.
+with startup_timer.phase("open lexical index"):
+    lexical = data_manager.load_lexical_index(config, len(df_articles), data_manager.artifact_version(config['paths'].get('lexical_index')))
+
+# Precomputed neighbors of every article, so "similar to" is a lookup (None: search live)
+with startup_timer.phase("open neighbor table"):
+    neighbors = data_manager.load_neighbor_table(config, len(df_articles), (data_manager.artifact_version(config['paths'].get('neighbor_table')), data_manager.dataset_version(config['paths']['faiss_index'])))
+
+# None until loaded in the background
+faiss_index = search_resources.index
+embedding_model = search_resources.model
+
 # --- Application State Initialization ---
 # Using st.session_state to store persistent state across reruns
 if 'selected_article_index' not in st.session_state:
@@ -47,6 +82,11 @@ if 'search_query' not in st.session_state:
     st.session_state.search_query = ""
 if 'last_clicked_id' not in st.session_state: # To track clicks on plot points
     st.session_state.last_clicked_id = None
+if 'query_point_coords' not in st.session_state:
+    st.session_state.query_point_coords = None # Map position of the last free-text query
+if 'base_figure_key' not in st.session_state: # Data/filter/settings the cached base figure was built for
+    st.session_state.base_figure_key = None
+    st.session_state.base_figure = None
 
 
 # --- Helper Functions ---
@@ -82,85 +122,101 @@ def display_article_details(article_series, max_abstract_length):
     else:
         st.write(abstract)
 
-def perform_search(query, df_articles_ref, model, index, top_k, query_prefix=""):
-    """Performs semantic search and updates session state."""
+def perform_search(query, df_articles_ref, model, index, top_k, query_prefix="", cache=None, allowed_ids=None, coord_columns=('x', 'y'), placement_k=10, lexical=None, hybrid_config=None):
+    """
+    Performs semantic search (restricted to allowed_ids, if given) and updates session state.
+    With a lexical (BM25) index, lexical and vector results are fused (hybrid search).
+    The query itself is placed on the map from its nearest vector results' coordinates.
+    """
+    st.session_state.selected_article_index = None
+    st.session_state.query_point_coords = None
     if not query:
-        st.session_state.selected_article_index = None
         st.session_state.neighbor_indices = []
         return
 
-    query_embedding = search_engine.embed_query(query, model, query_prefix)
+    query_embedding = search_engine.embed_query(query, model, query_prefix, cache=cache)
     if query_embedding is None:
         st.warning("Could not generate embedding for the query.")
-        st.session_state.selected_article_index = None
         st.session_state.neighbor_indices = []
         return
 
-    distances, neighbor_original_indices = search_engine.search_faiss_index(query_embedding, index, top_k=top_k + 1) # +1 to potentially exclude self if query is an article title
+    if lexical is not None:
+        hybrid_config = hybrid_config or {}
+        result_indices, distances, neighbor_original_indices = search_engine.hybrid_search(
+            query, query_embedding, index, lexical,
+            top_k=top_k,
+            candidates=max(top_k, placement_k, hybrid_config.get('candidates', 100)),
+            rrf_k=hybrid_config.get('rrf_k', 60),
+            lexical_weight=hybrid_config.get('lexical_weight', 1.0),
+            max_postings=hybrid_config.get('max_postings_per_term', 10000),
+            allowed_ids=allowed_ids
+        )
+    else:
+        distances, neighbor_original_indices = search_engine.search_faiss_index(query_embedding, index, top_k=max(top_k, placement_k), allowed_ids=allowed_ids)
+        result_indices = neighbor_original_indices[:top_k] if neighbor_original_indices is not None else None
 
-    if neighbor_original_indices is None or len(neighbor_original_indices) == 0:
+    if result_indices is None or len(result_indices) == 0:
         st.info("No similar articles found for your query.")
-        st.session_state.selected_article_index = None
         st.session_state.neighbor_indices = []
         return
 
-    # Convert FAISS indices (which are row numbers in the original embeddings array)
-    # to DataFrame indices if they are different (e.g., if df_articles was filtered).
-    # Here, we assume df_articles is the full, unfiltered dataset that matches FAISS.
-    # The indices from FAISS directly correspond to rows in df_articles.
-    
-    # Check if the query itself is very similar to one of the results (e.g. if user pasted a title)
-    # This is a simple check; more robust would involve comparing query text to titles.
-    # For now, we assume the first result is the "query" if it's very close.
-    # A better approach for "find similar to this article" is to use an article ID.
-
-    # The indices from FAISS are direct indices into the `df_articles` DataFrame
-    # because `df_articles` was used to generate embeddings in that order.
-    st.session_state.selected_article_index = neighbor_original_indices[0] # Closest match as "selected"
-    st.session_state.neighbor_indices = neighbor_original_indices[1:top_k+1] # The rest as neighbors
+    # The indices from FAISS (and the lexical index) are direct indices into the `df_articles`
+    # DataFrame because `df_articles` was used to generate embeddings in that order.
+    # Every result is a neighbor of the query; the query gets its own marker on the map.
+    st.session_state.neighbor_indices = list(result_indices)
+    if len(neighbor_original_indices) > 0:
+        neighbor_coords = df_articles_ref.loc[neighbor_original_indices, list(coord_columns)].to_numpy()
+        st.session_state.query_point_coords = search_engine.place_by_neighbors(
+            neighbor_coords, distances, index.metric_type, k=placement_k
+        )
 
 
-def find_similar_to_selected(selected_df_idx, df_articles_ref, model, index, top_k, passage_prefix=""):
-    """Finds articles similar to a currently selected article (by its DataFrame index)."""
+def find_similar_to_selected(selected_df_idx, df_articles_ref, index, top_k, embeddings=None, allowed_ids=None, neighbors=None):
+    """
+    Finds articles similar to a currently selected article (by its DataFrame index), within allowed_ids if given.
+    Reads the precomputed neighbor table (neighbors) when it can answer, otherwise searches live.
+    """
     if selected_df_idx is None:
         return
 
-    selected_article_series = df_articles_ref.loc[selected_df_idx]
-    
-    # Combine title and abstract for embedding, similar to preprocessing
-    text_to_embed = ""
-    for field in config['embedding_model']['text_fields_to_embed']:
-        text_to_embed += selected_article_series.get(field, "") + " "
-    text_to_embed = text_to_embed.strip()
-
-    if not text_to_embed:
-        st.warning("Selected article has no text content to find similars.")
+    # The indices from FAISS are direct indices into the `df_articles` DataFrame,
+    # so the article's stored vector can be looked up by its row instead of re-encoding its text.
+    distances, neighbor_original_indices = search_engine.similar_to_row(selected_df_idx, index, top_k=top_k, embeddings=embeddings, allowed_ids=allowed_ids, table=neighbors)
+    if neighbor_original_indices is None and index is None:
+        st.info("The search index is still loading. Similar articles will be available shortly.")
         return
 
-    # Use passage_prefix if defined, as we are embedding a "document"
-    article_embedding = search_engine.embed_query(text_to_embed, model, passage_prefix)
-
-    if article_embedding is None:
-        st.warning("Could not generate embedding for the selected article.")
-        return
-
-    distances, neighbor_original_indices = search_engine.search_faiss_index(article_embedding, index, top_k=top_k + 1) # +1 to exclude self
-
     if neighbor_original_indices is None or len(neighbor_original_indices) == 0:
         st.info("No similar articles found.")
         st.session_state.neighbor_indices = []
         return
 
-    # Exclude the selected article itself from its neighbors
-    # The indices from FAISS are direct indices into the `df_articles` DataFrame.
-    # The first result (index 0) will be the article itself.
-    st.session_state.neighbor_indices = [idx for idx in neighbor_original_indices if idx != selected_df_idx][:top_k]
+    # search_by_row already excludes the selected article itself from its neighbors
+    st.session_state.neighbor_indices = list(neighbor_original_indices)
 
 
 # --- UI Layout ---
 st.title(f"🗺️ {config['app_settings']['title']}")
 st.markdown("Interactive exploration of scientific articles through a 2D/3D semantic map.")
 
+@st.fragment(run_every=1 if search_resources.status == 'loading' else None) # Poll only while loading
+def search_status():
+    """Reports search readiness and reruns the whole page once the background loader publishes something new."""
+    if search_resources.status == 'loading':
+        if search_resources.index is None:
+            st.caption("⏳ Loading search index...")
+        else:
+            st.caption("⏳ Loading embedding model... (similar articles are available)")
+    elif search_resources.status == 'failed':
+        st.error(f"Search is unavailable: {search_resources.error}")
+    else:
+        st.caption("✅ Search ready")
+    # The rest of the page was drawn with the resources as they were; refresh it when they change
+    if (search_resources.index is not None) != (faiss_index is not None) or \
+       (search_resources.model is not None) != (embedding_model is not None):
+        st.rerun()
+
+
 # --- Sidebar for Controls ---
 with st.sidebar:
     st.header("🔎 Search & Filter")
@@ -173,25 +229,25 @@ with st.sidebar:
         on_change=lambda: setattr(st.session_state, 'search_query', st.session_state.search_bar_input) # Update state on change
     )
 
-    if st.button("Search", key="search_button", type="primary"):
-        st.session_state.search_query = st.session_state.search_bar_input # Ensure state is current
-        query_prefix = config.get('embedding_model', {}).get('query_prefix', "")
-        perform_search(
-            st.session_state.search_query,
-            df_articles,
-            embedding_model,
-            faiss_index,
-            config['app_settings']['default_top_k'],
-            query_prefix
-        )
-        st.session_state.last_clicked_id = None # Reset click selection on new search
+    # The search itself runs after the filters below are read, so it can be restricted to them
+    use_hybrid = st.checkbox(
+        "Match exact terms too (hybrid search)", value=True, key="hybrid_search",
+        help="Fuse keyword (BM25) and semantic results. Helps with gene names, acronyms and author names."
+    ) if lexical is not None else False
+
+    search_requested = st.button("Search", key="search_button", type="primary", disabled=embedding_model is None or faiss_index is None)
+    search_status()
 
     st.markdown("---")
     # Filters (optional)
     st.subheader("Filters")
+    # Filter index and facets are built once per dataset, not on every rerun
+    with startup_timer.phase("build filter index"):
+        filter_index = data_manager.build_filter_index(df_articles, data_manager.dataset_version(config['paths']['processed_data']))
+
     # Year filter
-    if 'year' in df_articles.columns and pd.api.types.is_numeric_dtype(df_articles['year']):
-        min_year, max_year = int(df_articles['year'].min()), int(df_articles['year'].max())
+    if filter_index['year'] is not None:
+        min_year, max_year = filter_index['year']['min'], filter_index['year']['max']
         if min_year < max_year : # Ensure there's a range to filter
             selected_years = st.slider(
                 "Publication Year:",
@@ -207,8 +263,8 @@ with st.sidebar:
         st.caption("Year data not available or not numeric for filtering.")
 
     # Journal filter (example - could be multi-select)
-    if 'journal' in df_articles.columns:
-        unique_journals = sorted(df_articles['journal'].astype(str).unique().tolist())
+    if filter_index['journal'] is not None:
+        unique_journals = filter_index['journal']['names'] # Sorted
         if len(unique_journals) > 1:
             selected_journal = st.selectbox(
                 "Journal (select 'All' to disable):",
@@ -224,6 +280,47 @@ with st.sidebar:
         selected_journal = "All"
         st.caption("Journal data not available for filtering.")
 
+    # Rows matching the filters (None when no filter is active). Also the allowed FAISS row ids.
+    view_rows = data_manager.filter_view(filter_index, selected_years, selected_journal)
+    allowed_ids = view_rows
+
+    # Map coloring by precomputed topic clusters (preprocessing/7_cluster_articles.py)
+    available_clusterings = data_manager.cluster_columns(df_articles)
+    if available_clusterings:
+        cluster_labels = data_manager.load_cluster_labels(
+            config['paths'].get('cluster_labels'), data_manager.dataset_version(config['paths']['processed_data'])
+        )
+        color_options = [None] + available_clusterings
+        default_color_by = config['app_settings'].get('color_by')
+        color_by = st.selectbox(
+            "Color map by:",
+            options=color_options,
+            index=color_options.index(default_color_by) if default_color_by in color_options else 0,
+            format_func=lambda col: "Nothing" if col is None else f"Topic ({col.split('_')[-1]} clusters)",
+            key="color_by"
+        )
+    else:
+        cluster_labels, color_by = {}, None
+
+    if search_requested:
+        st.session_state.search_query = st.session_state.search_bar_input # Ensure state is current
+        query_prefix = config.get('embedding_model', {}).get('query_prefix', "")
+        perform_search(
+            st.session_state.search_query,
+            df_articles,
+            embedding_model,
+            faiss_index,
+            config['app_settings']['default_top_k'],
+            query_prefix,
+            cache=query_cache,
+            allowed_ids=allowed_ids,
+            coord_columns=('x', 'y', 'z') if config['app_settings']['plot_dimensions'] == 3 else ('x', 'y'),
+            placement_k=config['app_settings'].get('query_placement_k', 10),
+            lexical=lexical if use_hybrid else None,
+            hybrid_config=config.get('hybrid_search')
+        )
+        st.session_state.last_clicked_id = None # Reset click selection on new search
+
 
 # --- Main Area for Visualization and Details ---
 col1, col2 = st.columns([3, 2]) # Visualization takes more space
@@ -231,85 +328,95 @@ col1, col2 = st.columns([3, 2]) # Visualization takes more space
 with col1:
     st.subheader("Semantic Map")
 
-    # Apply filters to get df_display
-    df_display = df_articles.copy()
-    if selected_years:
-        df_display = df_display[(df_display['year'] >= selected_years[0]) & (df_display['year'] <= selected_years[1])]
-    if selected_journal != "All":
-        df_display = df_display[df_display['journal'] == selected_journal]
+    # The filtered view is an array of row ids; a DataFrame of the displayed rows is only
+    # materialized when the base figure has to be rebuilt
+    n_displayed = filter_index['n_rows'] if view_rows is None else len(view_rows)
 
-    if df_display.empty:
+    if n_displayed == 0:
         st.warning("No articles match the current filter criteria.")
     else:
-        # Map session state indices (which are for original df_articles) to df_display indices
-        # This is crucial if df_display is a filtered subset.
-        # We need to find the df_display index for the selected_article_index from original df.
-        
-        query_point_display_idx = None
-        if st.session_state.selected_article_index is not None:
-            # Check if the selected article is in the filtered df_display
-            if st.session_state.selected_article_index in df_display.index:
-                query_point_display_idx = st.session_state.selected_article_index
-            else: # If selected article is filtered out, clear selection for display
-                query_point_display_idx = None
-
-
-        neighbor_display_indices = []
-        # if st.session_state.neighbor_indices: REMOVED
-        if st.session_state.neighbor_indices is not None and len(st.session_state.neighbor_indices) > 0:
-
-            # Filter neighbor_indices to only those present in df_display
-            neighbor_display_indices = [idx for idx in st.session_state.neighbor_indices if idx in df_display.index]
-
-
-        # Create the plot
-        plot_fig = visualization_engine.create_semantic_map(
-            df_display=df_display, # Pass the potentially filtered DataFrame
-            plot_dimensions=config['app_settings']['plot_dimensions'],
-            hover_name='title',
-            hover_data=['id', 'year', 'journal', 'authors'],
-            highlight_indices=neighbor_display_indices, # Use display indices
-            query_point_index=query_point_display_idx, # Use display index
-            point_size=config['app_settings']['plot_point_size'],
-            map_height=600
+        # Session state indices refer to rows of df_articles. Only those inside the
+        # filtered view are drawn; a filtered-out selection is not shown.
+        selected_in_view = data_manager.rows_in_view(view_rows, [st.session_state.selected_article_index])
+        query_point_display_idx = selected_in_view[0] if selected_in_view else None
+        neighbor_display_indices = data_manager.rows_in_view(view_rows, st.session_state.neighbor_indices or [])
+
+        # Create the plot: the base figure (every displayed document) only changes with the
+        # data, the filters or the plot settings, so it is built once and kept in the session;
+        # each rerun only swaps the small neighbor/selection/query overlay traces in Python.
+        # st.plotly_chart still serializes and sends the whole figure whenever it changes.
+        app_settings = config['app_settings']
+        base_figure_key = (
+            data_manager.dataset_version(config['paths']['processed_data']),
+            tuple(selected_years) if selected_years else None,
+            selected_journal,
+            app_settings['plot_dimensions'],
+            app_settings['plot_point_size'],
+            app_settings.get('render_mode', "auto"),
+            app_settings.get('webgl_threshold', 20000),
+            app_settings.get('density_threshold', 200000),
+            app_settings.get('hexbin_gridsize', 150),
+            color_by,
         )
-        # For handling clicks on the plot:
-        # Plotly express click events return a list of points. We take the first one.
-        # The `customdata` can be used to pass the original DataFrame index.
-        # For simplicity, px.scatter uses the DataFrame index by default if no customdata is set.
-        # We need to ensure that the index of df_display is what we want.
-        # If df_display is a slice, its index will be from the original df_articles.
-        
-        # Add customdata to map click events back to original df_articles index
-        # This is important if df_display is filtered.
-        # The index of df_display IS the original index from df_articles.
-        plot_fig.update_traces(customdata=df_display.index.values)
-
+        if st.session_state.base_figure_key != base_figure_key:
+            with startup_timer.phase("build base figure"):
+                df_display = df_articles if view_rows is None else df_articles.iloc[view_rows]
+                st.session_state.base_figure = visualization_engine.create_base_figure(
+                    df_display=df_display, # Pass the potentially filtered DataFrame
+                    plot_dimensions=app_settings['plot_dimensions'],
+                    hover_name='title',
+                    hover_data=[col for col in ['id', 'year', 'journal', 'authors'] if col in df_articles.columns],
+                    point_size=app_settings['plot_point_size'],
+                    map_height=600,
+                    render_mode=app_settings.get('render_mode', "auto"),
+                    webgl_threshold=app_settings.get('webgl_threshold', 20000),
+                    density_threshold=app_settings.get('density_threshold', 200000),
+                    hexbin_gridsize=app_settings.get('hexbin_gridsize', 150),
+                    color_by=color_by,
+                    cluster_labels=cluster_labels.get(color_by) if color_by else None
+                )
+            st.session_state.base_figure_key = base_figure_key
+        plot_fig = visualization_engine.update_overlays(
+            st.session_state.base_figure,
+            visualization_engine.build_overlays(
+                df_articles, # Only the highlighted rows (already restricted to the view) are read
+                plot_dimensions=app_settings['plot_dimensions'],
+                highlight_indices=neighbor_display_indices, # Use display indices
+                query_point_index=query_point_display_idx, # Use display index
+                query_coords=st.session_state.query_point_coords, # Free-text query marker
+                query_label=st.session_state.search_query,
+                point_size=app_settings['plot_point_size']
+            )
+        )
+        # For handling clicks on the plot: every trace stores each point's original
+        # df_articles index as its first customdata value (-1 for the query marker and density cells).
 
         # Display the plot and handle click events
         # `selected_points` will contain the `customdata` (original index) of the clicked point
         clicked_event = st.plotly_chart(plot_fig, use_container_width=True, on_select="rerun")
 
         if clicked_event.selection and clicked_event.selection["points"]:
-            # `customdata` holds the original DataFrame index
-            clicked_df_index = clicked_event.selection["points"][0]["customdata"]
+            # `customdata` holds the original DataFrame index (first value when hover data is attached)
+            clicked_customdata = clicked_event.selection["points"][0].get("customdata")
+            clicked_df_index = clicked_customdata[0] if isinstance(clicked_customdata, (list, tuple)) else clicked_customdata
 
             # Prevent re-processing if the same point is clicked repeatedly without other interaction
-            # (Streamlit's on_select="rerun" can be sensitive)
-            if st.session_state.last_clicked_id != clicked_df_index:
+            # (Streamlit's on_select="rerun" can be sensitive). The query marker is not an article.
+            if clicked_df_index is not None and clicked_df_index in df_articles.index and st.session_state.last_clicked_id != clicked_df_index:
                 st.session_state.selected_article_index = clicked_df_index
+                st.session_state.query_point_coords = None # Selecting an article replaces the query marker
                 st.session_state.last_clicked_id = clicked_df_index # Update last clicked
                 st.session_state.search_query = df_articles.loc[clicked_df_index, 'title'] # Update search bar
 
                 # Find similar articles to the one clicked on the map
-                passage_prefix = config.get('embedding_model', {}).get('passage_prefix', "")
                 find_similar_to_selected(
                     st.session_state.selected_article_index,
-                    df_articles, # Use original df_articles for embedding lookup
-                    embedding_model,
+                    df_articles,
                     faiss_index,
                     config['app_settings']['default_top_k'],
-                    passage_prefix
+                    stored_embeddings,
+                    allowed_ids,
+                    neighbors=neighbors
                 )
                 st.rerun() # Rerun to update plot with new selection and neighbors
 
@@ -319,19 +426,19 @@ with col2:
     # Display details of the currently selected article
     if st.session_state.selected_article_index is not None and \
        st.session_state.selected_article_index in df_articles.index: # Check if index is valid
-        selected_article_data = df_articles.loc[st.session_state.selected_article_index]
+        selected_article_data = data_manager.get_article(df_articles, st.session_state.selected_article_index, detail_store)
         display_article_details(selected_article_data, config['app_settings']['max_abstract_length_display'])
 
         # Button to find similar articles to the one displayed in details
         if st.button("Find Similar to This Article", key="find_similar_details_button"):
-            passage_prefix = config.get('embedding_model', {}).get('passage_prefix', "")
             find_similar_to_selected(
                 st.session_state.selected_article_index,
                 df_articles,
-                embedding_model,
                 faiss_index,
                 config['app_settings']['default_top_k'],
-                passage_prefix
+                stored_embeddings,
+                allowed_ids,
+                neighbors=neighbors
             )
             st.rerun() # Rerun to update plot and neighbor list
     else:
@@ -351,18 +458,19 @@ with col2:
             # Make neighbor titles clickable to select them
             if st.button(f"{i+1}. {neighbor_article.get('title', 'N/A')}", key=f"neighbor_{neighbor_idx}"):
                 st.session_state.selected_article_index = neighbor_idx
+                st.session_state.query_point_coords = None
                 st.session_state.last_clicked_id = neighbor_idx # Update last clicked
                 st.session_state.search_query = neighbor_article.get('title', '') # Update search bar
 
                 # Find new set of neighbors for this newly selected article
-                passage_prefix = config.get('embedding_model', {}).get('passage_prefix', "")
                 find_similar_to_selected(
                     st.session_state.selected_article_index,
                     df_articles,
-                    embedding_model,
                     faiss_index,
                     config['app_settings']['default_top_k'],
-                    passage_prefix
+                    stored_embeddings,
+                    allowed_ids,
+                    neighbors=neighbors
                 )
                 st.rerun() # Rerun to update everything
             st.caption(f"ID: {neighbor_article.get('id', 'N/A')}, Year: {neighbor_article.get('year', 'N/A')}")
@@ -371,7 +479,19 @@ with col2:
 
 # --- Footer or additional info ---
 st.sidebar.markdown("---")
+cache_stats = query_cache.stats()
+st.sidebar.caption(
+    f"Query cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+    f"({cache_stats['hit_rate']:.0%} hit rate), {cache_stats['size']}/{cache_stats['max_size']} entries"
+)
+with st.sidebar.expander("Startup timings"):
+    startup_phases = startup_timer.summary()
+    st.dataframe(
+        pd.DataFrame({'phase': list(startup_phases), 'seconds': [round(s, 3) for s in startup_phases.values()]}),
+        hide_index=True
+    )
 st.sidebar.info(
     "This app helps explore scientific articles using semantic similarity. "
     "Built with Streamlit, FAISS, SentenceTransformers, and Plotly."
-)
\ No newline at end of file
+)
+startup_timer.mark("map ready") # First full render of the page
\ No newline at end of file
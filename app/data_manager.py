@@ -2,19 +2,74 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import faiss
-from sentence_transformers import SentenceTransformer
+import pyarrow.parquet as pq
 import yaml
+import json
 import logging
 import os # For checking file existence
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
 
+import embedding_store
+import encoder_backend
+import lexical_index
+import neighbor_table
+import search_engine
+import topic_clusters
+
 # Get the parent directory of the current script
 parent_dir = Path(__file__).parent.parent
 
 # Configure basic logging (useful for Streamlit if run directly, though Streamlit has its own logging)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# faiss and sentence_transformers (which pulls in torch) are imported on first use, in the
+# background thread started by start_search_resources, so the map can render without them.
+
+class StartupTimer:
+    """
+    Wall-clock time of named startup phases, in the order they first ran. Only the first
+    run of a phase is kept: later reruns hit Streamlit's caches and cost nothing.
+    Thread-safe, so the background loader records into the same timer as the page.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.phases = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """Times the enclosed block as phase `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        with self._lock:
+            if name in self.phases:
+                return
+            self.phases[name] = seconds
+        logging.info(f"Startup phase '{name}' took {seconds:.3f}s.")
+
+    def mark(self, name):
+        """Records the time elapsed since the timer was created, e.g. when the page is first usable."""
+        self.record(name, time.perf_counter() - self.started_at)
+
+    def summary(self):
+        with self._lock:
+            return dict(self.phases)
+
+@st.cache_resource # One timer per server process
+def startup_timer():
+    """The process-wide StartupTimer."""
+    return StartupTimer()
+
 @st.cache_data # Caches the output of this function
 def load_config(config_path=parent_dir / "config.yaml"):
     """Loads the YAML configuration file."""
@@ -31,16 +86,30 @@ def load_config(config_path=parent_dir / "config.yaml"):
         logging.error(f"Error loading configuration: {e}")
         return None
 
+# Columns kept in memory when details are loaded lazily: plotting, filtering and lists
+RESIDENT_COLUMNS = ['id', 'title', 'year', 'journal', 'x', 'y', 'z']
+# Columns fetched per article on demand (ArticleDetailStore)
+DETAIL_COLUMNS = ['abstract', 'authors']
+
 @st.cache_data # Caches the DataFrame
-def load_processed_records(file_path):
-    """Loads the processed article records (metadata + UMAP coordinates) from Parquet."""
+def load_processed_records(file_path, resident_only=False, dataset_key=None):
+    """
+    Loads the processed article records (metadata + UMAP coordinates) from Parquet.
+    With resident_only, only RESIDENT_COLUMNS are read; abstracts and authors are then
+    served by load_detail_store. dataset_key (see dataset_version) is only part of the
+    cache key, so the records are reloaded when preprocessing rewrites the file.
+    """
     if not os.path.exists(file_path):
         st.error(f"Processed records file not found: {file_path}")
         return pd.DataFrame() # Return empty DataFrame
     try:
-        df = pd.read_parquet(file_path)
+        columns = None
+        if resident_only:
+            available = set(pq.read_schema(file_path).names)
+            columns = [col for col in RESIDENT_COLUMNS if col in available] + topic_clusters.cluster_columns(available) # Also kept in memory
+        df = pd.read_parquet(file_path, columns=columns)
         # Ensure essential columns for visualization exist
-        required_cols = ['id', 'title', 'abstract', 'x', 'y']
+        required_cols = ['id', 'title', 'x', 'y'] if resident_only else ['id', 'title', 'abstract', 'x', 'y']
         config = load_config()
         if config and config['app_settings']['plot_dimensions'] == 3:
             required_cols.append('z')
@@ -57,17 +126,124 @@ def load_processed_records(file_path):
         logging.error(f"Error loading processed records: {e}")
         return pd.DataFrame()
 
+class ArticleDetailStore:
+    """
+    Reads detail columns (abstract, authors) of single articles from the processed Parquet
+    file by row id. A miss reads only those columns of the row group holding the row, so
+    files written with small row groups (storage.row_group_size) make lookups cheap.
+    Fetched rows are kept in an LRU of max_size rows. Thread-safe.
+    """
+
+    def __init__(self, file_path, columns=None, max_size=1024):
+        self.file_path = str(file_path)
+        self.parquet_file = pq.ParquetFile(self.file_path)
+        available = set(self.parquet_file.schema_arrow.names)
+        self.columns = [col for col in (columns or DETAIL_COLUMNS) if col in available]
+        row_counts = [self.parquet_file.metadata.row_group(i).num_rows for i in range(self.parquet_file.num_row_groups)]
+        self.row_group_starts = np.concatenate(([0], np.cumsum(row_counts)))
+        self.max_size = max_size
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return int(self.row_group_starts[-1])
+
+    def get_many(self, row_ids):
+        """Returns {row_id: {column: value}} for the given row ids, reading each needed row group once."""
+        row_ids = [int(row_id) for row_id in row_ids]
+        found = {}
+        with self._lock:
+            for row_id in row_ids:
+                if row_id in self._rows:
+                    self._rows.move_to_end(row_id)
+                    found[row_id] = self._rows[row_id]
+            missing = [row_id for row_id in row_ids if row_id not in found and 0 <= row_id < len(self)]
+            if not missing or not self.columns:
+                return found
+
+            groups = np.searchsorted(self.row_group_starts, missing, side='right') - 1
+            for group in np.unique(groups):
+                table = self.parquet_file.read_row_group(int(group), columns=self.columns)
+                for row_id in (row_id for row_id, row_group in zip(missing, groups) if row_group == group):
+                    offset = row_id - int(self.row_group_starts[group])
+                    found[row_id] = {col: table.column(col)[offset].as_py() for col in self.columns}
+                    self._rows[row_id] = found[row_id]
+            while len(self._rows) > self.max_size:
+                self._rows.popitem(last=False)
+        return found
+
+    def get(self, row_id):
+        """Detail columns of one row as a dict (empty if the row does not exist)."""
+        return self.get_many([row_id]).get(int(row_id), {})
+
+def dataset_version(file_path):
+    """Identifies the current version of a data file (path and modification time), for cache keys."""
+    try:
+        return (str(file_path), os.path.getmtime(file_path))
+    except OSError:
+        return (str(file_path), None)
+
+def artifact_version(directory):
+    """Version of a directory artifact (lexical index, neighbor table): that of its meta.json, rewritten on every build."""
+    return dataset_version(os.path.join(directory, "meta.json")) if directory else None
+
+@st.cache_resource # One reader and LRU per dataset version, shared across sessions
+def load_detail_store(_config, dataset_key):
+    """Creates the on-demand reader for abstracts/authors. dataset_key identifies the file version."""
+    file_path = _config['paths']['processed_data']
+    try:
+        store = ArticleDetailStore(file_path, max_size=_config['app_settings'].get('detail_cache_size', 1024))
+        logging.info(f"Article details will be read on demand from {file_path} ({store.parquet_file.num_row_groups} row groups).")
+        return store
+    except Exception as e:
+        logging.error(f"Error opening article detail store: {e}")
+        return None
+
+def get_article(df_articles, row_id, detail_store=None):
+    """
+    Full record of one article as a Series: the resident columns from df_articles plus,
+    when details are loaded lazily, the detail columns from detail_store.
+    """
+    article = df_articles.loc[row_id]
+    if detail_store is None:
+        return article
+    return pd.concat([article, pd.Series(detail_store.get(row_id), dtype=object)])
+
+def read_index_with_params(file_path, mmap=False):
+    """
+    Reads the FAISS index (memory-mapped if requested) and applies the runtime parameters
+    (nprobe/efSearch) tuned when it was built. Raises on failure; no Streamlit calls, so it
+    can run in the background loader.
+    """
+    index, mmapped = search_engine.read_faiss_index(file_path, mmap=mmap)
+    logging.info(f"FAISS index loaded successfully from {file_path}{' (memory-mapped)' if mmapped else ''}. Contains {index.ntotal} vectors.")
+    params_path = Path(file_path).with_suffix('.params.json')
+    if params_path.exists():
+        with open(params_path, 'r') as f:
+            index_params = json.load(f)
+        search_engine.apply_search_params(index, index_params.get('search_params'))
+    return index
+
+def create_embedding_model(model_config):
+    """
+    Imports sentence_transformers (and torch) and loads the query encoder with the backend
+    configured in model_config (see encoder_backend). Raises on failure.
+    """
+    return encoder_backend.load_encoder(model_config)
+
 @st.cache_resource # Caches the FAISS index object
 def load_faiss_index(_config): # Pass config to use its path
-    """Loads the FAISS index."""
+    """
+    Loads the FAISS index. With app_settings.index_mmap the index is memory-mapped
+    read-only, so every app process on the host shares one copy of the vectors.
+    Blocks until loaded; the app uses start_search_resources instead.
+    """
     file_path = _config['paths']['faiss_index']
     if not os.path.exists(file_path):
         st.error(f"FAISS index file not found: {file_path}")
         return None
     try:
-        index = faiss.read_index(file_path)
-        logging.info(f"FAISS index loaded successfully from {file_path}. Contains {index.ntotal} vectors.")
-        return index
+        return read_index_with_params(file_path, mmap=_config['app_settings'].get('index_mmap', False))
     except Exception as e:
         st.error(f"Error loading FAISS index: {e}")
         logging.error(f"Error loading FAISS index: {e}")
@@ -75,29 +251,285 @@ def load_faiss_index(_config): # Pass config to use its path
 
 @st.cache_resource # Caches the SentenceTransformer model
 def load_embedding_model(_config): # Pass config to use its model name
-    """Loads the SentenceTransformer model specified in the config."""
+    """Loads the query encoder specified in the config. Blocks until loaded."""
     model_name = _config['embedding_model']['name']
     try:
-        model = SentenceTransformer(model_name)
-        logging.info(f"SentenceTransformer model '{model_name}' loaded successfully.")
-        return model
+        return create_embedding_model(_config['embedding_model'])
     except Exception as e:
         st.error(f"Error loading embedding model '{model_name}': {e}")
         logging.error(f"Error loading embedding model '{model_name}': {e}")
         return None
 
+class SearchResources:
+    """
+    Loads the FAISS index and the embedding model in a background thread, so the page,
+    which only needs the processed records to draw the map, renders without waiting for
+    faiss, torch or the model weights. Each resource is warmed up (one search, one encode)
+    before it is published, so the first real query does not pay for lazy initialization.
+
+    index is set as soon as it is ready (enough for "find similar"); model follows.
+    status is 'loading', 'ready' or 'failed' (see error). Phases are recorded in timer.
+    """
+
+    def __init__(self, config, timer):
+        self.index_path = config['paths']['faiss_index']
+        self.index_mmap = config['app_settings'].get('index_mmap', False)
+        self.model_config = config['embedding_model']
+        self.query_prefix = config['embedding_model'].get('query_prefix', "")
+        self.timer = timer
+        self.index = None
+        self.model = None
+        self.status = 'loading'
+        self.error = None
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._load, name="search-resources", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    @property
+    def ready(self):
+        return self.status == 'ready'
+
+    def wait(self, timeout=None):
+        """Blocks until loading finished (ready or failed). Returns False on timeout."""
+        return self._done.wait(timeout)
+
+    def _load(self):
+        try:
+            if not os.path.exists(self.index_path):
+                raise FileNotFoundError(f"FAISS index file not found: {self.index_path}")
+            with self.timer.phase("import faiss"):
+                import faiss # noqa: F401
+            with self.timer.phase("load index"):
+                index = read_index_with_params(self.index_path, mmap=self.index_mmap)
+            with self.timer.phase("warm-up search"):
+                if index.ntotal > 0:
+                    index.search(np.zeros((1, index.d), dtype=np.float32), 1)
+            self.index = index
+
+            with self.timer.phase("import sentence_transformers"):
+                import sentence_transformers # noqa: F401
+            with self.timer.phase("load model"):
+                model = create_embedding_model(self.model_config)
+            with self.timer.phase("warm-up encode"):
+                if search_engine.embed_query("warm-up", model, self.query_prefix) is None:
+                    raise RuntimeError(f"Model '{self.model_config['name']}' failed to encode the warm-up query.")
+            self.model = model
+            self.status = 'ready'
+            self.timer.mark("search ready")
+        except Exception as e:
+            logging.error(f"Error loading search resources: {e}")
+            self.error = str(e)
+            self.status = 'failed'
+        finally:
+            self._done.set()
+
+@st.cache_resource # Started once per server process, shared across sessions
+def start_search_resources(_config):
+    """Starts loading the index and model in the background and returns the SearchResources."""
+    return SearchResources(_config, startup_timer()).start()
+
+@st.cache_resource # Built once per dataset, shared across sessions
+def build_filter_index(_df_articles, dataset_key):
+    """
+    Precomputes everything the sidebar filters need, so a rerun costs O(result) instead
+    of O(corpus):
+    - year: row ids sorted by year (a year range is one searchsorted slice) plus the min/max facet.
+    - journal: categorical codes with row ids grouped by code and offsets
+      (a journal is one zero-copy slice) plus the sorted journal list facet.
+    Filtered views are memoized by filter tuple (see filter_view).
+    dataset_key (e.g. dataset_version of the processed data) identifies the cached entry.
+    """
+    filter_index = {
+        'n_rows': len(_df_articles),
+        'year': None,
+        'journal': None,
+        'views': OrderedDict(), # (year range, journal) -> sorted row ids
+        'lock': threading.Lock(),
+    }
+    if 'year' in _df_articles.columns and pd.api.types.is_numeric_dtype(_df_articles['year']):
+        years = _df_articles['year'].to_numpy()
+        rows_by_year = np.argsort(years, kind='stable').astype(np.int64)
+        filter_index['year'] = {
+            'values': years,
+            'sorted_values': years[rows_by_year],
+            'rows': rows_by_year,
+            'min': int(years.min()) if len(years) else 0,
+            'max': int(years.max()) if len(years) else 0,
+        }
+    if 'journal' in _df_articles.columns:
+        codes, journals = pd.factorize(_df_articles['journal'].astype(str), sort=True)
+        rows_by_journal = np.argsort(codes, kind='stable').astype(np.int64) # Rows stay sorted within a journal
+        filter_index['journal'] = {
+            'codes': codes,
+            'names': journals.tolist(),
+            'code_of': {name: code for code, name in enumerate(journals)},
+            'rows': rows_by_journal,
+            'offsets': np.concatenate(([0], np.cumsum(np.bincount(codes, minlength=len(journals))))),
+        }
+    logging.info(
+        f"Filter index built for {dataset_key}: "
+        f"{len(filter_index['journal']['names']) if filter_index['journal'] else 0} journals, "
+        f"years {'%d-%d' % (filter_index['year']['min'], filter_index['year']['max']) if filter_index['year'] else 'n/a'}."
+    )
+    return filter_index
+
+def year_range_rows(filter_index, selected_years):
+    """Row ids (in year order) with a year inside the inclusive range: a slice, no copy."""
+    year_index = filter_index['year']
+    start = np.searchsorted(year_index['sorted_values'], selected_years[0], side='left')
+    stop = np.searchsorted(year_index['sorted_values'], selected_years[1], side='right')
+    return year_index['rows'][start:stop]
+
+def journal_rows(filter_index, journal):
+    """Sorted row ids of one journal: a slice, no copy."""
+    journal_index = filter_index['journal']
+    code = journal_index['code_of'].get(journal)
+    if code is None:
+        return np.array([], dtype=np.int64)
+    return journal_index['rows'][journal_index['offsets'][code]:journal_index['offsets'][code + 1]]
+
+def filter_view(filter_index, selected_years=None, selected_journal="All", max_cached_views=64):
+    """
+    Sorted array of the row ids matching the filters, or None when no filter is active
+    (every row; searches can then skip the IDSelector entirely).
+    Views are memoized by filter tuple. Cost of a miss is proportional to the smaller of
+    the two filtered sets.
+    """
+    year_index, journal_index = filter_index['year'], filter_index['journal']
+    year_filter = None
+    if selected_years and year_index and (selected_years[0] > year_index['min'] or selected_years[1] < year_index['max']):
+        year_filter = (int(selected_years[0]), int(selected_years[1]))
+    journal_filter = selected_journal if journal_index and selected_journal and selected_journal != "All" else None
+    if year_filter is None and journal_filter is None:
+        return None
+
+    key = (year_filter, journal_filter)
+    with filter_index['lock']:
+        if key in filter_index['views']:
+            filter_index['views'].move_to_end(key)
+            return filter_index['views'][key]
+
+    if journal_filter is None:
+        rows = np.sort(year_range_rows(filter_index, year_filter))
+    elif year_filter is None:
+        rows = journal_rows(filter_index, journal_filter)
+    else:
+        in_journal = journal_rows(filter_index, journal_filter)
+        in_years = year_range_rows(filter_index, year_filter)
+        if len(in_journal) <= len(in_years): # Check the other condition on the smaller set
+            journal_years = year_index['values'][in_journal]
+            rows = in_journal[(journal_years >= year_filter[0]) & (journal_years <= year_filter[1])]
+        else:
+            rows = np.sort(in_years[journal_index['codes'][in_years] == journal_index['code_of'][journal_filter]])
+
+    rows.setflags(write=False) # Shared between sessions
+    with filter_index['lock']:
+        filter_index['views'][key] = rows
+        while len(filter_index['views']) > max_cached_views:
+            filter_index['views'].popitem(last=False)
+    return rows
+
+def rows_in_view(view_rows, row_ids):
+    """The given row ids that are part of a filtered view (all of them when view_rows is None)."""
+    row_ids = [row_id for row_id in row_ids if row_id is not None]
+    if view_rows is None or not row_ids:
+        return row_ids
+    positions = np.searchsorted(view_rows, row_ids)
+    return [row_id for row_id, position in zip(row_ids, positions) if position < len(view_rows) and view_rows[position] == row_id]
+
+@st.cache_resource # Shares one read-only mapping across sessions
+def load_lexical_index(_config, n_rows, artifact_key=None):
+    """
+    Memory-maps the BM25 index for hybrid search. Returns None (vector-only search) if
+    hybrid_search is disabled, the index is missing, or it was built for a different
+    number of records than the n_rows loaded. artifact_key (artifact_version of the index
+    directory) makes a rebuilt index replace the cached one.
+    """
+    if not (_config.get('hybrid_search') or {}).get('enabled', False):
+        return None
+    directory = _config['paths'].get('lexical_index')
+    if not directory or not os.path.exists(os.path.join(directory, "meta.json")):
+        logging.warning(f"Lexical index not found at {directory}. Run preprocessing/5_build_lexical_index.py for hybrid search.")
+        return None
+    try:
+        index = lexical_index.open_lexical_index(directory)
+    except Exception as e:
+        logging.error(f"Error opening lexical index: {e}")
+        return None
+    if len(index) != n_rows:
+        logging.warning(f"Lexical index covers {len(index)} records, processed data has {n_rows}. Rebuild it; using vector search only.")
+        return None
+    return index
+
+@st.cache_resource # Shares one read-only mapping across sessions
+def load_neighbor_table(_config, n_rows, artifact_key=None):
+    """
+    Memory-maps the precomputed neighbor table. Returns None (live search) if it is
+    missing, covers a different number of records, or is older than the FAISS index.
+    artifact_key (versions of the table and of the index) re-runs these checks after a rebuild.
+    """
+    directory = _config['paths'].get('neighbor_table')
+    if not directory or not os.path.exists(os.path.join(directory, "meta.json")):
+        logging.info(f"Neighbor table not found at {directory}. Similar articles are searched live.")
+        return None
+    try:
+        table = neighbor_table.open_neighbor_table(directory)
+    except Exception as e:
+        logging.error(f"Error opening neighbor table: {e}")
+        return None
+    if neighbor_table.is_stale(table, n_rows, _config['paths']['faiss_index']):
+        logging.warning(f"Neighbor table at {directory} is stale. Rebuild it with preprocessing/6_build_neighbor_table.py; searching live.")
+        return None
+    return table
+
+@st.cache_data # Re-read when the processed records change
+def load_cluster_labels(file_path, dataset_key):
+    """
+    Loads the cluster labels of every clustering granularity, as
+    {column: {cluster id: label}}. Empty if the labels file is missing.
+    dataset_key (see dataset_version) ties the cache to the records the clusters belong to.
+    """
+    if not file_path or not os.path.exists(file_path):
+        logging.info(f"Cluster labels not found at {file_path}. Run preprocessing/7_cluster_articles.py to color the map by topic.")
+        return {}
+    try:
+        with open(file_path, 'r') as f:
+            stored = json.load(f)
+        return {column: {cluster['id']: cluster['label'] for cluster in granularity['clusters']} for column, granularity in stored.items()}
+    except Exception as e:
+        logging.error(f"Error loading cluster labels: {e}")
+        return {}
+
+def cluster_columns(df_articles):
+    """Cluster id columns of the loaded records, coarsest granularity first."""
+    return topic_clusters.cluster_columns(df_articles.columns)
+
+@st.cache_resource # One cache shared by all sessions
+def load_query_cache(_config):
+    """Creates the query embedding cache configured under 'query_cache'."""
+    cache_config = _config.get('query_cache') or {}
+    return search_engine.QueryEmbeddingCache(
+        model_name=encoder_backend.encoder_id(_config['embedding_model']), # Backends differ slightly
+        max_size=cache_config.get('max_size', 1024),
+        disk_path=cache_config.get('disk_path'),
+        max_disk_size=cache_config.get('max_disk_size', 100000)
+    )
+
 # Optional: Load full embeddings if needed by some part of the app,
 # though typically search uses the index and query embedding.
-# For very large embeddings, consider memory mapping if direct access is needed.
+# Prefer load_embeddings_mmap, which reads rows on demand from the shared mapping.
 @st.cache_data
 def load_embeddings_array(_config):
-    """Loads the full embeddings array. Use with caution for large datasets."""
+    """Loads the full embeddings array as float32. Use with caution for large datasets."""
     file_path = _config['paths']['embeddings']
     if not os.path.exists(file_path):
-        st.warning(f"Embeddings .npy file not found: {file_path}. Full embeddings not available.")
+        st.warning(f"Embeddings file not found: {file_path}. Full embeddings not available.")
         return None
     try:
-        embeddings = np.load(file_path)
+        embeddings = np.array(embedding_store.open_embeddings(file_path).to_float32())
         logging.info(f"Full embeddings array loaded from {file_path}. Shape: {embeddings.shape}")
         return embeddings
     except Exception as e:
@@ -105,9 +537,30 @@ def load_embeddings_array(_config):
         logging.error(f"Error loading embeddings array: {e}")
         return None
 
+@st.cache_resource # Shares one read-only mapping across sessions
+def load_embeddings_mmap(_config):
+    """
+    Memory-maps the stored embeddings so individual article vectors can be read
+    (as float32) without loading the whole matrix. Returns None if the file is missing,
+    in which case vectors can still be reconstructed from the FAISS index.
+    """
+    file_path = _config['paths']['embeddings']
+    if not os.path.exists(file_path):
+        logging.warning(f"Embeddings file not found: {file_path}. Stored vectors will be read from the FAISS index.")
+        return None
+    try:
+        embeddings = embedding_store.open_embeddings(file_path)
+        if embeddings.model_name and embeddings.model_name != _config['embedding_model']['name']:
+            logging.warning(f"Stored embeddings were made with '{embeddings.model_name}', config uses '{_config['embedding_model']['name']}'.")
+        return embeddings
+    except Exception as e:
+        logging.error(f"Error memory-mapping embeddings: {e}")
+        return None
+
 # Example of how these might be called in app.py:
 # config = load_config()
 # if config:
 #     df_articles = load_processed_records(config['paths']['processed_data'])
-#     faiss_index = load_faiss_index(config)
-#     embedding_model = load_embedding_model(config)
\ No newline at end of file
+#     search_resources = start_search_resources(config) # Returns immediately
+#     if search_resources.ready:
+#         faiss_index, embedding_model = search_resources.index, search_resources.model
\ No newline at end of file
@@ -0,0 +1,173 @@
+# app/embedding_store.py
+"""
+On-disk embedding store shared by the preprocessing stages and the app.
+
+File layout: an 8-byte magic, a little-endian uint32 header length, a JSON header
+(dtype, dimension, row count, model name and, for int8, per-dimension scales),
+zero padding to a 64-byte boundary, then the row-major vector data.
+
+Stores are always opened memory-mapped, so several processes share one copy
+through the page cache. Reads return float32, converting only the rows asked for.
+Plain float32 .npy files are read the same way, and written when the configured path
+ends in .npy (the default); a path with another suffix (e.g. .emb) opts into the store
+format, which is needed for the float16 and int8 dtypes.
+"""
+import json
+import logging
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b"SAEEMB01"
+DATA_ALIGNMENT = 64
+SUPPORTED_DTYPES = ["float32", "float16", "int8"]
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def compute_int8_scales(embeddings, block_size=65536):
+    """Per-dimension symmetric scales (max |x| / 127), computed one block at a time."""
+    absmax = np.zeros(embeddings.shape[1], dtype=np.float32)
+    for start in range(0, embeddings.shape[0], block_size):
+        block = np.asarray(embeddings[start:start + block_size], dtype=np.float32)
+        absmax = np.maximum(absmax, np.abs(block).max(axis=0))
+    scales = absmax / 127.0
+    scales[scales == 0] = 1.0
+    return scales
+
+def quantize(block, dtype, scales=None):
+    """Converts a float block to the storage dtype."""
+    if dtype == "int8":
+        return np.clip(np.rint(block / scales), -127, 127).astype(np.int8)
+    return np.asarray(block, dtype=dtype)
+
+def write_embeddings(file_path, embeddings, dtype="float32", model_name=None, block_size=65536):
+    """
+    Writes embeddings (an array, memmap or EmbeddingStore) to file_path in the store
+    format, block by block so the input never has to be fully in memory.
+    A file_path ending in .npy gets a plain float32 .npy file instead.
+    Writes to a temporary file first so readers never see a partial store.
+    """
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"Unsupported embedding dtype '{dtype}'. Choose one of {SUPPORTED_DTYPES}.")
+    n_rows, dimension = embeddings.shape
+    if str(file_path).lower().endswith(".npy"):
+        if dtype != "float32":
+            raise ValueError(f"{file_path} is a .npy file, which holds float32 only. Use a store path (e.g. .emb) for dtype '{dtype}'.")
+        write_npy(file_path, embeddings, block_size)
+        return
+    scales = compute_int8_scales(embeddings, block_size) if dtype == "int8" else None
+
+    header = {
+        'format_version': 1,
+        'dtype': dtype,
+        'dimension': int(dimension),
+        'rows': int(n_rows),
+        'model_name': model_name,
+    }
+    if scales is not None:
+        header['scales'] = scales.tolist()
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_offset = len(MAGIC) + 4 + len(header_bytes)
+    padding = (-data_offset) % DATA_ALIGNMENT
+
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b"\0" * padding)
+        for start in range(0, n_rows, block_size):
+            block = np.asarray(embeddings[start:start + block_size], dtype=np.float32)
+            f.write(np.ascontiguousarray(quantize(block, dtype, scales)).tobytes())
+    os.replace(tmp_path, file_path)
+    logging.info(f"Embeddings written to {file_path} ({n_rows} x {dimension}, {dtype}).")
+
+def write_npy(file_path, embeddings, block_size=65536):
+    """Writes embeddings to a float32 .npy file, block by block, through a temporary file."""
+    tmp_path = f"{file_path}.tmp"
+    out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=tuple(embeddings.shape))
+    for start in range(0, embeddings.shape[0], block_size):
+        out[start:start + block_size] = np.asarray(embeddings[start:start + block_size], dtype=np.float32)
+    out.flush()
+    del out
+    os.replace(tmp_path, file_path)
+    logging.info(f"Embeddings written to {file_path} ({embeddings.shape[0]} x {embeddings.shape[1]}, float32 .npy).")
+
+class EmbeddingStore:
+    """
+    Read-only, memory-mapped view of a stored embedding matrix.
+    Indexing (store[i], store[a:b], store[row_ids]) returns float32 rows, so it can be
+    used wherever a float32 array of embeddings is expected, without loading the whole file.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = str(file_path)
+        with open(self.file_path, 'rb') as f:
+            magic = f.read(len(MAGIC))
+            if magic == MAGIC:
+                header_length = struct.unpack('<I', f.read(4))[0]
+                self.header = json.loads(f.read(header_length).decode('utf-8'))
+                data_offset = len(MAGIC) + 4 + header_length
+                data_offset += (-data_offset) % DATA_ALIGNMENT
+        if magic == MAGIC:
+            self.raw = np.memmap(
+                self.file_path, dtype=self.header['dtype'], mode='r', offset=data_offset,
+                shape=(self.header['rows'], self.header['dimension'])
+            )
+        elif magic.startswith(b"\x93NUMPY"): # Legacy .npy output
+            self.raw = np.load(self.file_path, mmap_mode='r')
+            self.header = {
+                'format_version': 0,
+                'dtype': str(self.raw.dtype),
+                'dimension': int(self.raw.shape[1]),
+                'rows': int(self.raw.shape[0]),
+                'model_name': None,
+            }
+        else:
+            raise ValueError(f"{self.file_path} is neither an embedding store nor a .npy file.")
+        self.scales = np.asarray(self.header['scales'], dtype=np.float32) if 'scales' in self.header else None
+
+    @property
+    def shape(self):
+        return self.raw.shape
+
+    @property
+    def dtype(self):
+        """Dtype of the returned rows (always float32), not the storage dtype."""
+        return np.dtype(np.float32)
+
+    @property
+    def model_name(self):
+        return self.header.get('model_name')
+
+    def __len__(self):
+        return self.raw.shape[0]
+
+    def __getitem__(self, key):
+        block = self.raw[key]
+        if self.scales is not None:
+            return block.astype(np.float32) * self.scales
+        return np.asarray(block, dtype=np.float32)
+
+    def iter_blocks(self, block_size=65536):
+        """Yields (start_row, float32 block) pairs covering the whole store."""
+        for start in range(0, len(self), block_size):
+            yield start, self[start:start + block_size]
+
+    def to_float32(self):
+        """
+        Returns the full matrix as float32: a view of the mapping for float32 stores,
+        a decoded in-memory copy otherwise. Only for consumers that need every row at once.
+        """
+        return self[:]
+
+def open_embeddings(file_path):
+    """Opens an embedding store (or legacy .npy) memory-mapped."""
+    store = EmbeddingStore(file_path)
+    logging.info(
+        f"Embeddings memory-mapped from {file_path}. Shape: {store.shape}, "
+        f"stored as {store.header['dtype']}, model: {store.model_name or 'unknown'}"
+    )
+    return store
@@ -0,0 +1,124 @@
+# app/encoder_backend.py
+"""
+Query encoder backends, selected by embedding_model.backend in config.yaml:
+
+- "torch": the SentenceTransformer model as published (full-precision PyTorch). This is the
+  reference; the corpus embeddings are always made with it (preprocessing/2).
+- "onnx": the same model exported to ONNX and run with ONNX Runtime.
+- "onnx_int8": the ONNX export with dynamic INT8 quantization of the weights, tuned for the
+  CPU's instruction set (embedding_model.quantization).
+
+ONNX backends need optimum[onnxruntime]. The export is written once to
+embedding_model.onnx_dir and reused. Query vectors from an ONNX backend differ slightly from
+the reference; check the agreement and the speedup with benchmarks/encoder_benchmark.py
+before switching.
+"""
+import logging
+import platform
+import re
+from pathlib import Path
+
+import numpy as np
+
+BACKENDS = ("torch", "onnx", "onnx_int8")
+QUANTIZATION_CONFIGS = ("arm64", "avx2", "avx512", "avx512_vnni")
+
+# Get the parent directory of the current script
+parent_dir = Path(__file__).parent.parent
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def default_quantization():
+    """Picks the dynamic quantization config matching this CPU (x86 flags from /proc/cpuinfo)."""
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "arm64"
+    try:
+        with open('/proc/cpuinfo') as f:
+            flags = next((line.split(':', 1)[1].split() for line in f if line.startswith('flags')), [])
+    except OSError:
+        flags = []
+    if 'avx512_vnni' in flags:
+        return "avx512_vnni"
+    if 'avx512f' in flags:
+        return "avx512"
+    return "avx2"
+
+def backend_settings(model_config):
+    """(backend, quantization) for an embedding_model config section; quantization is None unless onnx_int8."""
+    backend = model_config.get('backend') or "torch"
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown encoder backend '{backend}'. Expected one of {', '.join(BACKENDS)}.")
+    quantization = None
+    if backend == "onnx_int8":
+        quantization = model_config.get('quantization') or default_quantization()
+        if quantization not in QUANTIZATION_CONFIGS:
+            raise ValueError(f"Unknown quantization config '{quantization}'. Expected one of {', '.join(QUANTIZATION_CONFIGS)}.")
+    return backend, quantization
+
+def encoder_id(model_config):
+    """
+    Identifies the model and runtime that produce query vectors, e.g. for query cache keys.
+    The reference backend keeps the plain model name, so existing cache entries stay valid.
+    """
+    backend, quantization = backend_settings(model_config)
+    if backend == "torch":
+        return model_config['name']
+    return f"{model_config['name']}@{backend}" + (f"-{quantization}" if quantization else "")
+
+def onnx_model_dir(model_config):
+    """Directory holding the ONNX export of the configured model (one subdirectory per model)."""
+    base_dir = Path(model_config.get('onnx_dir') or parent_dir / "data" / "onnx_encoder")
+    return base_dir / re.sub(r'[^\w.-]+', '__', model_config['name']).strip('_')
+
+def onnx_file_name(quantization=None):
+    """Model file inside the export directory, as named by sentence_transformers' exporters."""
+    return f"onnx/model_qint8_{quantization}.onnx" if quantization else "onnx/model.onnx"
+
+def export_onnx_model(model_name, output_dir, quantization=None):
+    """
+    Exports model_name to ONNX under output_dir (onnx/model.onnx plus tokenizer and pooling
+    config) and, if quantization is given, a dynamically INT8-quantized copy next to it.
+    """
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+    output_dir = Path(output_dir)
+    if not (output_dir / onnx_file_name()).exists():
+        logging.info(f"Exporting '{model_name}' to ONNX in {output_dir}...")
+        model = SentenceTransformer(model_name, backend="onnx") # Converts from PyTorch if the repo has no ONNX file
+        model.save(str(output_dir))
+    if quantization and not (output_dir / onnx_file_name(quantization)).exists():
+        logging.info(f"Quantizing the ONNX export of '{model_name}' to INT8 ({quantization})...")
+        model = SentenceTransformer(str(output_dir), backend="onnx", model_kwargs={'file_name': onnx_file_name()})
+        export_dynamic_quantized_onnx_model(model, quantization, str(output_dir))
+    return output_dir / onnx_file_name(quantization)
+
+def load_encoder(model_config):
+    """
+    Loads the query encoder for an embedding_model config section, exporting the ONNX model
+    on first use. The result has the SentenceTransformer encode API. Raises on failure.
+    """
+    from sentence_transformers import SentenceTransformer
+    backend, quantization = backend_settings(model_config)
+    model_name = model_config['name']
+    if backend == "torch":
+        model = SentenceTransformer(model_name)
+    else:
+        output_dir = onnx_model_dir(model_config)
+        export_onnx_model(model_name, output_dir, quantization)
+        model = SentenceTransformer(str(output_dir), backend="onnx", model_kwargs={'file_name': onnx_file_name(quantization)})
+    logging.info(f"Query encoder '{encoder_id(model_config)}' loaded successfully.")
+    return model
+
+def cosine_agreement(reference_vectors, candidate_vectors):
+    """
+    Row-wise cosine similarity between the vectors of the reference encoder and a candidate
+    for the same texts. Returns the mean, minimum and 1st percentile.
+    """
+    reference = np.asarray(reference_vectors, dtype=np.float32)
+    candidate = np.asarray(candidate_vectors, dtype=np.float32)
+    norms = np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    cosines = (reference * candidate).sum(axis=1) / np.maximum(norms, 1e-12)
+    return {
+        'mean': float(cosines.mean()),
+        'min': float(cosines.min()),
+        'p1': float(np.percentile(cosines, 1)),
+    }
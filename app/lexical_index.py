@@ -0,0 +1,172 @@
+# app/lexical_index.py
+"""
+BM25 inverted index shared by preprocessing/5_build_lexical_index.py (writer) and the app
+(reader).
+
+Directory layout, all arrays as .npy so they are memory-mapped at load:
+- terms.npy: the vocabulary, sorted (fixed-width unicode); a term's id is its position.
+- offsets.npy: int64, len(terms) + 1; postings of term t are [offsets[t], offsets[t + 1]).
+- doc_ids.npy: int32 row ids of the processed records.
+- impacts.npy: float16 BM25 score of the term in that document (idf and length
+  normalization included), so a query only sums impacts.
+- meta.json: corpus size, BM25 parameters, fields and weights.
+Each term's postings are sorted by impact, highest first. A query scores only the first
+max_postings of each of its terms, which bounds its cost independently of corpus size;
+terms rarer than that are scored exactly.
+"""
+import json
+import logging
+import os
+import re
+import shutil
+
+import numpy as np
+
+FORMAT_VERSION = 1
+MAX_TERM_LENGTH = 40
+# Words, numbers and hyphen/dot compounds such as "il-6", "covid-19" or "h5n1"
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-.][a-z0-9]+)*")
+
+# scipy and scikit-learn are imported inside count_batch_terms: only the preprocessing
+# stages count terms, and the app imports this module at startup.
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def tokenize(text):
+    """
+    Lowercased tokens of text. Compounds are kept whole and also split into their parts,
+    so "il-6" matches queries for "il-6" and for "il 6". Used at build and query time.
+    """
+    tokens = []
+    for token in TOKEN_PATTERN.findall(str(text).lower()):
+        if len(token) > MAX_TERM_LENGTH:
+            continue
+        tokens.append(token)
+        if '-' in token or '.' in token:
+            tokens.extend(part for part in re.split(r"[-.]", token) if part)
+    return tokens
+
+def field_texts(column):
+    """Text of one field per row; list fields (authors) are joined, missing values become ''."""
+    return [" ".join(map(str, value)) if isinstance(value, (list, tuple, np.ndarray)) else ("" if value is None else str(value)) for value in column]
+
+def count_batch_terms(texts, vocabulary, tokenizer=tokenize):
+    """
+    Term counts of a batch of texts (English stop words removed) as a sparse COO matrix
+    of shape (len(texts), len(vocabulary)) whose columns are global term ids: vocabulary
+    maps term -> id across batches, and terms first seen in this batch are added to it.
+    Returns None if no text of the batch has a term.
+    """
+    from scipy import sparse
+    from sklearn.feature_extraction.text import CountVectorizer, ENGLISH_STOP_WORDS
+    vectorizer = CountVectorizer(tokenizer=tokenizer, token_pattern=None, lowercase=False, stop_words=list(ENGLISH_STOP_WORDS), dtype=np.float32)
+    try:
+        counts = vectorizer.fit_transform(texts).tocoo()
+    except ValueError: # Every text is empty or only stop words
+        return None
+    # Map this batch's vocabulary onto the global one
+    global_ids = np.array([vocabulary.setdefault(term, len(vocabulary)) for term in vectorizer.get_feature_names_out()], dtype=np.int64)
+    return sparse.coo_matrix((counts.data, (counts.row, global_ids[counts.col])), shape=(len(texts), len(vocabulary)))
+
+def bm25_impacts(term_frequencies, doc_lengths, document_frequencies, n_docs, avgdl, k1=1.2, b=0.75):
+    """
+    BM25 term-document scores. doc_lengths (of the posting's document) and
+    document_frequencies (of the posting's term) are aligned with term_frequencies.
+    """
+    avgdl = max(avgdl, 1e-9)
+    idf = np.log1p((n_docs - document_frequencies + 0.5) / (document_frequencies + 0.5))
+    tf = np.asarray(term_frequencies, dtype=np.float32)
+    return idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_lengths / avgdl))
+
+def write_lexical_index(directory, terms, offsets, doc_ids, impacts, meta):
+    """
+    Writes an index to directory. Writes to a sibling temporary directory first and swaps it
+    in, so readers never see a partial index.
+    """
+    directory = str(directory)
+    tmp_directory = f"{directory}.tmp"
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+    np.save(os.path.join(tmp_directory, "terms.npy"), np.asarray(terms, dtype=f"<U{MAX_TERM_LENGTH}"))
+    np.save(os.path.join(tmp_directory, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    np.save(os.path.join(tmp_directory, "doc_ids.npy"), np.asarray(doc_ids, dtype=np.int32))
+    np.save(os.path.join(tmp_directory, "impacts.npy"), np.asarray(impacts, dtype=np.float16))
+    with open(os.path.join(tmp_directory, "meta.json"), 'w') as f:
+        json.dump(dict(meta, format_version=FORMAT_VERSION), f, indent=2)
+
+    old_directory = f"{directory}.old"
+    shutil.rmtree(old_directory, ignore_errors=True)
+    if os.path.exists(directory):
+        os.replace(directory, old_directory)
+    os.replace(tmp_directory, directory)
+    shutil.rmtree(old_directory, ignore_errors=True)
+    logging.info(f"Lexical index written to {directory}: {len(terms)} terms, {len(doc_ids)} postings.")
+
+class LexicalIndex:
+    """Read-only, memory-mapped BM25 index (see the module docstring for the layout)."""
+
+    def __init__(self, directory):
+        self.directory = str(directory)
+        with open(os.path.join(self.directory, "meta.json"), 'r') as f:
+            self.meta = json.load(f)
+        if self.meta.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported lexical index format version {self.meta.get('format_version')} in {self.directory}.")
+        self.terms = np.load(os.path.join(self.directory, "terms.npy"), mmap_mode='r')
+        self.offsets = np.load(os.path.join(self.directory, "offsets.npy"), mmap_mode='r')
+        self.doc_ids = np.load(os.path.join(self.directory, "doc_ids.npy"), mmap_mode='r')
+        self.impacts = np.load(os.path.join(self.directory, "impacts.npy"), mmap_mode='r')
+        self.n_docs = int(self.meta['n_docs'])
+
+    def __len__(self):
+        return self.n_docs
+
+    def term_ids(self, tokens):
+        """Ids of the distinct tokens that are in the vocabulary."""
+        tokens = sorted(set(tokens))
+        if not tokens:
+            return np.array([], dtype=np.int64)
+        positions = np.searchsorted(self.terms, tokens)
+        found = [position for token, position in zip(tokens, positions) if position < len(self.terms) and self.terms[position] == token]
+        return np.array(found, dtype=np.int64)
+
+    def search(self, query_text, top_k=100, allowed_ids=None, max_postings=10000):
+        """
+        BM25 top_k for query_text. allowed_ids (sorted row ids, e.g. a filter view) restricts
+        the results. Each query term contributes its max_postings highest-impact documents.
+        Returns (scores, row ids), best first; both empty if no query term is indexed.
+        """
+        term_ids = self.term_ids(tokenize(query_text))
+        if len(term_ids) == 0:
+            return np.array([], dtype=np.float32), np.array([], dtype=np.int64)
+
+        doc_ids, impacts = [], []
+        for term_id in term_ids:
+            start = int(self.offsets[term_id])
+            stop = min(int(self.offsets[term_id + 1]), start + max_postings) if max_postings else int(self.offsets[term_id + 1])
+            doc_ids.append(self.doc_ids[start:stop])
+            impacts.append(self.impacts[start:stop])
+        doc_ids = np.concatenate(doc_ids)
+        impacts = np.concatenate(impacts).astype(np.float32)
+
+        if len(term_ids) > 1: # Sum the impacts of documents that match several terms
+            doc_ids, inverse = np.unique(doc_ids, return_inverse=True)
+            impacts = np.bincount(inverse, weights=impacts).astype(np.float32)
+        if allowed_ids is not None:
+            if len(allowed_ids) == 0:
+                return np.array([], dtype=np.float32), np.array([], dtype=np.int64)
+            positions = np.minimum(np.searchsorted(allowed_ids, doc_ids), len(allowed_ids) - 1)
+            allowed = allowed_ids[positions] == doc_ids
+            doc_ids, impacts = doc_ids[allowed], impacts[allowed]
+
+        if len(doc_ids) > top_k:
+            best = np.argpartition(-impacts, top_k - 1)[:top_k]
+            doc_ids, impacts = doc_ids[best], impacts[best]
+        order = np.lexsort((doc_ids, -impacts)) # Ties broken by row id, for stable results
+        return impacts[order], doc_ids[order].astype(np.int64)
+
+def open_lexical_index(directory):
+    """Opens the index in directory memory-mapped."""
+    index = LexicalIndex(directory)
+    logging.info(f"Lexical index opened from {directory}: {len(index.terms)} terms, {index.n_docs} documents.")
+    return index
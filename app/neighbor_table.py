@@ -0,0 +1,114 @@
+# app/neighbor_table.py
+"""
+Precomputed nearest-neighbor table shared by preprocessing/6_build_neighbor_table.py
+(writer) and the app (reader).
+
+Directory layout, memory-mapped at load:
+- ids.npy: int32 (n_rows, k), the k nearest other articles of each row, best first;
+  -1 where the index returned fewer than k results.
+- scores.npy: float16 (n_rows, k), the matching FAISS scores (inner product, or squared
+  L2 distance, as search_faiss_index returns them).
+- meta.json: n_rows, k, metric and the index/embeddings file versions it was built from.
+The arrays are created with their final shape up front and filled chunk by chunk, so
+building never holds more than one chunk of results in memory.
+"""
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def create_table(directory, n_rows, k):
+    """
+    Creates the arrays of a new table in a temporary sibling of directory and returns its
+    path. Fill them with write_rows (from any number of processes), then call finish_table.
+    """
+    tmp_directory = f"{directory}.tmp"
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+    ids = np.lib.format.open_memmap(os.path.join(tmp_directory, "ids.npy"), mode='w+', dtype=np.int32, shape=(n_rows, k))
+    scores = np.lib.format.open_memmap(os.path.join(tmp_directory, "scores.npy"), mode='w+', dtype=np.float16, shape=(n_rows, k))
+    ids[:] = -1
+    ids.flush()
+    del ids, scores
+    return tmp_directory
+
+def write_rows(tmp_directory, start, ids, scores):
+    """Writes the neighbors of rows [start, start + len(ids)) into a table being built."""
+    for name, values in (("ids.npy", ids), ("scores.npy", scores)):
+        table = np.load(os.path.join(tmp_directory, name), mmap_mode='r+')
+        table[start:start + len(values)] = values
+        table.flush()
+        del table
+
+def finish_table(directory, meta):
+    """Writes meta.json and swaps the finished table in, so readers never see a partial one."""
+    directory = str(directory)
+    tmp_directory = f"{directory}.tmp"
+    with open(os.path.join(tmp_directory, "meta.json"), 'w') as f:
+        json.dump(dict(meta, format_version=FORMAT_VERSION), f, indent=2)
+    old_directory = f"{directory}.old"
+    shutil.rmtree(old_directory, ignore_errors=True)
+    if os.path.exists(directory):
+        os.replace(directory, old_directory)
+    os.replace(tmp_directory, directory)
+    shutil.rmtree(old_directory, ignore_errors=True)
+    logging.info(f"Neighbor table written to {directory}: {meta.get('n_rows')} rows x {meta.get('k')} neighbors.")
+
+class NeighborTable:
+    """Read-only, memory-mapped neighbor table (see the module docstring for the layout)."""
+
+    def __init__(self, directory):
+        self.directory = str(directory)
+        with open(os.path.join(self.directory, "meta.json"), 'r') as f:
+            self.meta = json.load(f)
+        if self.meta.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported neighbor table format version {self.meta.get('format_version')} in {self.directory}.")
+        self.ids = np.load(os.path.join(self.directory, "ids.npy"), mmap_mode='r')
+        self.scores = np.load(os.path.join(self.directory, "scores.npy"), mmap_mode='r')
+        self.k = self.ids.shape[1]
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+    def neighbors(self, row_id, top_k=10, allowed_ids=None):
+        """
+        The stored top_k neighbors of row_id as (scores, row ids), restricted to allowed_ids
+        (sorted row ids, e.g. a filter view) if given. Returns (None, None) when the table
+        cannot answer exactly: top_k exceeds the stored k, or a filter leaves fewer than
+        top_k of the stored neighbors. Callers then search live.
+        """
+        row_id = int(row_id)
+        if top_k > self.k or not 0 <= row_id < len(self):
+            return None, None
+        ids = np.asarray(self.ids[row_id], dtype=np.int64)
+        scores = np.asarray(self.scores[row_id], dtype=np.float32)
+        exhaustive = ids[-1] < 0 # Fewer than k results: every other article is already listed
+        keep = ids >= 0
+        if allowed_ids is not None:
+            if len(allowed_ids) == 0:
+                return np.array([], dtype=np.float32), np.array([], dtype=np.int64)
+            positions = np.minimum(np.searchsorted(allowed_ids, ids), len(allowed_ids) - 1)
+            keep &= allowed_ids[positions] == ids
+            if keep.sum() < top_k and not exhaustive: # Rows beyond the stored k may qualify
+                return None, None
+        return scores[keep][:top_k], ids[keep][:top_k]
+
+def is_stale(table, n_rows, index_path):
+    """
+    Whether the table no longer matches the data: it covers a different number of rows
+    than n_rows, or the FAISS index at index_path was rewritten after the table was built.
+    """
+    return len(table) != n_rows or (os.path.exists(index_path) and os.path.getmtime(index_path) > table.meta.get('index_mtime', 0))
+
+def open_neighbor_table(directory):
+    """Opens the table in directory memory-mapped."""
+    table = NeighborTable(directory)
+    logging.info(f"Neighbor table opened from {directory}: {len(table)} rows x {table.k} neighbors.")
+    return table
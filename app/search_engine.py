@@ -1,15 +1,138 @@
 # app/search_engine.py
 import numpy as np
 import logging
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# faiss is imported inside the functions that use it: the app imports this module at
+# startup, but the index (and with it faiss) is loaded in the background.
 
 # Configure basic logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def embed_query(query_text, model, query_prefix=""):
+def normalize_query(query_text):
+    """
+    Normalizes a query for caching: lowercase and collapse whitespace.
+    Articles are lowercased the same way in preprocessing/1_clean_data.py.
+    """
+    return re.sub(r'\s+', ' ', query_text.lower()).strip()
+
+class QueryEmbeddingCache:
+    """
+    Bounded LRU cache of query embeddings keyed on (model name, prefix, normalized query).
+    Optionally backed by a SQLite file so entries survive restarts and are shared
+    between processes; every prune_interval writes (and on open) the file is trimmed to
+    max_disk_size entries, dropping the oldest-written first. Thread-safe, so one
+    instance can serve all Streamlit sessions. Returned embeddings are copies.
+    """
+
+    def __init__(self, model_name, max_size=1024, disk_path=None, max_disk_size=100000, prune_interval=256):
+        self.model_name = model_name
+        self.max_size = max_size
+        self.max_disk_size = max_disk_size
+        self.prune_interval = prune_interval
+        self._disk_writes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if disk_path:
+            try:
+                self._db = sqlite3.connect(str(disk_path), check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                    "model TEXT, prefix TEXT, query TEXT, dim INTEGER, vector BLOB, "
+                    "PRIMARY KEY (model, prefix, query))"
+                )
+                self._prune_disk()
+                self._db.commit()
+                logging.info(f"Query embedding cache persisted to {disk_path}")
+            except Exception as e:
+                logging.error(f"Could not open query embedding cache at {disk_path}: {e}. Using memory only.")
+                self._db = None
+
+    def get(self, prefix, normalized_query):
+        """Returns the cached (1, d) float32 embedding, or None on a miss."""
+        key = (self.model_name, prefix, normalized_query)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key].copy()
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT dim, vector FROM query_embeddings WHERE model = ? AND prefix = ? AND query = ?", key
+                ).fetchone()
+                if row is not None:
+                    embedding = np.frombuffer(row[1], dtype=np.float32).reshape(1, row[0])
+                    self._remember(key, embedding)
+                    self.hits += 1
+                    return embedding.copy()
+            self.misses += 1
+            return None
+
+    def put(self, prefix, normalized_query, embedding):
+        """Stores a (1, d) float32 embedding in memory and, if configured, on disk."""
+        key = (self.model_name, prefix, normalized_query)
+        embedding = np.array(embedding, dtype=np.float32, order='C') # Own copy, unaffected by the caller
+        with self._lock:
+            self._remember(key, embedding)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?, ?, ?)",
+                        key + (embedding.shape[1], embedding.tobytes())
+                    )
+                    self._disk_writes += 1
+                    if self._disk_writes % self.prune_interval == 0:
+                        self._prune_disk()
+                    self._db.commit()
+                except Exception as e:
+                    logging.warning(f"Could not persist query embedding: {e}")
+
+    def _prune_disk(self):
+        """Deletes all but the max_disk_size most recently written rows (REPLACE gives a row a new rowid)."""
+        self._db.execute(
+            "DELETE FROM query_embeddings WHERE rowid IN "
+            "(SELECT rowid FROM query_embeddings ORDER BY rowid DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_size,)
+        )
+
+    def _remember(self, key, embedding):
+        embedding.flags.writeable = False # Shared by later hits, which get copies
+        self._entries[key] = embedding
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        """Returns hit/miss counters and current size, for sizing the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+            }
+
+def embed_query(query_text, model, query_prefix="", cache=None):
     """
     Generates an embedding for a single query string using the provided model.
     Adds an optional prefix (e.g., for e5 models).
+    If a QueryEmbeddingCache is given, repeated queries skip the model entirely. The
+    normalized text is only the cache key; the model always sees the query as typed.
     """
+    if cache is not None:
+        cache_key = normalize_query(query_text)
+        cached_embedding = cache.get(query_prefix, cache_key)
+        if cached_embedding is not None:
+            logging.info(f"Query '{query_text}' served from embedding cache.")
+            return cached_embedding
     if not model:
         logging.error("Embedding model not provided to embed_query.")
         return None
@@ -18,14 +141,130 @@ def embed_query(query_text, model, query_prefix=""):
         text_to_embed = query_prefix + query_text if query_prefix else query_text
         query_embedding = model.encode([text_to_embed]) # model.encode expects a list
         logging.info(f"Query '{query_text}' embedded successfully. Shape: {query_embedding.shape}")
-        return query_embedding.astype(np.float32) # Ensure float32 for FAISS
+        query_embedding = query_embedding.astype(np.float32) # Ensure float32 for FAISS
+        if cache is not None:
+            cache.put(query_prefix, cache_key, query_embedding)
+        return query_embedding
     except Exception as e:
         logging.error(f"Error embedding query '{query_text}': {e}")
         return None
 
-def search_faiss_index(query_embedding, index, top_k=10):
+def embed_queries(query_texts, model, query_prefix="", cache=None):
+    """
+    Batched embed_query: returns an (n, d) float32 array for n query strings. Cached
+    queries are taken from the QueryEmbeddingCache; the rest are encoded in a single
+    model.encode call, which costs far less per query than one call each.
+    Raises on encoding errors, since a batch has no single query to report as failed.
+    """
+    keys = [normalize_query(text) if cache is not None else text for text in query_texts]
+    embeddings = [cache.get(query_prefix, key) if cache is not None else None for key in keys]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        if not model:
+            raise ValueError("Embedding model not provided to embed_queries.")
+        # Texts with the same cache key are encoded once, as the first of them was typed
+        first_text = {}
+        for i in missing:
+            first_text.setdefault(keys[i], query_texts[i])
+        unique_keys = list(first_text)
+        encoded = model.encode([query_prefix + first_text[key] for key in unique_keys]).astype(np.float32)
+        by_key = {key: encoded[j:j + 1] for j, key in enumerate(unique_keys)}
+        for i in missing:
+            embeddings[i] = by_key[keys[i]]
+        if cache is not None:
+            for key, embedding in by_key.items():
+                cache.put(query_prefix, key, embedding)
+        logging.info(f"Embedded {len(unique_keys)} of {len(query_texts)} queries in one batch.")
+    if not embeddings:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.vstack(embeddings)
+
+def faiss_mmap_flags():
+    """
+    IO flags for reading an index memory-mapped and read-only. FAISS versions with
+    IO_FLAG_MMAP_IFC map both flat code storage (IndexFlat*/HNSW*) and IVF inverted lists;
+    older versions (e.g. the pinned 1.7.4) only support mapping IVF lists through
+    IO_FLAG_MMAP, and read other index types into memory. The two flags cannot be combined.
+    """
+    import faiss
+    mmap_flag = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP)
+    return mmap_flag | faiss.IO_FLAG_READ_ONLY
+
+def read_faiss_index(file_path, mmap=False):
+    """
+    Reads a FAISS index. With mmap=True the vector data stays in the file and is paged in
+    on demand, so processes on one host that map the same file share a single copy
+    through the page cache. Falls back to a regular read if the index type cannot be mapped.
+    Returns (index, mmapped); mmapped is False when the index ended up in memory.
+    """
+    import faiss
+    if mmap:
+        try:
+            index = faiss.read_index(str(file_path), faiss_mmap_flags())
+        except RuntimeError as e:
+            logging.warning(f"Could not memory-map FAISS index {file_path} ({e}). Reading it into memory instead.")
+        else:
+            if hasattr(faiss, 'IO_FLAG_MMAP_IFC') or is_ivf_index(index):
+                return index, True
+            logging.warning(f"This FAISS version only memory-maps IVF indexes; {file_path} was read into memory.")
+            return index, False
+    return faiss.read_index(str(file_path)), False
+
+def is_ivf_index(index):
+    """Whether index is, or wraps, an IVF index (whose inverted lists IO_FLAG_MMAP maps)."""
+    import faiss
+    try:
+        faiss.extract_index_ivf(index)
+        return True
+    except RuntimeError:
+        return False
+
+def apply_search_params(index, search_params):
+    """
+    Applies runtime search parameters (e.g. {'nprobe': 16} for IVF, {'efSearch': 64}
+    for HNSW), as tuned by preprocessing/3_build_index.py, to a loaded index.
+    """
+    import faiss
+    parameter_space = faiss.ParameterSpace()
+    for name, value in (search_params or {}).items():
+        try:
+            parameter_space.set_index_parameter(index, name, value)
+            logging.info(f"Applied FAISS search parameter {name}={value}.")
+        except Exception as e:
+            logging.warning(f"Could not apply FAISS search parameter {name}={value}: {e}")
+
+def build_id_selector(allowed_ids):
+    """
+    Builds a FAISS IDSelector from an array of allowed row ids so the
+    top-k is computed inside that subset rather than post-filtered.
+    """
+    import faiss
+    allowed_ids = np.ascontiguousarray(allowed_ids, dtype=np.int64)
+    return faiss.IDSelectorBatch(allowed_ids)
+
+def filtered_search_params(index, selector):
+    """
+    Search parameters restricting index.search to the rows of selector. IVF and HNSW
+    indexes reject plain SearchParameters, so each gets its own type, carrying the
+    index's current (tuned) nprobe or efSearch; IndexPreTransform wraps its inner index's.
+    """
+    import faiss
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexPreTransform):
+        inner_params = filtered_search_params(index.index, selector)
+        params = faiss.SearchParametersPreTransform(index_params=inner_params)
+        params.inner_params = inner_params # Keep a reference while FAISS uses it
+        return params
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+def search_faiss_index(query_embedding, index, top_k=10, allowed_ids=None):
     """
     Searches the FAISS index for the top_k nearest neighbors to the query_embedding.
+    If allowed_ids is given, only those rows are considered (filter-aware search).
     Returns distances and indices of the neighbors.
     """
     if query_embedding is None:
@@ -37,20 +276,165 @@ def search_faiss_index(query_embedding, index, top_k=10):
     if index.ntotal == 0:
         logging.warning("FAISS index is empty. Cannot perform search.")
         return np.array([]), np.array([])
+    if allowed_ids is not None and len(allowed_ids) == 0:
+        logging.info("Filter excludes every article. Skipping search.")
+        return np.array([]), np.array([])
 
     try:
         # Ensure query_embedding is 2D (batch of 1)
         if query_embedding.ndim == 1:
             query_embedding = np.expand_dims(query_embedding, axis=0)
 
-        distances, indices = index.search(query_embedding, top_k)
-        logging.info(f"FAISS search complete. Found {len(indices[0])} neighbors.")
+        if allowed_ids is not None:
+            selector = build_id_selector(allowed_ids) # Keep a reference while FAISS uses it
+            distances, indices = index.search(query_embedding, top_k, params=filtered_search_params(index, selector))
+        else:
+            distances, indices = index.search(query_embedding, top_k)
         # distances and indices are 2D arrays (batch_size, top_k), extract first row
-        return distances[0], indices[0]
+        # FAISS pads with -1 when fewer than top_k rows pass the filter
+        found = indices[0] >= 0
+        logging.info(f"FAISS search complete. Found {int(found.sum())} neighbors.")
+        return distances[0][found], indices[0][found]
     except Exception as e:
         logging.error(f"Error searching FAISS index: {e}")
         return None, None
 
+def search_faiss_index_batch(query_embeddings, index, top_k=10):
+    """
+    Searches the FAISS index for several queries in one index.search call, which
+    amortizes its per-call overhead and lets FAISS scan the vectors once for the batch.
+    top_k is one value or one per query (each query then gets its own number of results).
+    Returns a list of (distances, indices) per query, padding (-1) removed.
+    """
+    query_embeddings = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+    top_ks = np.broadcast_to(np.asarray(top_k, dtype=np.int64), (len(query_embeddings),))
+    if len(query_embeddings) == 0 or index.ntotal == 0:
+        return [(np.array([], dtype=np.float32), np.array([], dtype=np.int64)) for _ in range(len(query_embeddings))]
+    distances, indices = index.search(query_embeddings, int(top_ks.max()))
+    results = []
+    for row_distances, row_indices, k in zip(distances, indices, top_ks):
+        found = row_indices[:k] >= 0
+        results.append((row_distances[:k][found], row_indices[:k][found]))
+    return results
+
+def get_stored_vector(row_id, index, embeddings=None):
+    """
+    Returns the stored embedding of a corpus row as a (1, d) float32 array.
+    Reads from the (memory-mapped) embeddings array when available, otherwise
+    reconstructs the vector from the FAISS index.
+    """
+    try:
+        if embeddings is not None:
+            vector = np.asarray(embeddings[int(row_id)], dtype=np.float32)
+        else:
+            vector = index.reconstruct(int(row_id))
+        return np.expand_dims(vector, axis=0)
+    except Exception as e:
+        logging.error(f"Error retrieving stored vector for row {row_id}: {e}")
+        return None
+
+def search_by_row(row_id, index, top_k=10, embeddings=None, allowed_ids=None):
+    """
+    Finds the top_k nearest neighbors of an article already in the index,
+    using its stored vector instead of re-encoding its text.
+    The article itself is excluded from the returned neighbors.
+    """
+    if not index:
+        logging.error("FAISS index not provided to search_by_row.")
+        return None, None
+
+    row_vector = get_stored_vector(row_id, index, embeddings)
+    if row_vector is None:
+        return None, None
+
+    distances, indices = search_faiss_index(row_vector, index, top_k=top_k + 1, allowed_ids=allowed_ids) # +1 to exclude self
+    if indices is None:
+        return None, None
+
+    keep = indices != row_id
+    return distances[keep][:top_k], indices[keep][:top_k]
+
+def similar_to_row(row_id, index, top_k=10, embeddings=None, allowed_ids=None, table=None):
+    """
+    Nearest neighbors of a corpus row: looked up in the precomputed neighbor table
+    (neighbor_table.NeighborTable) when it can answer, otherwise searched live with
+    search_by_row. Works without an index for lookups the table serves.
+    Returns (scores, row ids), best first.
+    """
+    if table is not None:
+        scores, indices = table.neighbors(row_id, top_k=top_k, allowed_ids=allowed_ids)
+        if indices is not None:
+            logging.info(f"Neighbors of row {row_id} served from the neighbor table.")
+            return scores, indices
+    return search_by_row(row_id, index, top_k=top_k, embeddings=embeddings, allowed_ids=allowed_ids)
+
+def reciprocal_rank_fusion(ranked_ids, top_k=10, rrf_k=60, weights=None):
+    """
+    Fuses ranked result lists (arrays of row ids, best first) by reciprocal rank:
+    score(d) = sum over lists of weight / (rrf_k + rank of d), ranks starting at 1.
+    Only ranks are used, so lexical (BM25) and vector scores need no calibration.
+    Returns (fused scores, row ids), best first.
+    """
+    weights = weights or [1.0] * len(ranked_ids)
+    ranked_ids = [np.asarray(ids, dtype=np.int64) for ids in ranked_ids]
+    ids = np.concatenate(ranked_ids) if ranked_ids else np.array([], dtype=np.int64)
+    if len(ids) == 0:
+        return np.array([], dtype=np.float32), ids
+    contributions = np.concatenate([
+        weight / (rrf_k + np.arange(1, len(list_ids) + 1, dtype=np.float64))
+        for list_ids, weight in zip(ranked_ids, weights)
+    ])
+    unique_ids, inverse = np.unique(ids, return_inverse=True)
+    scores = np.bincount(inverse, weights=contributions)
+    order = np.lexsort((unique_ids, -scores))[:top_k] # Ties broken by row id
+    return scores[order].astype(np.float32), unique_ids[order]
+
+def hybrid_search(query_text, query_embedding, index, lexical, top_k=10, candidates=100, rrf_k=60, lexical_weight=1.0, max_postings=10000, allowed_ids=None):
+    """
+    Runs the vector search and the BM25 search (lexical, a lexical_index.LexicalIndex) for
+    one query, candidates results each, and fuses them with reciprocal_rank_fusion.
+    Returns (fused row ids, vector distances, vector row ids); the vector results are
+    returned as well so callers can still use their distances (e.g. for map placement).
+    """
+    distances, vector_ids = search_faiss_index(query_embedding, index, top_k=candidates, allowed_ids=allowed_ids)
+    if vector_ids is None:
+        distances, vector_ids = np.array([]), np.array([], dtype=np.int64)
+    _, lexical_ids = lexical.search(query_text, top_k=candidates, allowed_ids=allowed_ids, max_postings=max_postings)
+    _, fused_ids = reciprocal_rank_fusion([vector_ids, lexical_ids], top_k=top_k, rrf_k=rrf_k, weights=[1.0, lexical_weight])
+    logging.info(f"Hybrid search fused {len(vector_ids)} vector and {len(lexical_ids)} lexical results.")
+    return fused_ids, distances, vector_ids
+
+def to_distances(scores, metric_type):
+    """
+    Converts FAISS search scores to distances. Inner-product scores (cosine similarity
+    for normalized embeddings) become cosine distances, 1 - similarity;
+    L2 results are squared distances, so their square root is used.
+    """
+    import faiss
+    scores = np.asarray(scores, dtype=np.float32)
+    if metric_type == faiss.METRIC_INNER_PRODUCT:
+        return np.maximum(1.0 - scores, 0.0)
+    return np.sqrt(np.maximum(scores, 0.0))
+
+def neighbor_weights(distances, metric_type, power=1.0, eps=1e-6):
+    """Inverse-distance weights for FAISS search results."""
+    return 1.0 / (to_distances(distances, metric_type) + eps) ** power
+
+def place_by_neighbors(neighbor_coords, distances, metric_type, k=10, power=1.0):
+    """
+    Places a query on the semantic map as the inverse-distance weighted mean of the map
+    coordinates of its k nearest articles. Reuses the results of the search that was
+    already run, so it costs O(k) rather than a reducer transform.
+    neighbor_coords: (n, 2 or 3) coordinates of the search results, in result order.
+    Returns the coordinates as a 1D array, or None if there are no neighbors.
+    """
+    if distances is None or len(distances) == 0:
+        return None
+    k = min(k, len(distances))
+    weights = neighbor_weights(distances[:k], metric_type, power)
+    coords = np.asarray(neighbor_coords[:k], dtype=np.float64)
+    return (weights[:, None] * coords).sum(axis=0) / weights.sum()
+
 # Example usage (conceptual, would be called from app.py)
 # config = data_manager.load_config()
 # if config:
@@ -0,0 +1,16 @@
+# app/topic_clusters.py
+"""
+Names of the topic cluster columns that preprocessing/7_cluster_articles.py adds to the
+processed records and the app colors the map by: one cluster_<k> column of cluster ids per
+k-means granularity. Has no Streamlit dependency, so the preprocessing stages can import it.
+"""
+CLUSTER_COLUMN_PREFIX = "cluster_"
+
+def cluster_column(n_clusters):
+    """Name of the processed-records column holding the cluster ids of one granularity."""
+    return f"{CLUSTER_COLUMN_PREFIX}{n_clusters}"
+
+def cluster_columns(column_names):
+    """The cluster id columns among column_names, coarsest granularity first."""
+    columns = [col for col in column_names if col.startswith(CLUSTER_COLUMN_PREFIX) and col[len(CLUSTER_COLUMN_PREFIX):].isdigit()]
+    return sorted(columns, key=lambda col: int(col[len(CLUSTER_COLUMN_PREFIX):]))
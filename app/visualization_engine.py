@@ -2,12 +2,277 @@
 import plotly.express as px
 import plotly.graph_objects as go
 import pandas as pd
+import numpy as np
 import logging
 
 # Configure basic logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def create_semantic_map(
+# Traces that depend on the current selection/query; everything else belongs to the base figure
+OVERLAY_META = "overlay"
+
+def query_marker_trace(query_coords, query_label="Query", plot_dimensions=2, point_size=5):
+    """A free-text query's map position as a separate, non-article marker trace."""
+    marker = dict(symbol='x' if plot_dimensions == 3 else 'star', size=point_size * 3, color='black')
+    trace_args = dict(
+        x=[query_coords[0]], y=[query_coords[1]],
+        mode='markers', name='Query', marker=marker, meta=OVERLAY_META,
+        customdata=[[-1]], # Not a DataFrame row; click handlers ignore it
+        hovertext=[query_label], hoverinfo='text'
+    )
+    if plot_dimensions == 3:
+        return go.Scatter3d(z=[query_coords[2]], **trace_args)
+    return go.Scatter(**trace_args)
+
+def add_query_marker(fig, query_coords, query_label="Query", plot_dimensions=2, point_size=5):
+    """Adds a free-text query's map position as a separate, non-article marker trace."""
+    fig.add_trace(query_marker_trace(query_coords, query_label, plot_dimensions, point_size))
+    return fig
+
+# Colors shared by the Plotly Express and level-of-detail renderings
+CATEGORY_COLORS = {
+    'All Documents': 'lightblue',
+    'Similar Documents': 'orange',
+    'Query/Selected Document': 'red'
+}
+
+# Cluster colors (color_by a cluster column); ids beyond the palette reuse its colors
+CLUSTER_PALETTE = px.colors.qualitative.Light24
+# Above this many clusters the markers mode colors one trace per point instead of one
+# trace (and legend entry) per cluster; the colors repeat beyond the palette anyway
+MAX_LEGEND_CLUSTERS = len(CLUSTER_PALETTE)
+
+def cluster_colorscale(palette=CLUSTER_PALETTE):
+    """Stepwise colorscale mapping the integers 0..len(palette)-1 to the palette colors (use with cluster_color_values)."""
+    colorscale = []
+    for i, color in enumerate(palette):
+        colorscale += [[i / len(palette), color], [(i + 1) / len(palette), color]]
+    return colorscale
+
+def cluster_color_values(cluster_ids, palette=CLUSTER_PALETTE):
+    """
+    Marker color arguments for cluster ids: one small integer per point plus the
+    stepwise colorscale, much lighter to send than a color string per point.
+    """
+    values = np.asarray(cluster_ids, dtype=np.int64) % len(palette)
+    return dict(color=values, colorscale=cluster_colorscale(palette), cmin=0, cmax=len(palette), showscale=False)
+
+def cluster_summary(df_display, cluster_column, plot_dimensions=2):
+    """Per cluster of the displayed rows: mean map position and number of articles."""
+    coords = ['x', 'y', 'z'][:plot_dimensions]
+    grouped = df_display.groupby(cluster_column, sort=True)
+    summary = grouped[coords].mean()
+    summary['count'] = grouped.size()
+    return summary
+
+def cluster_label_trace(df_display, cluster_column, cluster_labels=None, plot_dimensions=2, point_size=5):
+    """
+    One marker per cluster at the mean position of its displayed articles, sized by their
+    number and annotated with the cluster label: the aggregated, zoomed-out view of the map.
+    Cluster markers are not articles (customdata -1).
+    """
+    summary = cluster_summary(df_display, cluster_column, plot_dimensions)
+    cluster_labels = cluster_labels or {}
+    labels = [cluster_labels.get(int(cluster), f"Cluster {cluster}") for cluster in summary.index]
+    counts = summary['count'].to_numpy()
+    sizes = point_size * 2 + point_size * 4 * np.sqrt(counts / counts.max())
+    return scatter_trace(
+        plot_dimensions, x=summary['x'].to_numpy(), y=summary['y'].to_numpy(),
+        z=summary['z'].to_numpy() if plot_dimensions == 3 else None,
+        mode='markers+text', name='Topics', text=labels, textposition='top center',
+        marker=dict(size=sizes, line=dict(width=1, color='white'), opacity=0.9, **cluster_color_values(summary.index)),
+        customdata=np.full((len(summary), 1), -1), # Clusters are not articles; click handlers ignore them
+        hovertext=[f"{label} ({count} articles)" for label, count in zip(labels, counts)], hoverinfo='text'
+    )
+
+def majority_clusters(point_cells, cluster_ids, n_cells):
+    """The most frequent cluster among the points of each hexbin cell (ties: lowest id)."""
+    cluster_ids = np.asarray(cluster_ids, dtype=np.int64)
+    n_clusters = int(cluster_ids.max()) + 1
+    keys, counts = np.unique(point_cells.astype(np.int64) * n_clusters + cluster_ids, return_counts=True)
+    cells = keys // n_clusters
+    order = np.lexsort((-counts, cells)) # By cell, most frequent cluster first
+    first = order[np.r_[True, cells[order][1:] != cells[order][:-1]]]
+    majority = np.zeros(n_cells, dtype=np.int64)
+    majority[cells[first]] = keys[first] % n_clusters
+    return majority
+
+def choose_render_mode(n_points, webgl_threshold=20000, density_threshold=200000):
+    """
+    Picks how to draw n_points: 'markers' (Plotly Express SVG, full hover data),
+    'webgl' (one WebGL scatter trace) or 'density' (hexbin cells plus sparse points).
+    """
+    if n_points > density_threshold:
+        return "density"
+    if n_points > webgl_threshold:
+        return "webgl"
+    return "markers"
+
+def hexbin_cells(x, y, gridsize=150):
+    """
+    Assigns each point to a hexagonal cell (two offset rectangular lattices, as in
+    matplotlib's hexbin), fully vectorized.
+    Returns (cell_x, cell_y, counts, point_cells): cell centers, points per cell and
+    the cell of every point.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    nx = max(int(gridsize), 1)
+    ny = max(int(nx / np.sqrt(3)), 1)
+    xmin, xmax, ymin, ymax = x.min(), x.max(), y.min(), y.max()
+    sx = (xmax - xmin) / nx or 1.0
+    sy = (ymax - ymin) / ny or 1.0
+
+    ix, iy = (x - xmin) / sx, (y - ymin) / sy
+    ix1, iy1 = np.round(ix), np.round(iy) # Lattice 1: cell centers on integer points
+    ix2, iy2 = np.floor(ix), np.floor(iy) # Lattice 2: centers offset by half a cell
+    on_first = (ix - ix1) ** 2 + 3.0 * (iy - iy1) ** 2 < (ix - ix2 - 0.5) ** 2 + 3.0 * (iy - iy2 - 0.5) ** 2
+
+    cell_ix = np.where(on_first, ix1, ix2).astype(np.int64)
+    cell_iy = np.where(on_first, iy1, iy2).astype(np.int64)
+    keys = ((~on_first).astype(np.int64) * (ny + 2) + cell_iy) * (nx + 2) + cell_ix
+    unique_keys, point_cells, counts = np.unique(keys, return_inverse=True, return_counts=True)
+
+    cell_ix, cell_iy = unique_keys % (nx + 2), (unique_keys // (nx + 2)) % (ny + 2)
+    offset = np.where(unique_keys // ((nx + 2) * (ny + 2)) == 1, 0.5, 0.0)
+    return xmin + (cell_ix + offset) * sx, ymin + (cell_iy + offset) * sy, counts, point_cells
+
+def point_customdata(index_values):
+    """customdata column holding each point's original DataFrame index (first value, as in the px rendering)."""
+    return np.asarray(index_values)[:, None]
+
+def scatter_trace(plot_dimensions, **trace_args):
+    """A WebGL scatter trace: Scattergl in 2D, Scatter3d (always WebGL) in 3D."""
+    if plot_dimensions == 3:
+        return go.Scatter3d(**trace_args)
+    trace_args.pop('z', None)
+    return go.Scattergl(**trace_args)
+
+def build_base_traces(df_display, plot_dimensions=2, render_mode="webgl", hover_name='title', point_size=5,
+                      map_height=700, density_threshold=200000, hexbin_gridsize=150, min_cell_count=5, random_state=42,
+                      color_by=None, cluster_labels=None):
+    """
+    Traces for all documents in level-of-detail modes. Per point, only the coordinates,
+    the DataFrame index (customdata) and the hover name are sent.
+    'density' aggregates 2D points into hexbin cells of at least min_cell_count points
+    (customdata -1, not clickable) and draws the points of sparser cells individually.
+    3D has no cell aggregation, so 'density' draws a random sample of density_threshold points.
+    With color_by (a cluster id column), points are colored by cluster; in 'density' mode
+    each cell takes the color of its main cluster and a label marker is added per cluster.
+    """
+    hover_text = df_display[hover_name].to_numpy() if hover_name in df_display.columns else None
+    clusters = df_display[color_by].to_numpy() if color_by and color_by in df_display.columns else None
+    base_marker = dict(size=point_size, color=CATEGORY_COLORS['All Documents'], opacity=0.8)
+    point_marker = lambda rows=slice(None): base_marker if clusters is None else dict(base_marker, **cluster_color_values(clusters[rows]))
+    z = df_display['z'].to_numpy() if plot_dimensions == 3 else None
+
+    if render_mode != "density":
+        return [scatter_trace(
+            plot_dimensions, x=df_display['x'].to_numpy(), y=df_display['y'].to_numpy(), z=z,
+            mode='markers', name='All Documents', marker=point_marker(),
+            customdata=point_customdata(df_display.index), hovertext=hover_text, hoverinfo='text'
+        )]
+
+    if plot_dimensions == 3:
+        rng = np.random.default_rng(random_state)
+        sample = np.sort(rng.choice(len(df_display), size=min(density_threshold, len(df_display)), replace=False))
+        traces = [scatter_trace(
+            3, x=df_display['x'].to_numpy()[sample], y=df_display['y'].to_numpy()[sample], z=z[sample],
+            mode='markers', name=f'All Documents (sample of {len(sample)})', marker=point_marker(sample),
+            customdata=point_customdata(df_display.index[sample]),
+            hovertext=hover_text[sample] if hover_text is not None else None, hoverinfo='text'
+        )]
+        if clusters is not None:
+            traces.append(cluster_label_trace(df_display, color_by, cluster_labels, 3, point_size))
+        return traces
+
+    cell_x, cell_y, counts, point_cells = hexbin_cells(df_display['x'].to_numpy(), df_display['y'].to_numpy(), hexbin_gridsize)
+    dense = counts >= min_cell_count
+    cell_size = max(3.0, map_height / max(int(hexbin_gridsize / np.sqrt(3)), 1))
+    if clusters is None:
+        cell_colors = dict(color=np.log10(counts[dense]), colorscale='Blues', cmin=np.log10(min_cell_count), showscale=False)
+    else:
+        cell_colors = cluster_color_values(majority_clusters(point_cells, clusters, len(counts))[dense])
+    traces = [go.Scattergl(
+        x=cell_x[dense], y=cell_y[dense], mode='markers', name='Document density',
+        marker=dict(symbol='hexagon', size=cell_size, opacity=0.9, **cell_colors),
+        customdata=np.full((int(dense.sum()), 1), -1), # Cells are not articles; click handlers ignore them
+        text=counts[dense], hovertemplate='%{text} articles<extra></extra>'
+    )]
+    sparse_points = ~dense[point_cells]
+    if sparse_points.any():
+        traces.append(go.Scattergl(
+            x=df_display['x'].to_numpy()[sparse_points], y=df_display['y'].to_numpy()[sparse_points],
+            mode='markers', name='All Documents', marker=point_marker(sparse_points),
+            customdata=point_customdata(df_display.index[sparse_points]),
+            hovertext=hover_text[sparse_points] if hover_text is not None else None, hoverinfo='text'
+        ))
+    if clusters is not None:
+        traces.append(cluster_label_trace(df_display, color_by, cluster_labels, 2, point_size))
+    logging.info(f"Density map: {int(dense.sum())} cells aggregate {int(counts[dense].sum())} points, {int(sparse_points.sum())} drawn individually.")
+    return traces
+
+def build_overlay_traces(df_display, plot_dimensions=2, highlight_indices=None, query_point_index=None,
+                         hover_name='title', point_size=5):
+    """Individual marker traces for the neighbors and the selected article, drawn above the base traces."""
+    traces = []
+    overlays = [
+        ('Similar Documents', [idx for idx in (highlight_indices or []) if idx in df_display.index], 1.5),
+        ('Query/Selected Document', [query_point_index] if query_point_index is not None and query_point_index in df_display.index else [], 2.0),
+    ]
+    for name, indices, size_factor in overlays:
+        if not indices:
+            continue
+        rows = df_display.loc[indices]
+        traces.append(scatter_trace(
+            plot_dimensions, x=rows['x'].to_numpy(), y=rows['y'].to_numpy(),
+            z=rows['z'].to_numpy() if plot_dimensions == 3 else None,
+            mode='markers', name=name, meta=OVERLAY_META,
+            marker=dict(size=point_size * size_factor, color=CATEGORY_COLORS[name], opacity=1.0),
+            customdata=point_customdata(rows.index),
+            hovertext=rows[hover_name].to_numpy() if hover_name in rows.columns else None, hoverinfo='text'
+        ))
+    return traces
+
+def create_lod_base_figure(df_display, plot_dimensions=2, render_mode="webgl", hover_name='title', point_size=5,
+                           map_height=700, density_threshold=200000, hexbin_gridsize=150, min_cell_count=5,
+                           color_by=None, cluster_labels=None):
+    """Level-of-detail base figure: WebGL (or density) traces for all documents."""
+    fig = go.Figure(build_base_traces(
+        df_display, plot_dimensions, render_mode, hover_name, point_size, map_height,
+        density_threshold, hexbin_gridsize, min_cell_count, color_by=color_by, cluster_labels=cluster_labels
+    ))
+    fig.update_layout(
+        height=map_height,
+        margin=dict(l=0, r=0, b=0, t=30),
+        legend_title_text='Category',
+        clickmode='event+select'
+    )
+    logging.info(f"Created {plot_dimensions}D base map ({render_mode} rendering, {len(df_display)} points).")
+    return fig
+
+def build_overlays(df_source, plot_dimensions=2, highlight_indices=None, query_point_index=None,
+                   query_coords=None, query_label="Query", hover_name='title', point_size=5):
+    """
+    Selection-dependent traces: neighbors, the selected article and the query marker.
+    df_source only needs to contain those rows, so overlays cost O(top_k) to build.
+    """
+    traces = build_overlay_traces(df_source, plot_dimensions, highlight_indices, query_point_index, hover_name, point_size)
+    if query_coords is not None:
+        traces.append(query_marker_trace(query_coords, query_label, plot_dimensions, point_size))
+    return traces
+
+def update_overlays(fig, overlay_traces):
+    """
+    Replaces the overlay traces of a base figure in place, leaving the base traces
+    (and their data) untouched. The figure must not be shared between sessions.
+    """
+    fig.data = [trace for trace in fig.data if trace.meta != OVERLAY_META]
+    if overlay_traces:
+        fig.add_traces(overlay_traces)
+    return fig
+
+def create_base_figure(
     df_display,
     plot_dimensions=2,
     color_by=None,
@@ -15,27 +280,41 @@ def create_semantic_map(
     size_by=None,
     hover_name='title',
     hover_data=['id', 'year', 'journal'],
-    highlight_indices=None,
-    query_point_index=None,
     point_size=5,
-    map_height=700
+    map_height=700,
+    render_mode="auto",
+    webgl_threshold=20000,
+    density_threshold=200000,
+    hexbin_gridsize=150,
+    min_cell_count=5,
+    cluster_labels=None
 ):
     """
-    Creates an interactive 2D or 3D semantic map using Plotly Express.
+    Creates the selection-independent part of the 2D or 3D semantic map: every document
+    in df_display, without neighbor/selection/query highlighting. It depends only on the
+    data, the filters and the plot settings, so it can be cached and combined with
+    build_overlays/update_overlays on each rerun.
 
     Args:
         df_display (pd.DataFrame): DataFrame containing 'x', 'y', (optionally 'z'),
                                    and other metadata for plotting.
         plot_dimensions (int): 2 for 2D plot, 3 for 3D plot.
-        color_by (str, optional): Column name in df_display to color points by.
+        color_by (str, optional): Column name in df_display to color points by, typically
+                                  a cluster id column (cluster_<k>).
         symbol_by (str, optional): Column name for symbol mapping (2D only).
         size_by (str, optional): Column name for point size.
         hover_name (str): Column name for the main hover label.
         hover_data (list): List of column names to show in hover tooltip.
-        highlight_indices (list, optional): List of DataFrame indices to highlight as neighbors.
-        query_point_index (int, optional): DataFrame index of the query point.
         point_size (int): Default size of the points.
         map_height (int): Height of the plot in pixels.
+        render_mode (str): 'markers', 'webgl', 'density', or 'auto' to choose by point
+                           count (webgl_threshold, density_threshold). The WebGL and density
+                           modes send only coordinates and hover names per point and draw
+                           neighbors and the selection as overlay traces.
+        hexbin_gridsize (int): Hexbin cells across the x range in density mode.
+        min_cell_count (int): Cells with fewer points are drawn as individual points.
+        cluster_labels (dict, optional): Cluster id -> label for the color_by column, used
+                                         for the legend and the per-cluster label markers.
 
     Returns:
         plotly.graph_objects.Figure: The Plotly figure object.
@@ -53,6 +332,14 @@ def create_semantic_map(
         logging.error(f"Missing coordinate columns for plot: {missing}")
         return go.Figure().update_layout(title_text="Error: Missing coordinate data for plot.")
 
+    if render_mode == "auto":
+        render_mode = choose_render_mode(len(df_display), webgl_threshold, density_threshold)
+    if render_mode != "markers":
+        return create_lod_base_figure(
+            df_display, plot_dimensions, render_mode, hover_name, point_size, map_height,
+            density_threshold, hexbin_gridsize, min_cell_count, color_by, cluster_labels
+        )
+
     # Prepare hover data, ensuring all columns exist
     valid_hover_data = [col for col in hover_data if col in df_display.columns]
     if len(valid_hover_data) != len(hover_data):
@@ -66,6 +353,7 @@ def create_semantic_map(
         'hover_data': {col: True for col in valid_hover_data}, # Show these columns
         'color': color_by if color_by and color_by in df_display.columns else None,
         'height': map_height,
+        'custom_data': ['row_index'], # Original DataFrame index, returned by click events
     }
     if size_by and size_by in df_display.columns:
         plot_args['size'] = size_by
@@ -80,31 +368,29 @@ def create_semantic_map(
     df_plot = df_display.copy()
     df_plot['plot_color'] = 'All Documents' # Default category
     df_plot['plot_size'] = point_size # Default size
-
-    if highlight_indices:
-        df_plot.loc[highlight_indices, 'plot_color'] = 'Similar Documents'
-        df_plot.loc[highlight_indices, 'plot_size'] = point_size * 1.5 # Make neighbors slightly larger
-    if query_point_index is not None and query_point_index in df_plot.index:
-        df_plot.loc[query_point_index, 'plot_color'] = 'Query/Selected Document'
-        df_plot.loc[query_point_index, 'plot_size'] = point_size * 2.0 # Make query point largest
+    df_plot['row_index'] = df_plot.index
+    # Neighbors and the selected document are drawn as overlay traces (build_overlays)
 
     # Use the new 'plot_color' and 'plot_size' for consistent styling
     plot_args['color'] = 'plot_color'
     # For px.scatter, size is directly specified. For px.scatter_3d, marker.size is used.
     # We will set marker size uniformly later if not using 'size_by'
 
-    color_discrete_map = {
-        'All Documents': 'lightblue',
-        'Similar Documents': 'orange',
-        'Query/Selected Document': 'red'
-    }
-    if color_by and color_by in df_display.columns and color_by not in ['plot_color', 'plot_size']:
-        # If user specified a different color_by, let Plotly handle it,
-        # but our highlight logic might override or conflict.
-        # For simplicity, we prioritize highlight colors.
-        # A more complex setup could combine these.
-        logging.info(f"Using 'plot_color' for highlighting. Custom 'color_by={color_by}' might be overridden.")
+    color_discrete_map = CATEGORY_COLORS
+    point_colors = None
+    if color_by and color_by in df_display.columns and df_display[color_by].nunique() > MAX_LEGEND_CLUSTERS:
+        # Fine granularity: a single trace colored per point, like the WebGL rendering
+        point_colors = cluster_color_values(df_plot[color_by])
         plot_args['color_discrete_map'] = color_discrete_map
+    elif color_by and color_by in df_display.columns and color_by not in ['plot_color', 'plot_size']:
+        # Highlighting is done by the overlay traces, so the base points are free to show
+        # the color_by categories (cluster labels when known), in cluster id order
+        cluster_labels = cluster_labels or {}
+        df_plot = df_plot.sort_values(color_by, kind='stable')
+        categories = {value: f"{value}: {cluster_labels[value]}" if value in cluster_labels else f"Cluster {value}" for value in df_plot[color_by].unique().tolist()}
+        df_plot['plot_color'] = df_plot[color_by].map(categories)
+        # Same color per cluster as the WebGL and density renderings
+        plot_args['color_discrete_map'] = {name: CLUSTER_PALETTE[int(value) % len(CLUSTER_PALETTE)] for value, name in categories.items()}
     else:
         plot_args['color_discrete_map'] = color_discrete_map
 
@@ -117,7 +403,7 @@ def create_semantic_map(
             fig = px.scatter_3d(df_plot, x='x', y='y', z='z', **plot_args)
             # Set uniform marker size if not using 'size_by' column
             if not (size_by and size_by in df_display.columns):
-                 fig.update_traces(marker=dict(size=df_plot['plot_size'].tolist())) # Use list for per-point size
+                 fig.update_traces(marker=dict(size=point_size)) # Uniform; highlighted points are overlay traces
             else: # If size_by is used, ensure plot_size doesn't conflict
                  fig.update_traces(marker=dict(sizemode='diameter')) # Or other appropriate sizemode
 
@@ -127,20 +413,23 @@ def create_semantic_map(
             fig = px.scatter(df_plot, x='x', y='y', **plot_args)
             # Set uniform marker size if not using 'size_by' column
             if not (size_by and size_by in df_display.columns):
-                fig.update_traces(marker=dict(size=df_plot['plot_size'].tolist()))
+                fig.update_traces(marker=dict(size=point_size))
             else: # If size_by is used
                 fig.update_traces(marker=dict(sizemode='diameter'))
 
 
+        if point_colors is not None:
+            fig.update_traces(marker=point_colors, showlegend=False)
+
         fig.update_layout(
             margin=dict(l=0, r=0, b=0, t=30),
-            legend_title_text='Category' if plot_args['color'] == 'plot_color' else (color_by if color_by else ''),
+            legend_title_text=color_by if color_by and color_by in df_display.columns else 'Category',
             clickmode='event+select' # Enable click events
         )
         # Make points opaque
         fig.update_traces(marker=dict(opacity=0.8))
 
-        logging.info(f"Successfully created {plot_dimensions}D semantic map.")
+        logging.info(f"Successfully created {plot_dimensions}D base map.")
         return fig
 
     except Exception as e:
@@ -148,6 +437,43 @@ def create_semantic_map(
         st.error(f"Error creating plot: {e}")
         return go.Figure().update_layout(title_text=f"Error generating plot: {e}")
 
+def create_semantic_map(
+    df_display,
+    plot_dimensions=2,
+    color_by=None,
+    symbol_by=None,
+    size_by=None,
+    hover_name='title',
+    hover_data=['id', 'year', 'journal'],
+    highlight_indices=None,
+    query_point_index=None,
+    query_coords=None,
+    query_label="Query",
+    point_size=5,
+    map_height=700,
+    render_mode="auto",
+    webgl_threshold=20000,
+    density_threshold=200000,
+    hexbin_gridsize=150,
+    min_cell_count=5,
+    cluster_labels=None
+):
+    """
+    Creates the complete semantic map in one call: create_base_figure plus the overlays
+    for highlight_indices (neighbors), query_point_index (selected document) and
+    query_coords (free-text query marker). See create_base_figure for the other arguments.
+    """
+    fig = create_base_figure(
+        df_display, plot_dimensions, color_by, symbol_by, size_by, hover_name, hover_data,
+        point_size, map_height, render_mode, webgl_threshold, density_threshold, hexbin_gridsize, min_cell_count,
+        cluster_labels
+    )
+    if df_display.empty:
+        return fig
+    return update_overlays(fig, build_overlays(
+        df_display, plot_dimensions, highlight_indices, query_point_index, query_coords, query_label, hover_name, point_size
+    ))
+
 # Example usage (conceptual)
 # df = pd.DataFrame({
 #     'id': [1, 2, 3, 4, 5],
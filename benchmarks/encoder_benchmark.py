@@ -0,0 +1,133 @@
+# benchmarks/encoder_benchmark.py
+"""
+Validation / latency benchmark for the query encoder backends (app/encoder_backend.py).
+
+Loads the reference encoder ("torch") and one or more candidate backends, encodes the
+same sample of query texts with each, and reports:
+- agreement: row-wise cosine similarity between candidate and reference vectors, and,
+  if the FAISS index exists, the overlap of the top-k search results (overlap@k);
+- latency: load time and p50/p95/p99 of search_engine.embed_query, one query at a time,
+  as the app encodes queries.
+A candidate fails validation when its minimum cosine similarity is below --min-cosine;
+the exit status is non-zero if any candidate fails.
+
+Usage:
+    python benchmarks/encoder_benchmark.py
+    python benchmarks/encoder_benchmark.py --backends onnx onnx_int8 --n-queries 500 --min-cosine 0.98
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+# Get the parent directory of the current script
+parent_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(parent_dir / "app"))
+sys.path.insert(0, str(parent_dir / "benchmarks"))
+
+from search_benchmark import latency_summary, load_config, load_query_texts
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def benchmark_backend(model_config, query_texts, query_prefix=""):
+    """Loads one backend and times embed_query on each text. Returns (stats, vectors)."""
+    import encoder_backend
+    import search_engine
+    start = time.perf_counter()
+    model = encoder_backend.load_encoder(model_config)
+    stats = {'encoder': encoder_backend.encoder_id(model_config), 'load_s': time.perf_counter() - start}
+
+    search_engine.embed_query(query_texts[0], model, query_prefix) # Warm-up
+    latencies, vectors = [], []
+    for text in query_texts:
+        start = time.perf_counter()
+        vectors.append(search_engine.embed_query(text, model, query_prefix))
+        latencies.append(time.perf_counter() - start)
+    stats['embed_query'] = latency_summary(latencies)
+    return stats, np.vstack(vectors)
+
+def search_overlap(index, reference_vectors, candidate_vectors, k):
+    """Mean fraction of the reference top-k results that the candidate vectors also retrieve."""
+    _, reference_ids = index.search(np.ascontiguousarray(reference_vectors), k)
+    _, candidate_ids = index.search(np.ascontiguousarray(candidate_vectors), k)
+    return float(np.mean([len(set(ref) & set(cand)) / k for ref, cand in zip(reference_ids, candidate_ids)]))
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate query encoder backends against the reference model and compare latency.")
+    parser.add_argument("--backends", nargs="+", default=None, help="Candidate backends (default: embedding_model.backend, or onnx_int8 if that is torch).")
+    parser.add_argument("--quantization", default=None, help="INT8 config for onnx_int8 (arm64, avx2, avx512, avx512_vnni; default: embedding_model.quantization or detected).")
+    parser.add_argument("--n-queries", type=int, default=200, help="Query texts (article titles) to encode.")
+    parser.add_argument("--k", type=int, default=10, help="Results compared for overlap@k.")
+    parser.add_argument("--min-cosine", type=float, default=0.99, help="Minimum cosine similarity to the reference for a backend to pass.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", type=Path, default=None, help="JSON results file (default: benchmarks/results/encoder_<timestamp>.json).")
+    args = parser.parse_args()
+    import encoder_backend
+    import search_engine
+
+    config = load_config()
+    model_config = dict(config['embedding_model'])
+    if args.quantization:
+        model_config['quantization'] = args.quantization
+    candidates = args.backends or [backend for backend in [model_config.get('backend') or "torch"] if backend != "torch"] or ["onnx_int8"]
+    query_prefix = model_config.get('query_prefix', "")
+    query_texts = load_query_texts(args.n_queries, args.seed)
+
+    report = {
+        'benchmark': 'encoder',
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'args': {key: (str(value) if isinstance(value, Path) else value) for key, value in vars(args).items()},
+        'model': model_config['name'],
+        'platform': {'python': platform.python_version(), 'machine': platform.machine(), 'processor': platform.processor()},
+        'backends': {},
+    }
+
+    reference_stats, reference_vectors = benchmark_backend(dict(model_config, backend="torch"), query_texts, query_prefix)
+    report['backends']['torch'] = reference_stats
+    logging.info(f"torch: load={reference_stats['load_s']:.2f}s p50={reference_stats['embed_query']['p50_ms']:.2f}ms p99={reference_stats['embed_query']['p99_ms']:.2f}ms")
+
+    index = None
+    index_path = config['paths']['faiss_index']
+    if os.path.exists(index_path):
+        index, _ = search_engine.read_faiss_index(index_path, mmap=True)
+
+    all_passed = True
+    for backend in candidates:
+        try:
+            stats, vectors = benchmark_backend(dict(model_config, backend=backend), query_texts, query_prefix)
+        except Exception as e:
+            logging.error(f"{backend}: could not be benchmarked: {e}")
+            report['backends'][backend] = {'error': repr(e)}
+            all_passed = False
+            continue
+        stats['cosine'] = encoder_backend.cosine_agreement(reference_vectors, vectors)
+        if index is not None and index.d == vectors.shape[1]:
+            stats[f'overlap_at_{args.k}'] = search_overlap(index, reference_vectors, vectors, args.k)
+        stats['speedup_p50'] = reference_stats['embed_query']['p50_ms'] / stats['embed_query']['p50_ms']
+        stats['passed'] = stats['cosine']['min'] >= args.min_cosine
+        all_passed &= stats['passed']
+        report['backends'][backend] = stats
+        logging.info(
+            f"{stats['encoder']}: load={stats['load_s']:.2f}s p50={stats['embed_query']['p50_ms']:.2f}ms "
+            f"p99={stats['embed_query']['p99_ms']:.2f}ms speedup={stats['speedup_p50']:.2f}x "
+            f"cosine mean={stats['cosine']['mean']:.5f} min={stats['cosine']['min']:.5f}"
+            + (f" overlap@{args.k}={stats[f'overlap_at_{args.k}']:.3f}" if f'overlap_at_{args.k}' in stats else "")
+            + ("" if stats['passed'] else f" FAILED (min cosine < {args.min_cosine})")
+        )
+
+    output_path = args.output or parent_dir / "benchmarks" / "results" / f"encoder_{datetime.now():%Y%m%d_%H%M%S}.json"
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    logging.info(f"Benchmark results written to {output_path}")
+    sys.exit(0 if all_passed else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+# benchmarks/index_loading_benchmark.py
+"""
+Startup / memory benchmark for loading the FAISS index the way the app does
+(search_engine.read_faiss_index), with and without memory-mapping.
+
+For each mode, N worker processes are started at once, as N app server
+processes would be. Each one loads the index, runs a few searches so the
+pages it needs are touched, then reports its load time and memory:
+RSS split into anonymous (private heap) and file-backed pages, and PSS,
+which divides shared pages among the processes mapping them (Linux only).
+The index file is evicted from the page cache before each mode, so the
+first load in a mode is a cold start.
+
+Usage:
+    python benchmarks/index_loading_benchmark.py --processes 4
+    python benchmarks/index_loading_benchmark.py --synthetic 1000000 --index-type IVFFlat --processes 8
+"""
+import argparse
+import importlib
+import json
+import logging
+import multiprocessing as mp
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+# Get the parent directory of the current script
+parent_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(parent_dir / "app"))
+sys.path.insert(0, str(parent_dir / "preprocessing"))
+sys.path.insert(0, str(parent_dir / "benchmarks"))
+
+from search_benchmark import load_config, synthetic_vectors
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def memory_stats_mb():
+    """RssAnon/RssFile from /proc/self/status and Pss from /proc/self/smaps_rollup, in MB (Linux only)."""
+    stats = {}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                key, value = line.split(':', 1)
+                if key in ('VmRSS', 'RssAnon', 'RssFile'):
+                    stats[key] = int(value.split()[0]) / 1024
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    stats['Pss'] = int(line.split()[1]) / 1024
+    except OSError:
+        pass # Not Linux; only load times are reported
+    return stats
+
+def evict_from_page_cache(file_path):
+    """Asks the kernel to drop the file's cached pages so the next load reads from disk."""
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+def load_worker(index_path, mmap, queries, k, barrier, result_queue):
+    """Loads the index in this process, searches, and reports timings and memory once all workers are loaded."""
+    import search_engine
+    logging.getLogger().setLevel(logging.WARNING)
+
+    start = time.perf_counter()
+    index, mmapped = search_engine.read_faiss_index(index_path, mmap=mmap)
+    load_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index.search(queries, k)
+    first_search_s = time.perf_counter() - start
+
+    barrier.wait() # Measure PSS while every worker holds the index
+    result_queue.put({'pid': os.getpid(), 'mmapped': mmapped, 'load_s': load_s, 'first_search_s': first_search_s, **memory_stats_mb()})
+    barrier.wait() # Keep the mappings alive until everyone has measured
+
+def run_mode(index_path, mmap, n_processes, queries, k):
+    """Starts n_processes loaders concurrently and summarizes their results."""
+    evicted = evict_from_page_cache(index_path)
+    context = mp.get_context("spawn")
+    barrier = context.Barrier(n_processes)
+    result_queue = context.Queue()
+    processes = [
+        context.Process(target=load_worker, args=(index_path, mmap, queries, k, barrier, result_queue))
+        for _ in range(n_processes)
+    ]
+    for process in processes:
+        process.start()
+    workers = [result_queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    load_times = np.array([worker['load_s'] for worker in workers])
+    summary = {
+        'mmap_requested': mmap,
+        'mmapped': all(worker['mmapped'] for worker in workers),
+        'page_cache_evicted': evicted,
+        'load_s_max': float(load_times.max()),
+        'load_s_median': float(np.median(load_times)),
+        'workers': workers,
+    }
+    for key in ('VmRSS', 'RssAnon', 'RssFile', 'Pss'):
+        if all(key in worker for worker in workers):
+            summary[f'{key}_mb_per_process'] = float(np.mean([worker[key] for worker in workers]))
+            summary[f'{key}_mb_total'] = float(np.sum([worker[key] for worker in workers]))
+    return summary
+
+def build_synthetic_index(args, output_path):
+    """Builds an index of args.index_type over synthetic vectors and writes it to output_path."""
+    import faiss
+    build_index = importlib.import_module("3_build_index")
+    vectors = synthetic_vectors(args.synthetic, args.dimension, random_state=args.seed)
+    faiss_params = dict(load_config().get('faiss_params') or {}, metric='inner_product')
+    index, _ = build_index.build_faiss_index(vectors, args.index_type, faiss_params)
+    faiss.write_index(index, str(output_path))
+    return vectors.shape[1]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FAISS index load time and per-process memory with and without mmap.")
+    parser.add_argument("--processes", type=int, default=4, help="Concurrent loader processes (app workers) per mode.")
+    parser.add_argument("--index", type=Path, default=None, help="Index file to load (default: paths.faiss_index from config.yaml).")
+    parser.add_argument("--synthetic", type=int, default=None, help="Instead of --index, build a temporary index over this many synthetic vectors.")
+    parser.add_argument("--index-type", default="IndexFlatIP", help="Index type for --synthetic.")
+    parser.add_argument("--dimension", type=int, default=384, help="Vector dimension for --synthetic.")
+    parser.add_argument("--n-queries", type=int, default=100, help="Searches each worker runs after loading.")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", type=Path, default=None, help="JSON results file (default: benchmarks/results/index_loading_<timestamp>.json).")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.synthetic:
+            index_path = Path(tmp_dir) / "synthetic.faiss"
+            dimension = build_synthetic_index(args, index_path)
+        else:
+            import search_engine
+            index_path = args.index or Path(load_config()['paths']['faiss_index'])
+            dimension = search_engine.read_faiss_index(index_path, mmap=True)[0].d # Cheap where the index can be mapped
+        queries = synthetic_vectors(args.n_queries, dimension, random_state=args.seed + 1)
+
+        report = {
+            'benchmark': 'index_loading',
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'args': {key: (str(value) if isinstance(value, Path) else value) for key, value in vars(args).items()},
+            'index_file_mb': index_path.stat().st_size / (1024 * 1024),
+            'platform': {'python': platform.python_version(), 'machine': platform.machine(), 'processor': platform.processor()},
+            'modes': {},
+        }
+        for mode, mmap in (("read", False), ("mmap", True)):
+            logging.info(f"Loading {index_path} in {args.processes} processes ({mode})...")
+            summary = run_mode(str(index_path), mmap, args.processes, queries, args.k)
+            report['modes'][mode] = summary
+            logging.info(
+                f"{mode}: load max={summary['load_s_max']:.3f}s median={summary['load_s_median']:.3f}s "
+                f"RSS/process={summary.get('VmRSS_mb_per_process', float('nan')):.0f}MB "
+                f"PSS total={summary.get('Pss_mb_total', float('nan')):.0f}MB"
+                + ("" if summary['mmapped'] == mmap else " (mmap not supported, fell back to read)")
+            )
+
+    output_path = args.output or parent_dir / "benchmarks" / "results" / f"index_loading_{datetime.now():%Y%m%d_%H%M%S}.json"
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    logging.info(f"Benchmark results written to {output_path}")
+
+if __name__ == "__main__":
+    main()
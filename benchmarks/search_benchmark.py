@@ -0,0 +1,251 @@
+# benchmarks/search_benchmark.py
+"""
+Latency / recall benchmark for the search path used by the app:
+search_engine.embed_query (query encoding) and search_engine.search_faiss_index
+(FAISS search), measured separately and together.
+
+For every corpus size and every index type that preprocessing/3_build_index.py
+can build, a fresh process builds the index (with the same auto-tuning as the
+pipeline), runs the queries one at a time, and reports p50/p95/p99 latency,
+queries per second, recall@k against exact search and peak RSS.
+Results are written as JSON so runs can be compared.
+
+Usage:
+    python benchmarks/search_benchmark.py --sizes 10000 100000 1000000
+    python benchmarks/search_benchmark.py --source sampled --embed --index-types IndexFlatIP HNSW
+"""
+import argparse
+import importlib
+import json
+import logging
+import multiprocessing as mp
+import platform
+import queue
+import resource
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+# Get the parent directory of the current script
+parent_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(parent_dir / "app"))
+sys.path.insert(0, str(parent_dir / "preprocessing"))
+
+import yaml
+
+DEFAULT_INDEX_TYPES = ["IndexFlatIP", "IVFFlat", "IVFPQ", "HNSW"]
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def load_config(config_path=parent_dir / "config.yaml"):
+    """Loads the YAML configuration file."""
+    with open(config_path, 'r') as f:
+        return yaml.safe_load(f)
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (ru_maxrss is KB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024
+
+def latency_summary(latencies_s):
+    """p50/p95/p99/mean latency in milliseconds and single-stream queries per second."""
+    latencies_ms = np.asarray(latencies_s) * 1000
+    return {
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p95_ms': float(np.percentile(latencies_ms, 95)),
+        'p99_ms': float(np.percentile(latencies_ms, 99)),
+        'mean_ms': float(latencies_ms.mean()),
+        'qps': float(len(latencies_ms) / (latencies_ms.sum() / 1000)) if latencies_ms.sum() > 0 else 0.0,
+    }
+
+def synthetic_vectors(n_vectors, dimension, n_clusters=256, random_state=42):
+    """Unit-norm vectors drawn around random cluster centers, a rough stand-in for text embeddings."""
+    rng = np.random.default_rng(random_state)
+    centers = rng.standard_normal((n_clusters, dimension)).astype(np.float32)
+    vectors = centers[rng.integers(0, n_clusters, size=n_vectors)]
+    vectors += 0.6 * rng.standard_normal((n_vectors, dimension)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+def sampled_vectors(embeddings, n_vectors, random_state=42):
+    """Resamples stored embeddings (with small noise) to reach the requested corpus size."""
+    rng = np.random.default_rng(random_state)
+    rows = rng.integers(0, embeddings.shape[0], size=n_vectors)
+    vectors = np.asarray(embeddings[rows], dtype=np.float32)
+    vectors += 0.02 * rng.standard_normal(vectors.shape).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+def make_corpus(args, n_vectors, dimension):
+    """Returns (corpus, held-out queries) for one benchmark size."""
+    total = n_vectors + args.n_queries
+    if args.source == "sampled":
+        import embedding_store
+        stored = embedding_store.open_embeddings(load_config()['paths']['embeddings'])
+        vectors = sampled_vectors(stored, total, args.seed)
+    else:
+        vectors = synthetic_vectors(total, dimension, random_state=args.seed)
+    return vectors[:n_vectors], np.ascontiguousarray(vectors[n_vectors:])
+
+def load_query_texts(n_queries, random_state=42):
+    """Article titles from the processed records, used as realistic query strings."""
+    import pandas as pd
+    titles = pd.read_parquet(load_config()['paths']['processed_data'], columns=['title'])['title'].tolist()
+    rng = np.random.default_rng(random_state)
+    return [titles[i] for i in rng.integers(0, len(titles), size=n_queries)]
+
+def benchmark_embedding(model, query_texts, query_prefix=""):
+    """Times search_engine.embed_query on each query text (no cache). Returns stats and the vectors."""
+    import search_engine
+    search_engine.embed_query(query_texts[0], model, query_prefix) # Warm-up
+    latencies, vectors = [], []
+    for text in query_texts:
+        start = time.perf_counter()
+        vectors.append(search_engine.embed_query(text, model, query_prefix))
+        latencies.append(time.perf_counter() - start)
+    return latency_summary(latencies), np.vstack(vectors)
+
+def run_case(args, n_vectors, index_type, dimension, result_queue):
+    """Builds one index in this (child) process and measures it. Puts a result dict on result_queue."""
+    import search_engine
+    build_index = importlib.import_module("3_build_index")
+    logging.getLogger().setLevel(logging.WARNING) # Per-query INFO logs would dominate the timings
+
+    result = {'n_vectors': n_vectors, 'index_type': index_type, 'dimension': dimension, 'k': args.k}
+    try:
+        corpus, queries = make_corpus(args, n_vectors, dimension)
+        result['rss_after_corpus_mb'] = peak_rss_mb()
+
+        faiss_params = dict(load_config().get('faiss_params') or {}, metric='inner_product')
+        start = time.perf_counter()
+        index, build_params = build_index.build_faiss_index(corpus, index_type, faiss_params)
+        result['build_s'] = time.perf_counter() - start
+        result['build_params'] = build_params
+
+        metric = build_index.get_metric(index_type, faiss_params)
+        tuning = build_index.autotune_search_params(index, corpus, metric, args.target_recall, args.k, min(args.n_queries, 1000), args.seed)
+        result['search_params'] = tuning['search_params']
+
+        # Ground truth for the held-out queries
+        _, exact_indices = build_index.exact_knn(queries, corpus, args.k, metric)
+
+        search_engine.search_faiss_index(queries[0], index, args.k) # Warm-up
+        latencies, found = [], []
+        for query in queries:
+            start = time.perf_counter()
+            _, indices = search_engine.search_faiss_index(query, index, args.k)
+            latencies.append(time.perf_counter() - start)
+            found.append(indices)
+        result['search'] = latency_summary(latencies)
+        result['recall_at_k'] = build_index.recall_at_k(found, exact_indices, args.k)
+
+        start = time.perf_counter()
+        index.search(queries, args.k)
+        result['batch_search_qps'] = len(queries) / (time.perf_counter() - start)
+        result['peak_rss_mb'] = peak_rss_mb()
+
+        if args.embed:
+            # Encoder + search together, as one app query would run them
+            import encoder_backend
+            model_config = load_config()['embedding_model']
+            model = encoder_backend.load_encoder(model_config)
+            query_prefix = model_config.get('query_prefix', "")
+            query_texts = load_query_texts(args.n_queries, args.seed)
+            search_engine.search_faiss_index(search_engine.embed_query(query_texts[0], model, query_prefix), index, args.k)
+            latencies = []
+            for text in query_texts:
+                start = time.perf_counter()
+                search_engine.search_faiss_index(search_engine.embed_query(text, model, query_prefix), index, args.k)
+                latencies.append(time.perf_counter() - start)
+            result['embed_and_search'] = latency_summary(latencies)
+            result['peak_rss_with_model_mb'] = peak_rss_mb()
+    except Exception as e:
+        result['error'] = repr(e)
+    result_queue.put(result)
+
+def wait_for_result(process, result_queue, case, poll_seconds=5.0):
+    """
+    Waits for the result of a run_case process. If the child dies without reporting (e.g.
+    killed for running out of memory, or a crash inside FAISS), returns the case with an error.
+    """
+    while True:
+        try:
+            return result_queue.get(timeout=poll_seconds)
+        except queue.Empty:
+            if not process.is_alive():
+                try: # The result may have been put just before the process exited
+                    return result_queue.get(timeout=poll_seconds)
+                except queue.Empty:
+                    return dict(case, error=f"Benchmark process exited with code {process.exitcode} without a result.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark query encoding and FAISS search latency/recall.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help="Corpus sizes (number of vectors).")
+    parser.add_argument("--index-types", nargs="+", default=DEFAULT_INDEX_TYPES, help="Index types accepted by 3_build_index.build_faiss_index.")
+    parser.add_argument("--source", choices=["synthetic", "sampled"], default="synthetic", help="Synthetic clustered vectors, or resampled stored embeddings.")
+    parser.add_argument("--dimension", type=int, default=384, help="Vector dimension for synthetic corpora.")
+    parser.add_argument("--n-queries", type=int, default=1000, help="Held-out queries per case.")
+    parser.add_argument("--k", type=int, default=10, help="Neighbors per query (recall@k).")
+    parser.add_argument("--target-recall", type=float, default=0.95, help="Target recall for the index auto-tuner.")
+    parser.add_argument("--embed", action="store_true", help="Also benchmark the configured encoder alone and encoder+search.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", type=Path, default=None, help="JSON results file (default: benchmarks/results/search_<timestamp>.json).")
+    args = parser.parse_args()
+
+    config = load_config()
+    dimension = args.dimension
+    if args.source == "sampled":
+        import embedding_store
+        dimension = embedding_store.open_embeddings(config['paths']['embeddings']).shape[1]
+
+    report = {
+        'benchmark': 'search',
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'args': {key: (str(value) if isinstance(value, Path) else value) for key, value in vars(args).items()},
+        'platform': {'python': platform.python_version(), 'machine': platform.machine(), 'processor': platform.processor()},
+        'results': [],
+    }
+
+    if args.embed:
+        # Encoding cost does not depend on the corpus, so it is measured once
+        # (with the configured backend; benchmarks/encoder_benchmark.py compares backends)
+        import encoder_backend
+        model = encoder_backend.load_encoder(config['embedding_model'])
+        embedding_stats, query_vectors = benchmark_embedding(model, load_query_texts(args.n_queries, args.seed), config['embedding_model'].get('query_prefix', ""))
+        report['embed_query'] = embedding_stats
+        logging.info(f"embed_query: p50={embedding_stats['p50_ms']:.2f}ms p99={embedding_stats['p99_ms']:.2f}ms")
+        if args.source == "synthetic" and query_vectors.shape[1] != dimension:
+            logging.warning(f"Using the model's dimension ({query_vectors.shape[1]}) for synthetic corpora.")
+            dimension = query_vectors.shape[1]
+        del model
+
+    context = mp.get_context("spawn") # Fresh process per case so peak RSS is per index
+    for n_vectors in args.sizes:
+        for index_type in args.index_types:
+            logging.info(f"Benchmarking {index_type} on {n_vectors} vectors...")
+            result_queue = context.Queue()
+            process = context.Process(target=run_case, args=(args, n_vectors, index_type, dimension, result_queue))
+            process.start()
+            result = wait_for_result(process, result_queue, {'n_vectors': n_vectors, 'index_type': index_type, 'dimension': dimension, 'k': args.k})
+            process.join()
+            report['results'].append(result)
+            if 'error' in result:
+                logging.error(f"{index_type} @ {n_vectors}: {result['error']}")
+            else:
+                logging.info(
+                    f"{index_type} @ {n_vectors}: search p50={result['search']['p50_ms']:.3f}ms "
+                    f"p99={result['search']['p99_ms']:.3f}ms qps={result['search']['qps']:.0f} "
+                    f"recall@{args.k}={result['recall_at_k']:.4f} peak_rss={result['peak_rss_mb']:.0f}MB"
+                )
+
+    output_path = args.output or parent_dir / "benchmarks" / "results" / f"search_{datetime.now():%Y%m%d_%H%M%S}.json"
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    logging.info(f"Benchmark results written to {output_path}")
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,17 @@
 # preprocessing/1_clean_data.py
 import json
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import yaml
 import re
 import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from operator import itemgetter
 from pathlib import Path
 
 # Get the parent directory of the current script
@@ -24,14 +32,86 @@ def load_config(config_path= parent_dir / "config.yaml"):
         logging.error(f"Error loading configuration: {e}")
         raise
 
+def is_jsonl_file(file_path):
+    """JSON Lines if the extension says so, or if the file does not start with a JSON array."""
+    if str(file_path).lower().endswith(('.jsonl', '.ndjson')):
+        return True
+    with open(file_path, 'r', encoding='utf-8') as f:
+        while True:
+            char = f.read(1)
+            if not char or not char.isspace():
+                return char != '['
+
+def iter_json_array(f, read_size=1 << 20):
+    """
+    Yields the elements of a top-level JSON array one at a time, reading the
+    file in blocks of read_size characters, so memory is bounded by the largest record.
+    """
+    decoder = json.JSONDecoder()
+    separators = re.compile(r'[\s,]*')
+    buffer = f.read(read_size).lstrip()
+    if not buffer.startswith('['):
+        raise json.JSONDecodeError("Expected a JSON array", buffer, 0)
+    pos = 1
+    eof = False
+    while True:
+        pos = separators.match(buffer, pos).end()
+        if not eof and len(buffer) - pos < read_size:
+            # Top up the buffer so the next record is (most likely) complete
+            more = f.read(read_size)
+            eof = not more
+            buffer, pos = buffer[pos:] + more, 0
+            continue
+        if pos == len(buffer):
+            raise json.JSONDecodeError("Unterminated JSON array", buffer, pos)
+        if buffer[pos] == ']':
+            return
+        try:
+            record, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            more = f.read(read_size) # Record spans past the buffer; read more and retry
+            eof = not more
+            buffer, pos = buffer[pos:] + more, 0
+            continue
+        yield record
+        pos = end
+
+def iter_raw_records(file_path):
+    """Yields raw records one at a time from a JSON array file or a JSON Lines file."""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        if is_jsonl_file(file_path):
+            for line_number, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logging.warning(f"Skipping malformed JSON on line {line_number} of {file_path}")
+        else:
+            yield from iter_json_array(f)
+
+def iter_record_chunks(records, chunk_size):
+    """Groups an iterable of records into lists of at most chunk_size records."""
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
 def load_raw_data(file_path= parent_dir / "data/raw_records.json"):
     """
-    Loads raw data from a JSON file.
-    Assumes a list of dictionaries.
+    Loads raw data from a JSON file (a list of dictionaries) or a JSON Lines file.
     """
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        if is_jsonl_file(file_path):
+            data = list(iter_raw_records(file_path))
+        else:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
         logging.info(f"Successfully loaded {len(data)} records from {file_path}")
         return data
     except FileNotFoundError:
@@ -107,33 +187,309 @@ def clean_data(raw_data, text_fields_to_normalize=['title', 'abstract']):
     return pd.DataFrame(cleaned_records)
 
 
-def save_processed_data(df, file_path):
-    """Saves the processed DataFrame to a Parquet file."""
+def truthy_mask(series):
+    """Vectorized equivalent of bool(value) per element, with missing values treated as False."""
+    if pd.api.types.is_bool_dtype(series):
+        return series.fillna(False).astype(bool)
+    if pd.api.types.is_numeric_dtype(series):
+        return series.notna() & (series != 0)
+    try:
+        lengths = series.str.len().astype(float) # len() of strings and containers, NaN for scalars
+    except AttributeError: # No string-like values at all
+        lengths = pd.Series(np.nan, index=series.index)
+    mask = (lengths.fillna(0.0) > 0).to_numpy()
+    scalars = (lengths.isna() & series.notna()).to_numpy()
+    if scalars.any(): # Numbers, booleans and other scalars in an object column
+        mask[scalars] = series[scalars].map(bool).to_numpy(dtype=bool)
+    return pd.Series(mask, index=series.index)
+
+def re2_character_class(characters):
+    """RE2 character class (e.g. [\\x{9}-\\x{d}]) matching exactly the given characters."""
+    codes = sorted(ord(char) for char in characters)
+    ranges, start = [], codes[0]
+    for previous, code in zip(codes, codes[1:] + [None]):
+        if code != previous + 1:
+            ranges.append(f"\\x{{{start:x}}}" if start == previous else f"\\x{{{start:x}}}-\\x{{{previous:x}}}")
+            start = code
+    return "[" + "".join(ranges) + "]"
+
+# The characters Python's re treats as \s in str patterns (exactly those with str.isspace()),
+# so Arrow's RE2 kernel collapses the same runs as normalize_text. Runs that are already a
+# single ' ' are left unmatched, which makes the replacement much cheaper on typical text.
+PYTHON_WHITESPACE = (
+    "\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005"
+    "\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000"
+)
+WHITESPACE_TO_COLLAPSE = (
+    re2_character_class(PYTHON_WHITESPACE) + "{2,}|"
+    + re2_character_class([char for char in PYTHON_WHITESPACE if char != ' '])
+)
+
+def normalize_text_column(series):
+    """
+    Vectorized normalize_text: lowercase and collapse whitespace; non-strings become ''.
+    Lowercasing uses str.lower (its Unicode rules differ from Arrow's); the whitespace
+    collapse and trim run in Arrow's compute kernels.
+    """
+    try:
+        lowered = series.str.lower() # NaN for anything that is not a string
+    except AttributeError: # No strings in the column
+        return pd.Series("", index=series.index, dtype=object)
+    is_string = lowered.notna().to_numpy()
+    collapsed = pc.replace_substring_regex(pa.array(lowered[is_string], type=pa.large_string()), pattern=WHITESPACE_TO_COLLAPSE, replacement=' ')
+    normalized = np.full(len(series), "", dtype=object)
+    normalized[is_string] = pc.utf8_trim(collapsed, characters=' ').to_numpy(zero_copy_only=False)
+    return pd.Series(normalized, index=series.index)
+
+def coerce_year_column(series):
+    """
+    Vectorized version of the year rule in clean_data: int(year) if year is truthy and
+    parseable, else 0. Floats are truncated and strings must be integer literals, as with int().
+    """
+    years = np.zeros(len(series), dtype=np.int64)
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        values = series.to_numpy(dtype=float, na_value=np.nan)
+        valid = np.isfinite(values)
+        years[valid] = np.trunc(values[valid]).astype(np.int64)
+        return pd.Series(years, index=series.index)
+
+    try:
+        stripped = series.str.strip() # NaN for anything that is not a string
+    except AttributeError:
+        stripped = pd.Series(np.nan, index=series.index, dtype=object)
+    is_string = stripped.notna().to_numpy()
+
+    # Strings: integer literals (optionally signed or with '_' separators), as int() accepts
+    literals = stripped[is_string]
+    literals = literals[literals.str.fullmatch(r'[+-]?\d+(?:_\d+)*').fillna(False).astype(bool)]
+    parsed = pd.to_numeric(literals.str.replace('_', ''), errors='coerce')
+    if parsed.isna().any(): # e.g. non-ASCII digits, which pandas does not parse
+        parsed[parsed.isna()] = literals[parsed.isna()].map(int)
+    years[series.index.get_indexer(literals.index)] = parsed.astype(np.int64).to_numpy()
+
+    # Other scalars: numbers and booleans convert; containers, None and NaN stay 0
+    numbers = pd.to_numeric(series[~is_string & series.notna().to_numpy()], errors='coerce').astype(float)
+    numbers = numbers[np.isfinite(numbers)]
+    years[series.index.get_indexer(numbers.index)] = np.trunc(numbers.to_numpy()).astype(np.int64)
+    return pd.Series(years, index=series.index)
+
+def clean_data_columnar(raw_data, text_fields_to_normalize=['title', 'abstract'], required_fields=['id', 'title', 'abstract']):
+    """
+    Columnar implementation of clean_data: validation, text normalization, year coercion
+    and journal defaulting run as vectorized pandas string/array operations instead of
+    per-record Python. Produces the same DataFrame (columns, order, dtypes) as clean_data.
+    """
+    if not raw_data:
+        return pd.DataFrame()
+    required = pd.DataFrame.from_records(raw_data, columns=required_fields)
+    valid_mask = np.logical_and.reduce([truthy_mask(required[field]).to_numpy() for field in required_fields])
+    valid_rows = np.flatnonzero(valid_mask)
+    valid_count, invalid_count = len(valid_rows), len(raw_data) - len(valid_rows)
+    if valid_count == 0:
+        logging.info(f"Data cleaning complete. Valid records: 0, Invalid/skipped records: {invalid_count}")
+        return pd.DataFrame()
+
+    valid_records = itemgetter(*valid_rows)(raw_data)
+    valid_records = [valid_records] if valid_count == 1 else list(valid_records)
+    first_keys = list(valid_records[0])
+    # object dtype keeps a present None apart from an absent key (NaN); dtypes are inferred at the end
+    df = pd.DataFrame(valid_records, dtype=object)
+
+    for field in text_fields_to_normalize:
+        if field not in df.columns:
+            continue
+        normalized = normalize_text_column(df[field])
+        if field not in required_fields:
+            # clean_data only normalizes keys a record has; absent keys stay missing
+            values = df[field].to_numpy()
+            absent = pd.isna(values) & ~np.equal(values, None)
+            normalized = normalized.where(~absent, np.nan)
+        df[field] = normalized
+
+    df['year'] = coerce_year_column(df['year']) if 'year' in df.columns else np.int64(0)
+    journal = df['journal'] if 'journal' in df.columns else pd.Series(np.nan, index=df.index, dtype=object)
+    df['journal'] = journal.where(truthy_mask(journal), 'Unknown Journal').astype(object)
+
+    # clean_data appends 'year'/'journal' to records lacking them, so their position is set by
+    # the first valid record; the other columns keep their first-seen order
+    leading = first_keys + [key for key in ('year', 'journal') if key not in first_keys]
+    df = df[leading + [col for col in df.columns if col not in leading]].infer_objects()
+
+    logging.info(f"Data cleaning complete. Valid records: {valid_count}, Invalid/skipped records: {invalid_count}")
+    return df
+
+def clean_data_parallel(raw_data, text_fields_to_normalize=['title', 'abstract'], n_workers=None, chunk_size=50000):
+    """Runs clean_data_columnar on chunks of raw_data in a process pool and concatenates the results."""
+    chunks = [raw_data[start:start + chunk_size] for start in range(0, len(raw_data), chunk_size)]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        frames = list(executor.map(clean_data_columnar, chunks, [text_fields_to_normalize] * len(chunks)))
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+def clean_records(raw_data, text_fields_to_normalize=['title', 'abstract'], engine="python", n_workers=1, chunk_size=50000):
+    """
+    Dispatches to the configured cleaning implementation:
+    "python" (clean_data, per record) or "columnar" (clean_data_columnar,
+    optionally fanned out over n_workers processes).
+    """
+    if engine == "columnar":
+        if n_workers and n_workers > 1 and len(raw_data) > chunk_size:
+            return clean_data_parallel(raw_data, text_fields_to_normalize, n_workers, chunk_size)
+        return clean_data_columnar(raw_data, text_fields_to_normalize)
+    return clean_data(raw_data, text_fields_to_normalize)
+
+def save_processed_data(df, file_path, row_group_size=None):
+    """
+    Saves the processed DataFrame to a Parquet file. Small row groups (row_group_size rows)
+    let the app fetch abstracts and authors of single articles without reading the whole file.
+    """
     try:
-        df.to_parquet(file_path, index=False)
+        df.to_parquet(file_path, index=False, row_group_size=row_group_size)
         logging.info(f"Processed data saved to {file_path}")
     except Exception as e:
         logging.error(f"Error saving processed data to Parquet: {e}")
         raise
 
+# Arrow types of the record fields the pipeline knows about. The streaming writer declares
+# them up front, so a field that is absent or all-null in the first chunk keeps its real type.
+RECORD_FIELDS = pa.schema([
+    ('id', pa.string()),
+    ('title', pa.string()),
+    ('abstract', pa.string()),
+    ('year', pa.int64()),
+    ('journal', pa.string()),
+    ('authors', pa.list_(pa.string())),
+])
+
+def streaming_schema(table):
+    """
+    Output schema of a streamed Parquet file, from the first cleaned chunk: known record
+    fields get their declared types (and are added if the chunk lacks them), other all-null
+    columns are widened from the null type to string so later chunks can fill them.
+    """
+    fields = []
+    for field in table.schema:
+        if field.name in RECORD_FIELDS.names:
+            field = RECORD_FIELDS.field(field.name)
+        elif pa.types.is_null(field.type):
+            field = field.with_type(pa.string())
+        fields.append(field)
+    fields += [field for field in RECORD_FIELDS if field.name not in table.column_names]
+    return pa.schema(fields)
+
+def wrap_single_values(df):
+    """
+    Record fields declared as lists (authors) may hold a single string instead; wraps such
+    values in a one-item list so every chunk converts to the declared list type.
+    """
+    for field in RECORD_FIELDS:
+        if pa.types.is_list(field.type) and field.name in df.columns:
+            df[field.name] = df[field.name].map(lambda value: [value] if isinstance(value, str) else value)
+    return df
+
+def align_table_to_schema(table, schema):
+    """
+    Makes a chunk's Arrow table match the schema of the Parquet file being written:
+    columns missing from the chunk become nulls. A column the schema lacks cannot be
+    added to a file that is already being written, so it raises a ValueError.
+    """
+    extra_columns = [name for name in table.column_names if name not in schema.names]
+    if extra_columns:
+        raise ValueError(
+            f"Columns {extra_columns} first appear after the first chunk, so the streamed output cannot hold them. "
+            "Add them to RECORD_FIELDS, raise cleaning.chunk_size or disable cleaning.streaming."
+        )
+    columns = [
+        table.column(field.name).cast(field.type) if field.name in table.column_names
+        else pa.nulls(table.num_rows, type=field.type)
+        for field in schema
+    ]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+def clean_data_streaming(raw_file_path, output_file_path, text_fields_to_normalize=['title', 'abstract'], chunk_size=50000, engine="python", row_group_size=None, n_workers=1):
+    """
+    Streams raw records (JSON array or JSON Lines) through the cleaning engine in chunks of
+    chunk_size and appends each cleaned chunk to the Parquet file (as row groups of at most
+    row_group_size rows), so peak memory is bounded by the chunk size rather than the file size.
+    With the columnar engine and n_workers > 1, each chunk is split over the worker processes.
+    The output schema is the first non-empty chunk's columns plus the known record fields
+    (see streaming_schema); a column first seen in a later chunk fails the run.
+    Writes to a temporary file, renamed on success. Returns the number of records written.
+    """
+    writer = None
+    n_written = 0
+    tmp_path = f"{output_file_path}.tmp"
+    try:
+        for chunk_number, chunk in enumerate(iter_record_chunks(iter_raw_records(raw_file_path), chunk_size), start=1):
+            split_size = -(-len(chunk) // n_workers) if n_workers and n_workers > 1 else len(chunk)
+            df_chunk = clean_records(chunk, text_fields_to_normalize, engine, n_workers, split_size)
+            if df_chunk.empty:
+                continue
+            table = pa.Table.from_pandas(wrap_single_values(df_chunk), preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, streaming_schema(table))
+            table = align_table_to_schema(table, writer.schema)
+            writer.write_table(table, row_group_size=row_group_size)
+            n_written += table.num_rows
+            logging.info(f"Chunk {chunk_number}: wrote {table.num_rows} records ({n_written} total).")
+    except FileNotFoundError:
+        logging.error(f"Raw data file not found: {raw_file_path}")
+        raise
+    except Exception:
+        if writer is not None:
+            writer.close()
+            os.remove(tmp_path)
+        raise
+    if writer is not None:
+        writer.close()
+        os.replace(tmp_path, output_file_path)
+        logging.info(f"Processed data streamed to {output_file_path}")
+    return n_written
+
 def main():
     """Main function to orchestrate data cleaning."""
     logging.info("Starting data cleaning process...")
     config = load_config()
     paths = config['paths']
+    cleaning_config = config.get('cleaning') or {}
+
+    if cleaning_config.get('streaming', False):
+        n_written = clean_data_streaming(
+            paths['raw_data'],
+            paths['processed_data'],
+            config['embedding_model']['text_fields_to_embed'],
+            cleaning_config.get('chunk_size', 50000),
+            cleaning_config.get('engine', "python"),
+            (config.get('storage') or {}).get('row_group_size'),
+            cleaning_config.get('n_workers', 1)
+        )
+        if n_written == 0:
+            logging.warning("No valid data after cleaning. Output file was not created.")
+            return
+        logging.info("Data cleaning process finished successfully.")
+        return
 
     raw_data = load_raw_data(paths['raw_data'])
     if not raw_data:
         logging.warning("No raw data loaded. Exiting.")
         return
 
-    df_processed = clean_data(raw_data, config['embedding_model']['text_fields_to_embed'])
+    text_fields = config['embedding_model']['text_fields_to_embed']
+    df_processed = clean_records(
+        raw_data,
+        text_fields,
+        cleaning_config.get('engine', "python"),
+        cleaning_config.get('n_workers', 1),
+        cleaning_config.get('chunk_size', 50000)
+    )
 
     if df_processed.empty:
         logging.warning("No valid data after cleaning. Output file will not be created.")
         return
 
-    save_processed_data(df_processed, paths['processed_data'])
+    save_processed_data(df_processed, paths['processed_data'], (config.get('storage') or {}).get('row_group_size'))
     logging.info("Data cleaning process finished successfully.")
 
 if __name__ == "__main__":
@@ -4,12 +4,22 @@ import numpy as np
 from sentence_transformers import SentenceTransformer
 import yaml
 import logging
+import hashlib
+import json
+import os
+import shutil
+import time
 import torch # For checking CUDA availability
 from pathlib import Path
+import sys
 
 # Get the parent directory of the current script
 parent_dir = Path(__file__).parent.parent
 
+# The embedding store format is shared with the app
+sys.path.insert(0, str(parent_dir / "app"))
+import embedding_store
+
 # Configure basic logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -77,10 +87,284 @@ def generate_embeddings(texts, model_name, batch_size, device):
     logging.info(f"Embeddings generated. Shape: {embeddings.shape}")
     return embeddings
 
-def save_embeddings(embeddings, file_path):
-    """Saves embeddings to a .npy file."""
+def compute_token_lengths(model, texts, chunk_size=10000):
+    """Token count of each text as the model sees it (special tokens included, truncated to max_seq_length)."""
+    lengths = np.empty(len(texts), dtype=np.int64)
+    for start in range(0, len(texts), chunk_size):
+        encoded = model.tokenizer(
+            texts[start:start + chunk_size],
+            add_special_tokens=True,
+            truncation=True,
+            max_length=model.max_seq_length,
+            return_attention_mask=False,
+            return_token_type_ids=False
+        )
+        lengths[start:start + chunk_size] = [len(ids) for ids in encoded['input_ids']]
+    return lengths
+
+def make_token_budget_batches(lengths, token_budget, max_batch_size=None):
+    """
+    Sorts texts by token length (longest first) and greedily forms batches whose
+    padded size (batch size x longest member) stays within token_budget.
+    Returns a list of arrays of row positions.
+    """
+    order = np.argsort(-lengths, kind='stable')
+    batches, start = [], 0
+    while start < len(order):
+        longest = max(int(lengths[order[start]]), 1) # Sorted descending: the first member is the longest
+        size = max(1, token_budget // longest)
+        if max_batch_size:
+            size = min(size, max_batch_size)
+        batches.append(order[start:start + size])
+        start += size
+    return batches
+
+def fixed_size_batches(order, batch_size):
+    """Splits a row order into consecutive batches of batch_size."""
+    return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+def padding_ratio(lengths, batches):
+    """Fraction of the encoded token slots that are padding."""
+    padded = sum(len(batch) * int(lengths[batch].max()) for batch in batches)
+    return 1.0 - float(lengths.sum()) / padded if padded else 0.0
+
+def encode_batches(model, texts, batches):
+    """Encodes each batch as one forward pass and scatters the vectors back to the original order."""
+    embeddings = None
+    for batch in batches:
+        vectors = model.encode([texts[row] for row in batch], batch_size=len(batch), show_progress_bar=False)
+        if embeddings is None:
+            embeddings = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+        embeddings[batch] = vectors
+    return embeddings
+
+def generate_embeddings_bucketed(texts, model_name, batch_size, token_budget, device, compare_sample_size=0):
+    """
+    Generates embeddings with length-bucketed dynamic batching: texts are sorted by
+    token length and batched by a token budget instead of a fixed count, so short
+    abstracts are not padded to the length of long ones.
+    Logs the padding ratio of fixed-size batching (corpus order, and sorted by
+    character length as SentenceTransformer.encode does) versus the bucketed batches.
+    If compare_sample_size > 0, also times both batchings on that many texts.
+    """
     try:
-        np.save(file_path, embeddings)
+        model = SentenceTransformer(model_name, device=device)
+        logging.info(f"SentenceTransformer model '{model_name}' loaded on {device}.")
+    except Exception as e:
+        logging.error(f"Error loading SentenceTransformer model '{model_name}': {e}")
+        raise
+
+    lengths = compute_token_lengths(model, texts)
+    batches = make_token_budget_batches(lengths, token_budget)
+    by_characters = np.argsort([-len(text) for text in texts], kind='stable')
+    logging.info(
+        f"Padding ratio: fixed batches of {batch_size} in corpus order {padding_ratio(lengths, fixed_size_batches(np.arange(len(texts)), batch_size)):.1%}, "
+        f"sorted by characters {padding_ratio(lengths, fixed_size_batches(by_characters, batch_size)):.1%}, "
+        f"token-budget batches ({token_budget} tokens, {len(batches)} batches) {padding_ratio(lengths, batches):.1%}."
+    )
+
+    if compare_sample_size:
+        sample = texts[:compare_sample_size]
+        sample_lengths = lengths[:compare_sample_size]
+        start = time.perf_counter()
+        model.encode(sample, batch_size=batch_size, show_progress_bar=False)
+        fixed_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        encode_batches(model, sample, make_token_budget_batches(sample_lengths, token_budget))
+        bucketed_seconds = time.perf_counter() - start
+        logging.info(
+            f"Throughput on {len(sample)} texts: fixed batches {len(sample) / fixed_seconds:.1f} texts/s, "
+            f"token-budget batches {len(sample) / bucketed_seconds:.1f} texts/s ({fixed_seconds / bucketed_seconds:.2f}x)."
+        )
+
+    logging.info(f"Generating embeddings for {len(texts)} texts (token budget: {token_budget})...")
+    start = time.perf_counter()
+    embeddings = encode_batches(model, texts, batches)
+    elapsed = time.perf_counter() - start
+    logging.info(
+        f"Embeddings generated. Shape: {embeddings.shape}. "
+        f"{len(texts) / elapsed:.1f} texts/s, {lengths.sum() / elapsed:.0f} tokens/s."
+    )
+    return embeddings
+
+def corpus_fingerprint(texts, model_name, shard_size):
+    """Identifies a sharded run, so a checkpoint is only resumed for the same texts, model and sharding."""
+    digest = hashlib.sha1(f"{model_name}\0{shard_size}\0{len(texts)}".encode('utf-8'))
+    for text in texts:
+        digest.update(text.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def load_checkpoint(shard_dir, fingerprint):
+    """Returns the set of finished shard numbers for this run, or an empty set if the checkpoint is for other input."""
+    checkpoint_path = Path(shard_dir) / "checkpoint.json"
+    if not checkpoint_path.exists():
+        return set()
+    with open(checkpoint_path, 'r') as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('fingerprint') != fingerprint:
+        logging.info("Existing embedding shards belong to a different input. Starting over.")
+        return set()
+    completed = {shard for shard in checkpoint.get('completed', []) if (Path(shard_dir) / f"shard_{shard:05d}.npy").exists()}
+    logging.info(f"Resuming from checkpoint: {len(completed)} shards already encoded.")
+    return completed
+
+def save_checkpoint(shard_dir, fingerprint, n_texts, shard_size, completed):
+    """Atomically records which shards are finished."""
+    checkpoint_path = Path(shard_dir) / "checkpoint.json"
+    tmp_path = checkpoint_path.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump({'fingerprint': fingerprint, 'n_texts': n_texts, 'shard_size': shard_size, 'completed': sorted(completed)}, f)
+    os.replace(tmp_path, checkpoint_path)
+
+def consolidate_shards(shard_dir, n_shards, n_texts, output_path):
+    """
+    Copies the shard files into one .npy at output_path, one shard at a time, and
+    returns it memory-mapped so the full matrix never has to sit in RAM.
+    """
+    first_shard = np.load(Path(shard_dir) / "shard_00000.npy", mmap_mode='r')
+    consolidated = np.lib.format.open_memmap(output_path, mode='w+', dtype=np.float32, shape=(n_texts, first_shard.shape[1]))
+    start = 0
+    for shard in range(n_shards):
+        vectors = np.load(Path(shard_dir) / f"shard_{shard:05d}.npy", mmap_mode='r')
+        consolidated[start:start + len(vectors)] = vectors
+        start += len(vectors)
+    consolidated.flush()
+    del consolidated
+    logging.info(f"Consolidated {n_shards} shards into {output_path}")
+    return np.load(output_path, mmap_mode='r')
+
+def generate_embeddings_sharded(texts, model_name, batch_size, shard_dir, shard_size=10000, n_workers=None):
+    """
+    Encodes texts on CPU with a multi-process SentenceTransformer pool, writing each
+    shard of shard_size texts to shard_dir as soon as it is finished and recording
+    progress in a checkpoint. A restarted run with the same input skips finished shards.
+    Returns the consolidated embeddings, memory-mapped.
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    Path(shard_dir).mkdir(parents=True, exist_ok=True)
+    fingerprint = corpus_fingerprint(texts, model_name, shard_size)
+    n_shards = (len(texts) + shard_size - 1) // shard_size
+    completed = load_checkpoint(shard_dir, fingerprint)
+    if not completed:
+        for stale_shard in Path(shard_dir).glob("shard_*.npy"):
+            stale_shard.unlink()
+
+    pending = [shard for shard in range(n_shards) if shard not in completed]
+    if pending:
+        model = SentenceTransformer(model_name, device='cpu')
+        # Split the cores between workers instead of letting every worker use all of them.
+        # Workers read OMP_NUM_THREADS when they start, so it is only set while they are spawned.
+        previous_omp_threads = os.environ.get('OMP_NUM_THREADS')
+        os.environ['OMP_NUM_THREADS'] = str(max(1, (os.cpu_count() or 1) // n_workers))
+        try:
+            pool = model.start_multi_process_pool(target_devices=['cpu'] * n_workers)
+        finally:
+            if previous_omp_threads is None:
+                del os.environ['OMP_NUM_THREADS']
+            else:
+                os.environ['OMP_NUM_THREADS'] = previous_omp_threads
+        logging.info(f"Encoding {len(pending)} of {n_shards} shards with {n_workers} CPU worker processes...")
+        try:
+            for shard in pending:
+                shard_texts = texts[shard * shard_size:(shard + 1) * shard_size]
+                vectors = model.encode_multi_process(shard_texts, pool, batch_size=batch_size).astype(np.float32)
+                shard_path = Path(shard_dir) / f"shard_{shard:05d}.npy"
+                with open(shard_path.with_suffix('.tmp'), 'wb') as f:
+                    np.save(f, vectors)
+                os.replace(shard_path.with_suffix('.tmp'), shard_path) # A crash never leaves a partial shard
+                completed.add(shard)
+                save_checkpoint(shard_dir, fingerprint, len(texts), shard_size, completed)
+                logging.info(f"Shard {shard + 1}/{n_shards} written ({len(completed)} done).")
+        finally:
+            SentenceTransformer.stop_multi_process_pool(pool)
+
+    return consolidate_shards(shard_dir, n_shards, len(texts), Path(shard_dir) / "consolidated.npy")
+
+def clear_shards(shard_dir):
+    """Removes shards, checkpoint and consolidated file once the final outputs are saved."""
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    logging.info(f"Removed embedding shards in {shard_dir}")
+
+def compute_text_hashes(texts, model_name, passage_prefix=""):
+    """
+    Content hash per text, keyed on (model name, passage prefix, text).
+    Texts already carry the prefix; it is hashed as its own field so the key stays unambiguous.
+    """
+    return np.array(
+        [hashlib.sha1(f"{model_name}\0{passage_prefix}\0{text}".encode('utf-8')).hexdigest() for text in texts],
+        dtype='S40'
+    )
+
+def load_embedding_cache(file_path):
+    """Loads previously computed vectors as (hashes, vectors). Returns (None, None) if there is no cache."""
+    if not file_path or not os.path.exists(file_path):
+        logging.info("No embedding cache found. All texts will be encoded.")
+        return None, None
+    try:
+        with np.load(file_path) as cache:
+            hashes, vectors = cache['hashes'], cache['vectors']
+        logging.info(f"Embedding cache loaded from {file_path}: {len(hashes)} vectors.")
+        return hashes, vectors
+    except Exception as e:
+        logging.warning(f"Could not read embedding cache {file_path}: {e}. All texts will be encoded.")
+        return None, None
+
+def save_embedding_cache(hashes, vectors, file_path):
+    """Saves the content-hash -> vector store used by the next incremental run."""
+    try:
+        # np.savez appends .npz to names without it, so write through a file handle
+        with open(file_path, 'wb') as f:
+            np.savez(f, hashes=hashes, vectors=vectors)
+        logging.info(f"Embedding cache saved to {file_path} ({len(hashes)} vectors).")
+    except Exception as e:
+        logging.error(f"Error saving embedding cache: {e}")
+        raise
+
+def generate_embeddings_incremental(texts, model_name, encode, cache_path, output_path, passage_prefix=""):
+    """
+    Generates embeddings, only sending texts whose content hash is not in the cache
+    at cache_path to `encode` (a function from a list of texts to an array).
+    Cached and new vectors are written in the order of `texts` to a .npy at output_path,
+    returned memory-mapped, and the cache is rewritten with the vectors of the current corpus.
+    """
+    text_hashes = compute_text_hashes(texts, model_name, passage_prefix)
+    cached_hashes, cached_vectors = load_embedding_cache(cache_path)
+    cached_rows = {} if cached_hashes is None else {h: row for row, h in enumerate(cached_hashes)}
+
+    # Identical texts share one hash, so each distinct new text is encoded once
+    missing = {}
+    for row, text_hash in enumerate(text_hashes):
+        if text_hash not in cached_rows and text_hash not in missing:
+            missing[text_hash] = row
+    n_reused = sum(text_hash in cached_rows for text_hash in text_hashes)
+    logging.info(f"Embedding cache: {n_reused} of {len(texts)} texts reused, {len(missing)} new or changed texts to encode.")
+
+    new_vectors = None
+    if missing:
+        new_vectors = encode([texts[row] for row in missing.values()])
+
+    dimension = new_vectors.shape[1] if new_vectors is not None else cached_vectors.shape[1]
+    embeddings = np.lib.format.open_memmap(output_path, mode='w+', dtype=np.float32, shape=(len(texts), dimension))
+    new_rows = {text_hash: i for i, text_hash in enumerate(missing)}
+    for row, text_hash in enumerate(text_hashes):
+        if text_hash in new_rows:
+            embeddings[row] = new_vectors[new_rows[text_hash]]
+        else:
+            embeddings[row] = cached_vectors[cached_rows[text_hash]]
+
+    embeddings.flush()
+
+    # Keep only vectors of the current corpus so the cache does not grow without bound.
+    # Rows are saved in corpus order (identical texts repeat), so np.savez streams them from the file.
+    save_embedding_cache(text_hashes, embeddings, cache_path)
+    del embeddings
+    return np.load(output_path, mmap_mode='r')
+
+def save_embeddings(embeddings, file_path, dtype="float32", model_name=None):
+    """Saves embeddings in the embedding store format (float32, float16 or int8)."""
+    try:
+        embedding_store.write_embeddings(file_path, embeddings, dtype=dtype, model_name=model_name)
         logging.info(f"Embeddings saved to {file_path}")
     except Exception as e:
         logging.error(f"Error saving embeddings: {e}")
@@ -109,14 +393,47 @@ def main():
         logging.warning("No texts to embed after preparation. Exiting.")
         return
 
-    embeddings = generate_embeddings(
-        texts_to_embed,
-        model_config['name'],
-        model_config['batch_size'],
-        device
-    )
+    multiprocess_config = model_config.get('multiprocess') or {}
+    use_multiprocess = multiprocess_config.get('enabled', False) and device == 'cpu'
+    shard_dir = multiprocess_config.get('shard_dir', 'data/embedding_shards')
+    if use_multiprocess and model_config.get('token_budget'):
+        logging.warning("embedding_model.token_budget is ignored with multiprocess.enabled: the worker pool batches by batch_size.")
+
+    def encode(texts):
+        if use_multiprocess:
+            return generate_embeddings_sharded(
+                texts,
+                model_config['name'],
+                model_config['batch_size'],
+                shard_dir,
+                multiprocess_config.get('shard_size', 10000),
+                multiprocess_config.get('n_workers')
+            )
+        if model_config.get('token_budget'):
+            return generate_embeddings_bucketed(
+                texts,
+                model_config['name'],
+                model_config['batch_size'],
+                model_config['token_budget'],
+                device,
+                model_config.get('compare_batching_sample_size', 0)
+            )
+        return generate_embeddings(texts, model_config['name'], model_config['batch_size'], device)
+
+    cache_path = paths_config.get('embedding_cache')
+    if cache_path:
+        rows_path = f"{cache_path}.rows.npy" # Embeddings of the current corpus, until written to the store
+        embeddings = generate_embeddings_incremental(texts_to_embed, model_config['name'], encode, cache_path, rows_path, passage_prefix)
+    else:
+        embeddings = encode(texts_to_embed)
 
-    save_embeddings(embeddings, paths_config['embeddings'])
+    store_config = config.get('embedding_store') or {}
+    save_embeddings(embeddings, paths_config['embeddings'], store_config.get('dtype', "float32"), model_config['name'])
+    if cache_path:
+        del embeddings # Unmap before removing the file
+        os.remove(rows_path)
+    if use_multiprocess:
+        clear_shards(shard_dir) # Final outputs are saved; the shards are no longer needed for a resume
     logging.info("Embedding generation process finished successfully.")
 
 if __name__ == "__main__":
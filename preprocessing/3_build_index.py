@@ -2,13 +2,20 @@
 import numpy as np
 import faiss
 import yaml
+import json
 import logging
+import os
 
 from pathlib import Path
+import sys
 
 # Get the parent directory of the current script
 parent_dir = Path(__file__).parent.parent
 
+# The embedding store format is shared with the app
+sys.path.insert(0, str(parent_dir / "app"))
+import embedding_store
+
 # Configure basic logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -18,12 +25,9 @@ def load_config(config_path=parent_dir / "config.yaml"):
         return yaml.safe_load(f)
 
 def load_embeddings(file_path):
-    """Loads embeddings from a .npy file."""
+    """Opens the embedding store memory-mapped; rows are read as float32 block by block."""
     try:
-        embeddings = np.load(file_path)
-        # FAISS expects float32
-        if embeddings.dtype != np.float32:
-            embeddings = embeddings.astype(np.float32)
+        embeddings = embedding_store.open_embeddings(file_path)
         logging.info(f"Embeddings loaded from {file_path}. Shape: {embeddings.shape}")
         return embeddings
     except FileNotFoundError:
@@ -33,44 +37,218 @@ def load_embeddings(file_path):
         logging.error(f"Error loading embeddings: {e}")
         raise
 
-def build_faiss_index(embeddings, index_type="IndexFlatL2"):
+def add_in_blocks(index, embeddings, block_size=65536):
+    """Adds embeddings to the index one float32 block at a time (FAISS expects float32)."""
+    for start in range(0, embeddings.shape[0], block_size):
+        index.add(np.ascontiguousarray(embeddings[start:start + block_size], dtype=np.float32))
+
+FLAT_INDEX_TYPES = ["IndexFlatL2", "IndexFlatIP"]
+
+def get_metric(index_type, faiss_params):
+    """
+    Resolves the FAISS metric: implied by flat index names, otherwise faiss_params['metric'].
+    Without a metric, factory strings keep faiss.index_factory's default, L2.
+    """
+    if index_type == "IndexFlatL2":
+        return faiss.METRIC_L2
+    if index_type == "IndexFlatIP":
+        return faiss.METRIC_INNER_PRODUCT
+    default_metric = 'inner_product' if index_type in ["IVFFlat", "IVFPQ", "HNSW"] else 'l2'
+    metric = faiss_params.get('metric', default_metric)
+    return faiss.METRIC_INNER_PRODUCT if metric == 'inner_product' else faiss.METRIC_L2
+
+def default_nlist(n_vectors):
+    """Number of IVF lists: ~4*sqrt(N), but keep at least 39 training points per list."""
+    return int(max(1, min(4 * np.sqrt(n_vectors), n_vectors // 39)))
+
+def default_pq_m(dimension):
+    """Number of PQ sub-quantizers: aim for 8 dimensions each, must divide the dimension."""
+    for m in range(max(1, dimension // 8), 0, -1):
+        if dimension % m == 0:
+            return m
+    return 1
+
+def sample_training_vectors(embeddings, train_size, random_state=42):
+    """Draws a random training sample (all vectors if the corpus is smaller)."""
+    if train_size >= embeddings.shape[0]:
+        return np.ascontiguousarray(embeddings[:], dtype=np.float32)
+    rng = np.random.default_rng(random_state)
+    rows = np.sort(rng.choice(embeddings.shape[0], size=train_size, replace=False))
+    return np.ascontiguousarray(embeddings[rows], dtype=np.float32)
+
+def build_ivf_flat(embeddings, metric, nlist, train_size, random_state=42):
+    """IVF with uncompressed vectors: exact distances within the probed lists."""
+    dimension = embeddings.shape[1]
+    quantizer = faiss.IndexFlat(dimension, metric)
+    index = faiss.IndexIVFFlat(quantizer, dimension, nlist, metric)
+    index.train(sample_training_vectors(embeddings, train_size, random_state))
+    return index
+
+def build_ivf_pq(embeddings, metric, nlist, pq_m, pq_nbits, train_size, random_state=42):
+    """IVF with product-quantized vectors: pq_m bytes per vector for pq_nbits=8."""
+    dimension = embeddings.shape[1]
+    quantizer = faiss.IndexFlat(dimension, metric)
+    index = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, pq_nbits, metric)
+    index.train(sample_training_vectors(embeddings, train_size, random_state))
+    return index
+
+def build_hnsw(embeddings, metric, hnsw_m, ef_construction):
+    """HNSW graph over uncompressed vectors. No training needed."""
+    index = faiss.IndexHNSWFlat(embeddings.shape[1], hnsw_m, metric)
+    index.hnsw.efConstruction = ef_construction
+    return index
+
+def build_faiss_index(embeddings, index_type="IndexFlatL2", faiss_params=None):
     """
     Builds a FAISS index from embeddings.
-    index_type: A string like "IndexFlatL2", "IndexFlatIP", or a factory string.
+    index_type: "IndexFlatL2", "IndexFlatIP", "IVFFlat", "IVFPQ", "HNSW", or a factory string.
+    faiss_params: the 'faiss_params' config section; unset values get size-based defaults.
+    Returns the index and the build parameters that were used.
     """
     if embeddings.shape[0] == 0:
         logging.warning("No embeddings provided to build index.")
-        return None
+        return None, {}
 
-    dimension = embeddings.shape[1]
+    faiss_params = faiss_params or {}
+    n_vectors, dimension = embeddings.shape
+    metric = get_metric(index_type, faiss_params)
+    random_state = faiss_params.get('random_state', 42)
+    build_params = {'index_type': index_type, 'metric': 'inner_product' if metric == faiss.METRIC_INNER_PRODUCT else 'l2'}
     try:
         # For simple index types like IndexFlatL2 or IndexFlatIP
         if index_type == "IndexFlatL2":
             index = faiss.IndexFlatL2(dimension)
         elif index_type == "IndexFlatIP":
             index = faiss.IndexFlatIP(dimension)
+        elif index_type in ["IVFFlat", "IVFPQ"]:
+            nlist = faiss_params.get('nlist') or default_nlist(n_vectors)
+            build_params['nlist'] = nlist
+            if index_type == "IVFFlat":
+                train_size = faiss_params.get('train_sample_size') or min(n_vectors, 64 * nlist)
+                logging.info(f"Training IVF-Flat index (nlist={nlist}) on {min(train_size, n_vectors)} vectors...")
+                index = build_ivf_flat(embeddings, metric, nlist, train_size, random_state)
+            else:
+                pq_m = faiss_params.get('pq_m') or default_pq_m(dimension)
+                pq_nbits = faiss_params.get('pq_nbits', 8)
+                build_params.update({'pq_m': pq_m, 'pq_nbits': pq_nbits})
+                # PQ codebooks need ~39 points per centroid as well
+                train_size = faiss_params.get('train_sample_size') or min(n_vectors, max(64 * nlist, 39 * 2 ** pq_nbits))
+                logging.info(f"Training IVF-PQ index (nlist={nlist}, m={pq_m}, nbits={pq_nbits}) on {min(train_size, n_vectors)} vectors...")
+                index = build_ivf_pq(embeddings, metric, nlist, pq_m, pq_nbits, train_size, random_state)
+            build_params['train_sample_size'] = min(train_size, n_vectors)
+            logging.info("FAISS index training complete.")
+        elif index_type == "HNSW":
+            hnsw_m = faiss_params.get('hnsw_m', 32)
+            ef_construction = faiss_params.get('ef_construction', 200)
+            build_params.update({'hnsw_m': hnsw_m, 'ef_construction': ef_construction})
+            index = build_hnsw(embeddings, metric, hnsw_m, ef_construction)
         else:
             # For more complex indices specified by a factory string
             # e.g., "IVF256,Flat" or "PCA64,IVF256,PQ8"
-            # This requires training if it's not a flat index.
-            # For simplicity, this example focuses on flat indices.
-            # If using a factory string for non-flat indices, you'd need:
-            # if not index.is_trained: index.train(embeddings)
-            index = faiss.index_factory(dimension, index_type)
+            index = faiss.index_factory(dimension, index_type, metric)
             logging.info(f"Using FAISS index factory for type: {index_type}")
+            if not index.is_trained:
+                train_size = faiss_params.get('train_sample_size') or n_vectors
+                logging.info(f"Training FAISS index of type {index_type}...")
+                index.train(sample_training_vectors(embeddings, train_size, random_state))
+                logging.info("FAISS index training complete.")
 
+        add_in_blocks(index, embeddings)
+        logging.info(f"FAISS index built with {index.ntotal} vectors. Index type: {index_type}")
+        return index, build_params
+    except Exception as e:
+        logging.error(f"Error building FAISS index: {e}")
+        raise
 
-        if not index.is_trained and index_type not in ["IndexFlatL2", "IndexFlatIP"]: # Flat indices don't need training
-             logging.info(f"Training FAISS index of type {index_type}...")
-             index.train(embeddings)
-             logging.info("FAISS index training complete.")
+def get_tunable_parameter(index):
+    """Returns the name and candidate values of the runtime search parameter, or (None, []) for exact indices."""
+    base_index = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexPreTransform) else index
+    if isinstance(base_index, faiss.IndexIVF):
+        candidates = [1 << i for i in range(int(np.log2(base_index.nlist)) + 1)]
+        if candidates[-1] != base_index.nlist:
+            candidates.append(base_index.nlist)
+        return 'nprobe', candidates
+    if isinstance(base_index, faiss.IndexHNSW):
+        return 'efSearch', [16, 32, 64, 128, 256, 512, 1024]
+    return None, []
 
+def exact_knn(queries, embeddings, k, metric, block_size=65536):
+    """
+    Exact k nearest neighbors of queries among embeddings, searched one float32 block of
+    embeddings at a time and merged, so the corpus is never copied into a flat index.
+    Returns (distances, indices), each (n_queries, k), best first.
+    """
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    distances = np.empty((len(queries), 0), dtype=np.float32)
+    indices = np.empty((len(queries), 0), dtype=np.int64)
+    for start in range(0, embeddings.shape[0], block_size):
+        block = np.ascontiguousarray(embeddings[start:start + block_size], dtype=np.float32)
+        block_distances, block_indices = faiss.knn(queries, block, min(k, len(block)), metric=metric)
+        distances = np.hstack([distances, block_distances])
+        indices = np.hstack([indices, block_indices + start])
+        order = np.argsort(-distances if metric == faiss.METRIC_INNER_PRODUCT else distances, axis=1, kind='stable')[:, :k]
+        distances = np.take_along_axis(distances, order, axis=1)
+        indices = np.take_along_axis(indices, order, axis=1)
+    return distances, indices
 
-        index.add(embeddings)
-        logging.info(f"FAISS index built with {index.ntotal} vectors. Index type: {index_type}")
-        return index
+def recall_at_k(approx_indices, exact_indices, k):
+    """Mean fraction of the exact top-k that the approximate search also returned."""
+    hits = [len(np.intersect1d(approx[:k], exact[:k])) for approx, exact in zip(approx_indices, exact_indices)]
+    return float(np.mean(hits)) / k
+
+def autotune_search_params(index, embeddings, metric, target_recall=0.95, k=10, n_queries=1000, random_state=42):
+    """
+    Picks the cheapest runtime parameter (nprobe for IVF, efSearch for HNSW) whose
+    recall@k against exact search reaches target_recall on a sample of corpus vectors.
+    Each query's own row is removed from both result lists, so it is held out.
+    Returns a dict with the chosen search parameters and the measured recall.
+    """
+    param_name, candidates = get_tunable_parameter(index)
+    if param_name is None:
+        logging.info("Index performs exact search; no runtime parameters to tune.")
+        return {'search_params': {}, 'recall_at_k': 1.0, 'k': k}
+
+    rng = np.random.default_rng(random_state)
+    n_queries = min(n_queries, embeddings.shape[0])
+    query_rows = np.sort(rng.choice(embeddings.shape[0], size=n_queries, replace=False))
+    queries = np.ascontiguousarray(embeddings[query_rows], dtype=np.float32)
+
+    def drop_self(indices):
+        return [row[row != query_row][:k] for row, query_row in zip(indices, query_rows)]
+
+    _, exact_indices = exact_knn(queries, embeddings, k + 1, metric)
+    exact_indices = drop_self(exact_indices)
+
+    parameter_space = faiss.ParameterSpace()
+    chosen_value, chosen_recall = None, 0.0
+    for value in candidates:
+        parameter_space.set_index_parameter(index, param_name, value)
+        _, approx_indices = index.search(queries, k + 1)
+        recall = recall_at_k(drop_self(approx_indices), exact_indices, k)
+        logging.info(f"Auto-tune: {param_name}={value} -> recall@{k}={recall:.4f}")
+        chosen_value, chosen_recall = value, recall
+        if recall >= target_recall:
+            break
+    else:
+        logging.warning(f"Target recall@{k}={target_recall} not reached; using {param_name}={chosen_value} (recall {chosen_recall:.4f}).")
+
+    parameter_space.set_index_parameter(index, param_name, chosen_value)
+    logging.info(f"Auto-tune selected {param_name}={chosen_value} (recall@{k}={chosen_recall:.4f}).")
+    return {'search_params': {param_name: chosen_value}, 'recall_at_k': chosen_recall, 'k': k, 'target_recall': target_recall}
+
+def index_params_path(index_path):
+    """Path of the JSON file holding build and tuned search parameters, next to the index."""
+    return Path(index_path).with_suffix('.params.json')
+
+def save_index_params(params, index_path):
+    """Saves build and tuned search parameters next to the index so the app can apply them."""
+    params_path = index_params_path(index_path)
+    try:
+        with open(params_path, 'w') as f:
+            json.dump(params, f, indent=2)
+        logging.info(f"FAISS index parameters saved to {params_path}")
     except Exception as e:
-        logging.error(f"Error building FAISS index: {e}")
+        logging.error(f"Error saving FAISS index parameters: {e}")
         raise
 
 def save_faiss_index(index, file_path):
@@ -79,7 +257,10 @@ def save_faiss_index(index, file_path):
         logging.warning("FAISS index is None, nothing to save.")
         return
     try:
-        faiss.write_index(index, file_path)
+        # Write then rename: app processes that memory-map the old index keep a valid file
+        tmp_path = f"{file_path}.tmp"
+        faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, file_path)
         logging.info(f"FAISS index saved to {file_path}")
     except Exception as e:
         logging.error(f"Error saving FAISS index: {e}")
@@ -97,8 +278,25 @@ def main():
         logging.warning("No embeddings loaded. Cannot build FAISS index.")
         return
 
-    faiss_index = build_faiss_index(embeddings, faiss_config['index_type'])
+    faiss_index, build_params = build_faiss_index(embeddings, faiss_config['index_type'], faiss_config)
+    if faiss_index is None:
+        return
+
+    autotune_config = faiss_config.get('autotune') or {}
+    tuning = {'search_params': faiss_config.get('search_params') or {}} # Used as-is when auto-tuning is off
+    if autotune_config.get('enabled', True):
+        tuning = autotune_search_params(
+            faiss_index,
+            embeddings,
+            get_metric(faiss_config['index_type'], faiss_config),
+            target_recall=autotune_config.get('target_recall', 0.95),
+            k=autotune_config.get('k', 10),
+            n_queries=autotune_config.get('n_queries', 1000),
+            random_state=faiss_config.get('random_state', 42)
+        )
+
     save_faiss_index(faiss_index, paths_config['faiss_index'])
+    save_index_params({'build_params': build_params, **tuning}, paths_config['faiss_index'])
     logging.info("FAISS index building process finished successfully.")
 
 if __name__ == "__main__":
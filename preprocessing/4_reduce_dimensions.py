@@ -1,15 +1,25 @@
 # preprocessing/4_reduce_dimensions.py
 import pandas as pd
 import numpy as np
+import faiss
+import joblib
 from umap import UMAP
 import yaml
+import json
 import logging
+import os
 
 from pathlib import Path
+import sys
 
 # Get the parent directory of the current script
 parent_dir = Path(__file__).parent.parent
 
+# The embedding store format and FAISS helpers are shared with the app
+sys.path.insert(0, str(parent_dir / "app"))
+import embedding_store
+import search_engine
+
 # Configure basic logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -19,9 +29,9 @@ def load_config(config_path=parent_dir / "config.yaml"):
         return yaml.safe_load(f)
 
 def load_embeddings(file_path):
-    """Loads embeddings from a .npy file."""
+    """Opens the embedding store memory-mapped."""
     try:
-        embeddings = np.load(file_path)
+        embeddings = embedding_store.open_embeddings(file_path)
         logging.info(f"Embeddings loaded from {file_path}. Shape: {embeddings.shape}")
         return embeddings
     except FileNotFoundError:
@@ -44,31 +54,351 @@ def load_processed_data(file_path):
         logging.error(f"Error loading processed data: {e}")
         raise
 
+def make_reducer(umap_params, **overrides):
+    """Creates a UMAP reducer from the 'umap_params' config section."""
+    reducer_args = dict(
+        n_neighbors=umap_params['n_neighbors'],
+        min_dist=umap_params['min_dist'],
+        n_components=umap_params['n_components'],
+        metric=umap_params['metric'],
+        random_state=umap_params.get('random_state', 42), # Ensure reproducibility
+        verbose=True
+    )
+    reducer_args.update(overrides)
+    return UMAP(**reducer_args)
+
 def reduce_dimensions_umap(embeddings, umap_params):
     """
     Reduces dimensionality of embeddings using UMAP.
+    Returns (reduced_embeddings, fitted reducer).
     """
     if embeddings.shape[0] == 0:
         logging.warning("No embeddings provided for dimensionality reduction.")
-        return None
+        return None, None
 
     try:
-        reducer = UMAP(
-            n_neighbors=umap_params['n_neighbors'],
-            min_dist=umap_params['min_dist'],
-            n_components=umap_params['n_components'],
-            metric=umap_params['metric'],
-            random_state=umap_params.get('random_state', 42), # Ensure reproducibility
-            verbose=True
-        )
+        reducer = make_reducer(umap_params)
         logging.info(f"Starting UMAP dimensionality reduction to {umap_params['n_components']} components...")
-        reduced_embeddings = reducer.fit_transform(embeddings)
+        reduced_embeddings = reducer.fit_transform(embeddings.to_float32()) # UMAP needs every row at once
         logging.info(f"UMAP reduction complete. Reduced shape: {reduced_embeddings.shape}")
-        return reduced_embeddings
+        return reduced_embeddings, reducer
     except Exception as e:
         logging.error(f"Error during UMAP dimensionality reduction: {e}")
         raise
 
+# Index metric -> UMAP metrics whose distances search_engine.to_distances reproduces
+COMPATIBLE_UMAP_METRICS = {
+    'inner_product': {'cosine', 'correlation'}, # Same ranking for normalized embeddings
+    'l2': {'euclidean', 'l2'},
+}
+
+def load_index_for_knn(index_path):
+    """Opens the stage 3 FAISS index (memory-mapped) with its tuned search parameters."""
+    index, _ = search_engine.read_faiss_index(index_path, mmap=True)
+    params_path = Path(index_path).with_suffix('.params.json')
+    if params_path.exists():
+        with open(params_path, 'r') as f:
+            search_engine.apply_search_params(index, json.load(f).get('search_params'))
+    return index
+
+def build_knn_graph(embeddings, index, n_neighbors, batch_size=4096):
+    """
+    Builds the k-nearest-neighbor graph UMAP needs by searching every stored vector
+    against the FAISS index, batch by batch.
+    Returns (knn_indices int64, knn_dists float32), both (n, n_neighbors), with each
+    row's own id first at distance 0 as UMAP expects. Missing results stay -1.
+    """
+    n_rows = len(embeddings)
+    knn_indices = np.full((n_rows, n_neighbors), -1, dtype=np.int64)
+    knn_dists = np.zeros((n_rows, n_neighbors), dtype=np.float32)
+    for start, block in embeddings.iter_blocks(batch_size):
+        scores, indices = index.search(np.ascontiguousarray(block), n_neighbors)
+        distances = search_engine.to_distances(scores, index.metric_type)
+        row_ids = np.arange(start, start + len(block))
+
+        # Approximate indexes (and duplicate articles) do not always return the row itself first
+        misordered = np.flatnonzero(indices[:, 0] != row_ids)
+        for i in misordered:
+            others = indices[i] != row_ids[i]
+            indices[i] = np.concatenate(([row_ids[i]], indices[i][others]))[:n_neighbors]
+            distances[i] = np.concatenate(([0.0], distances[i][others]))[:n_neighbors]
+        distances[:, 0] = 0.0
+
+        missing = indices < 0
+        if missing.any(): # Pad with the row's largest found distance; UMAP skips -1 neighbors
+            fill = np.where(missing, -np.inf, distances).max(axis=1, keepdims=True)
+            distances = np.where(missing, fill, distances)
+        knn_indices[start:start + len(block)] = indices
+        knn_dists[start:start + len(block)] = distances
+        logging.info(f"kNN graph: {start + len(block)}/{n_rows} rows searched.")
+    return knn_indices, knn_dists
+
+def knn_graph_signature(embeddings_path, index_path, n_rows, n_neighbors):
+    """Identifies the inputs a stored kNN graph was built from."""
+    return {
+        'rows': int(n_rows),
+        'n_neighbors': int(n_neighbors),
+        'embeddings_mtime': os.path.getmtime(embeddings_path),
+        'index_mtime': os.path.getmtime(index_path),
+    }
+
+def load_or_build_knn_graph(embeddings, embeddings_path, index_path, graph_path, n_neighbors, umap_metric="cosine", batch_size=4096):
+    """
+    Returns the kNN graph for the stored embeddings, reusing graph_path when it was built
+    from the same embeddings and index with at least n_neighbors neighbors, so the 2D and
+    3D layouts (or any re-run with new UMAP settings) share one graph.
+    """
+    signature = knn_graph_signature(embeddings_path, index_path, len(embeddings), n_neighbors)
+    if graph_path and os.path.exists(graph_path):
+        with np.load(graph_path) as graph:
+            stored_signature = json.loads(str(graph['signature']))
+            reusable = stored_signature['n_neighbors'] >= n_neighbors and all(
+                stored_signature[key] == signature[key] for key in ('rows', 'embeddings_mtime', 'index_mtime')
+            )
+            if reusable:
+                logging.info(f"Reusing kNN graph from {graph_path} ({stored_signature['n_neighbors']} neighbors).")
+                return graph['knn_indices'][:, :n_neighbors], graph['knn_dists'][:, :n_neighbors]
+        logging.info(f"kNN graph at {graph_path} is stale. Rebuilding.")
+
+    index = load_index_for_knn(index_path)
+    index_metric = 'inner_product' if index.metric_type == faiss.METRIC_INNER_PRODUCT else 'l2'
+    if umap_metric not in COMPATIBLE_UMAP_METRICS[index_metric]:
+        logging.warning(f"UMAP metric '{umap_metric}' does not match the FAISS index metric '{index_metric}'. The kNN graph uses the index metric.")
+    logging.info(f"Building {n_neighbors}-NN graph for {len(embeddings)} rows with the FAISS index...")
+    knn_indices, knn_dists = build_knn_graph(embeddings, index, n_neighbors, batch_size)
+    if graph_path:
+        with open(graph_path, 'wb') as f:
+            np.savez(f, knn_indices=knn_indices, knn_dists=knn_dists, signature=json.dumps(signature))
+        logging.info(f"kNN graph saved to {graph_path}")
+    return knn_indices, knn_dists
+
+def reduce_dimensions_faiss_knn(embeddings, umap_params, knn_graph):
+    """Runs UMAP on a precomputed kNN graph instead of its own nearest-neighbor descent."""
+    knn_indices, knn_dists = knn_graph
+    reducer = make_reducer(umap_params, precomputed_knn=(knn_indices, knn_dists, None))
+    logging.info(f"Starting UMAP reduction to {umap_params['n_components']} components on the precomputed kNN graph...")
+    reduced_embeddings = reducer.fit_transform(embeddings.to_float32())
+    logging.info(f"UMAP reduction complete. Reduced shape: {reduced_embeddings.shape}")
+    return reduced_embeddings
+
+def stratified_sample(df, column, sample_size, random_state=42):
+    """
+    Returns sorted row positions of a sample of about sample_size rows, with each value
+    of `column` represented in proportion to its frequency (at least one row each).
+    Falls back to a uniform sample when the column is missing.
+    """
+    rng = np.random.default_rng(random_state)
+    n_rows = len(df)
+    if sample_size >= n_rows:
+        return np.arange(n_rows)
+    if not column or column not in df.columns:
+        return np.sort(rng.choice(n_rows, size=sample_size, replace=False))
+
+    fraction = sample_size / n_rows
+    sampled = []
+    for rows in df.groupby(column, sort=False, dropna=False).indices.values():
+        n_take = min(len(rows), max(1, int(round(len(rows) * fraction))))
+        sampled.append(rng.choice(rows, size=n_take, replace=False))
+    return np.sort(np.concatenate(sampled))
+
+def reduce_dimensions_sample(embeddings, df, umap_params):
+    """
+    Fits UMAP on a stratified sample, then projects the remaining rows with
+    reducer.transform in chunks. Returns (reduced_embeddings, fitted reducer).
+    """
+    sample_rows = stratified_sample(
+        df,
+        umap_params.get('stratify_by'),
+        umap_params.get('sample_size', 100000),
+        umap_params.get('random_state', 42)
+    )
+    reducer = make_reducer(umap_params)
+    logging.info(f"Fitting UMAP on a sample of {len(sample_rows)}/{len(embeddings)} rows...")
+    reduced_embeddings = np.zeros((len(embeddings), umap_params['n_components']), dtype=np.float32)
+    reduced_embeddings[sample_rows] = reducer.fit_transform(embeddings[sample_rows])
+
+    remaining_rows = np.setdiff1d(np.arange(len(embeddings)), sample_rows, assume_unique=True)
+    chunk_size = umap_params.get('transform_chunk_size', 50000)
+    for start in range(0, len(remaining_rows), chunk_size):
+        chunk_rows = remaining_rows[start:start + chunk_size]
+        reduced_embeddings[chunk_rows] = reducer.transform(embeddings[chunk_rows])
+        logging.info(f"Projected {start + len(chunk_rows)}/{len(remaining_rows)} remaining rows.")
+    logging.info(f"UMAP reduction complete. Reduced shape: {reduced_embeddings.shape}")
+    return reduced_embeddings, reducer
+
+def coordinate_columns(n_components):
+    return ['x', 'y', 'z'][:n_components]
+
+def save_reducer(reducer, file_path):
+    """Persists a fitted reducer so append runs can place new rows with its transform."""
+    joblib.dump(reducer, file_path)
+    logging.info(f"UMAP reducer saved to {file_path}")
+
+def load_reducer(file_path):
+    """Loads a persisted reducer, or returns None if there is none."""
+    if not file_path or not os.path.exists(file_path):
+        return None
+    reducer = joblib.load(file_path)
+    logging.info(f"UMAP reducer loaded from {file_path}")
+    return reducer
+
+def load_map_coordinates(file_path, n_components):
+    """
+    Loads the persisted map coordinates (id plus x/y[/z]). They are kept apart from the
+    processed records, which stage 1 rewrites without coordinates.
+    Returns None when there are none for this number of components.
+    """
+    if not file_path or not os.path.exists(file_path):
+        return None
+    coordinates = pd.read_parquet(file_path)
+    if not set(coordinate_columns(n_components)).issubset(coordinates.columns):
+        logging.warning(f"Map coordinates at {file_path} do not have {n_components} components. Ignoring them.")
+        return None
+    return coordinates[['id'] + coordinate_columns(n_components)].drop_duplicates('id', keep='last')
+
+def save_map_coordinates(df, n_components, file_path):
+    """Saves the id and coordinates of every row, so later append runs keep them fixed."""
+    df[['id'] + coordinate_columns(n_components)].to_parquet(file_path, index=False)
+    logging.info(f"Map coordinates saved to {file_path}")
+
+def existing_coordinates(df, coordinates, n_components):
+    """
+    Returns an (n, n_components) array with each row's known coordinates, NaN for rows
+    without any. Uses the persisted coordinates (matched by id), falling back to
+    coordinate columns already present in df.
+    """
+    columns = coordinate_columns(n_components)
+    if coordinates is not None:
+        merged = df[['id']].merge(coordinates, on='id', how='left')
+        return merged[columns].to_numpy(dtype=np.float32)
+    if set(columns).issubset(df.columns):
+        return df[columns].to_numpy(dtype=np.float32)
+    return np.full((len(df), n_components), np.nan, dtype=np.float32)
+
+def search_among_rows(embeddings, query_rows, index, allowed_rows, k, batch_size=4096):
+    """
+    Finds the k nearest neighbors of the given rows among allowed_rows only (IDSelector),
+    batch by batch. Returns (scores, indices) with -1 for missing results.
+    """
+    selector = search_engine.build_id_selector(allowed_rows)
+    params = search_engine.filtered_search_params(index, selector)
+    scores = np.zeros((len(query_rows), k), dtype=np.float32)
+    indices = np.full((len(query_rows), k), -1, dtype=np.int64)
+    for start in range(0, len(query_rows), batch_size):
+        rows = query_rows[start:start + batch_size]
+        scores[start:start + len(rows)], indices[start:start + len(rows)] = index.search(
+            np.ascontiguousarray(embeddings[rows]), k, params=params
+        )
+    return scores, indices
+
+def interpolate_from_neighbors(coords, scores, indices, metric_type, power=1.0):
+    """
+    Places each row at the inverse-distance weighted mean of its neighbors' coordinates,
+    the batched form of search_engine.place_by_neighbors.
+    """
+    weights = search_engine.neighbor_weights(scores, metric_type, power)
+    weights[indices < 0] = 0.0
+    neighbor_coords = coords[np.maximum(indices, 0)]
+    return (weights[:, :, None] * neighbor_coords).sum(axis=1) / weights.sum(axis=1, keepdims=True)
+
+def exclude_self(scores, indices, query_rows):
+    """
+    Each row's best result that is not the row itself, as (n, 1) scores and indices
+    (-1 if there is none), from a search of the rows among a set that contains them.
+    """
+    not_self = indices != np.asarray(query_rows)[:, None]
+    first = np.argmax(not_self, axis=1)
+    rows = np.arange(len(indices))
+    found = not_self[rows, first]
+    return scores[rows, first][:, None], np.where(found, indices[rows, first], -1)[:, None]
+
+def nearest_distances(scores, indices, metric_type):
+    """Distance from each row to its nearest returned neighbor (NaN if none)."""
+    distances = search_engine.to_distances(scores[:, 0], metric_type)
+    return np.where(indices[:, 0] >= 0, distances, np.nan)
+
+def compute_drift(new_nn_distances, baseline_nn_distances, n_new, n_total):
+    """
+    Drift of an append run relative to the fitted layout:
+    - new_fraction: share of rows placed without a refit.
+    - distance_ratio: median distance from new rows to their nearest mapped row, divided
+      by the same median for mapped rows. Well above 1, new rows fall where the map has no articles.
+    """
+    baseline = float(np.nanmedian(baseline_nn_distances)) if len(baseline_nn_distances) else float('nan')
+    new = float(np.nanmedian(new_nn_distances)) if len(new_nn_distances) else float('nan')
+    return {
+        'n_new': int(n_new),
+        'n_total': int(n_total),
+        'new_fraction': n_new / n_total if n_total else 0.0,
+        'new_median_nn_distance': new,
+        'baseline_median_nn_distance': baseline,
+        'distance_ratio': new / baseline if baseline > 0 else float('nan'),
+    }
+
+def append_coordinates(df, embeddings, umap_params, paths_config):
+    """
+    Computes coordinates only for rows that have none yet, leaving existing ones untouched.
+    New rows are projected with the persisted reducer's transform, or placed from their
+    FAISS neighbors among mapped rows when no transform-capable reducer is stored.
+    Returns (reduced_embeddings for every row, drift report), or (None, None) if a full run is needed.
+    """
+    n_components = umap_params['n_components']
+    append_config = umap_params.get('append') or {}
+    coords = existing_coordinates(df, load_map_coordinates(paths_config.get('map_coordinates'), n_components), n_components)
+    is_new = np.isnan(coords).any(axis=1)
+    new_rows, mapped_rows = np.flatnonzero(is_new), np.flatnonzero(~is_new)
+    if len(mapped_rows) == 0:
+        logging.error("No existing map coordinates to append to. Run a full reduction first.")
+        return None, None
+    logging.info(f"Append mode: {len(new_rows)} new rows, {len(mapped_rows)} rows keep their coordinates.")
+
+    index = load_index_for_knn(paths_config['faiss_index'])
+    if index.ntotal != len(df):
+        logging.error(f"FAISS index has {index.ntotal} vectors but there are {len(df)} records. Re-run stage 3 first.")
+        return None, None
+    k = append_config.get('n_neighbors', 10)
+    batch_size = umap_params.get('knn_batch_size', 4096)
+
+    # Neighbors of the new rows among mapped rows: used for drift and, if needed, placement
+    new_scores, new_indices = search_among_rows(embeddings, new_rows, index, mapped_rows, k, batch_size)
+    rng = np.random.default_rng(umap_params.get('random_state', 42))
+    baseline_rows = rng.choice(mapped_rows, size=min(len(mapped_rows), append_config.get('baseline_sample_size', 2000)), replace=False)
+    # Searched among all mapped rows (the sample may be all of them), skipping each row's own hit
+    baseline_scores, baseline_indices = exclude_self(
+        *search_among_rows(embeddings, baseline_rows, index, mapped_rows, 2, batch_size), baseline_rows
+    )
+
+    if len(new_rows):
+        reducer = load_reducer(paths_config.get('umap_reducer')) if append_config.get('placement', "transform") == "transform" else None
+        if reducer is not None and reducer.n_components == n_components:
+            logging.info(f"Projecting {len(new_rows)} new rows with the persisted reducer...")
+            chunk_size = umap_params.get('transform_chunk_size', 50000)
+            for start in range(0, len(new_rows), chunk_size):
+                chunk_rows = new_rows[start:start + chunk_size]
+                coords[chunk_rows] = reducer.transform(embeddings[chunk_rows])
+        else:
+            logging.info(f"Placing {len(new_rows)} new rows from their {k} nearest mapped neighbors...")
+            coords[new_rows] = interpolate_from_neighbors(coords, new_scores, new_indices, index.metric_type)
+
+    drift = compute_drift(
+        nearest_distances(new_scores, new_indices, index.metric_type),
+        nearest_distances(baseline_scores, baseline_indices, index.metric_type),
+        len(new_rows),
+        len(df)
+    )
+    drift['refit_recommended'] = bool(
+        drift['new_fraction'] > append_config.get('max_new_fraction', 0.2)
+        or drift['distance_ratio'] > append_config.get('max_distance_ratio', 1.5)
+    )
+    return coords, drift
+
+def save_drift_report(drift, coordinates_path):
+    """Writes the append run's drift report next to the map coordinates."""
+    report_path = Path(coordinates_path).with_suffix('.drift.json')
+    with open(report_path, 'w') as f:
+        json.dump(drift, f, indent=2)
+    logging.info(f"Drift report saved to {report_path}")
+
 def add_coordinates_to_dataframe(df, reduced_embeddings, n_components):
     """
     Adds the reduced dimension coordinates (x, y, possibly z) to the DataFrame.
@@ -87,10 +417,16 @@ def add_coordinates_to_dataframe(df, reduced_embeddings, n_components):
     logging.info("Added UMAP coordinates (x, y" + (", z" if n_components == 3 and 'z' in df.columns else "") + ") to DataFrame.")
     return df
 
-def save_data_with_coordinates(df, file_path):
-    """Saves the DataFrame (now with coordinates) back to Parquet."""
+def save_data_with_coordinates(df, file_path, row_group_size=None):
+    """
+    Saves the DataFrame (now with coordinates) back to Parquet, in row groups of
+    row_group_size rows for the app's on-demand detail lookups. Writes then renames,
+    so running app processes that read details from the old file keep a valid file.
+    """
     try:
-        df.to_parquet(file_path, index=False)
+        tmp_path = f"{file_path}.tmp"
+        df.to_parquet(tmp_path, index=False, row_group_size=row_group_size)
+        os.replace(tmp_path, file_path)
         logging.info(f"DataFrame with coordinates saved to {file_path}")
     except Exception as e:
         logging.error(f"Error saving DataFrame with coordinates: {e}")
@@ -117,11 +453,52 @@ def main():
         logging.error(f"Mismatch between number of records in processed data ({len(df_processed)}) and number of embeddings ({len(embeddings)}). Aborting.")
         return
 
-    reduced_embeddings = reduce_dimensions_umap(embeddings, umap_config)
+    mode = umap_config.get('mode', "full")
+    reducer = None
+    if mode == "append":
+        reduced_embeddings, drift = append_coordinates(df_processed, embeddings, umap_config, paths_config)
+        if drift is not None:
+            logging.info(
+                f"Map drift: {drift['new_fraction']:.1%} new rows, nearest-neighbor distance ratio {drift['distance_ratio']:.2f}."
+            )
+            if drift['refit_recommended']:
+                logging.warning("New articles differ markedly from the mapped ones. A full refit (mode: full, faiss_knn or sample) is recommended.")
+            if paths_config.get('map_coordinates'):
+                save_drift_report(drift, paths_config['map_coordinates'])
+    elif mode == "faiss_knn":
+        knn_graph = load_or_build_knn_graph(
+            embeddings,
+            paths_config['embeddings'],
+            paths_config['faiss_index'],
+            umap_config.get('knn_graph_path'),
+            umap_config['n_neighbors'],
+            umap_config['metric'],
+            umap_config.get('knn_batch_size', 4096)
+        )
+        reduced_embeddings = reduce_dimensions_faiss_knn(embeddings, umap_config, knn_graph)
+    elif mode == "sample":
+        reduced_embeddings, reducer = reduce_dimensions_sample(embeddings, df_processed, umap_config)
+    else:
+        reduced_embeddings, reducer = reduce_dimensions_umap(embeddings, umap_config)
+
+    if mode != "append" and paths_config.get('umap_reducer'):
+        # faiss_knn reducers cannot transform new data; drop any older reducer so append runs
+        # fall back to neighbor placement instead of projecting into a different layout.
+        # A full-mode reducer pickles every embedding and the whole kNN graph, so by default
+        # only the (sample-sized) reducer of sample mode is kept.
+        keep_reducer = umap_config.get('save_reducer')
+        if keep_reducer is None:
+            keep_reducer = mode == "sample"
+        if reducer is not None and keep_reducer:
+            save_reducer(reducer, paths_config['umap_reducer'])
+        elif os.path.exists(paths_config['umap_reducer']):
+            os.remove(paths_config['umap_reducer'])
 
     if reduced_embeddings is not None:
         df_with_coords = add_coordinates_to_dataframe(df_processed, reduced_embeddings, umap_config['n_components'])
-        save_data_with_coordinates(df_with_coords, paths_config['processed_data']) # Overwrite with new columns
+        save_data_with_coordinates(df_with_coords, paths_config['processed_data'], (config.get('storage') or {}).get('row_group_size')) # Overwrite with new columns
+        if paths_config.get('map_coordinates'):
+            save_map_coordinates(df_with_coords, umap_config['n_components'], paths_config['map_coordinates'])
         logging.info("Dimensionality reduction process finished successfully.")
     else:
         logging.warning("Dimensionality reduction failed or produced no output.")
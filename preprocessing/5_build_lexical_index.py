@@ -0,0 +1,131 @@
+# preprocessing/5_build_lexical_index.py
+import numpy as np
+import pyarrow.parquet as pq
+import yaml
+import logging
+import sys
+from pathlib import Path
+
+from scipy import sparse
+
+# Get the parent directory of the current script
+parent_dir = Path(__file__).parent.parent
+
+# The tokenizer and index format are shared with the app
+sys.path.insert(0, str(parent_dir / "app"))
+import lexical_index
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_FIELD_WEIGHTS = {'title': 2.0, 'abstract': 1.0, 'authors': 1.0}
+
+def load_config(config_path=parent_dir / "config.yaml"):
+    """Loads the YAML configuration file."""
+    with open(config_path, 'r') as f:
+        return yaml.safe_load(f)
+
+def count_terms(file_path, field_weights, batch_size=50000):
+    """
+    Tokenizes the indexed fields of the processed records, row group batch by batch.
+    A field's term counts are multiplied by its weight (e.g. title terms count double).
+    Returns (terms in first-seen order, posting term ids, posting row ids, weighted term
+    frequencies, document lengths); one posting per distinct (row, term).
+    """
+    parquet_file = pq.ParquetFile(file_path)
+    fields = [field for field in field_weights if field in parquet_file.schema_arrow.names]
+    missing = [field for field in field_weights if field not in fields]
+    if missing:
+        logging.warning(f"Fields not in {file_path}, not indexed: {', '.join(missing)}")
+    if not fields:
+        raise ValueError(f"None of the fields {list(field_weights)} are in {file_path}.")
+
+    vocabulary = {}
+    term_ids, row_ids, frequencies, doc_lengths = [], [], [], []
+    first_row = 0
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=fields):
+        n_rows = batch.num_rows
+        batch_rows, batch_terms, batch_counts = [], [], []
+        for field in fields:
+            field_counts = lexical_index.count_batch_terms(lexical_index.field_texts(batch.column(field).to_pylist()), vocabulary)
+            if field_counts is None: # Every text in the batch is empty or only stop words
+                continue
+            batch_rows.append(field_counts.row)
+            batch_terms.append(field_counts.col)
+            batch_counts.append(field_counts.data * field_weights[field])
+        if batch_rows:
+            # Converting to CSR sums the counts of a term found in several fields
+            counts = sparse.csr_matrix(
+                (np.concatenate(batch_counts), (np.concatenate(batch_rows), np.concatenate(batch_terms))),
+                shape=(n_rows, len(vocabulary))
+            )
+            doc_lengths.append(np.asarray(counts.sum(axis=1), dtype=np.float32).ravel())
+            counts = counts.tocoo()
+            term_ids.append(counts.col.astype(np.int32))
+            row_ids.append((counts.row + first_row).astype(np.int32))
+            frequencies.append(counts.data.astype(np.float32))
+        else:
+            doc_lengths.append(np.zeros(n_rows, dtype=np.float32))
+        first_row += n_rows
+        logging.info(f"Tokenized {first_row} records ({len(vocabulary)} terms so far).")
+
+    concat = lambda parts, dtype: np.concatenate(parts) if parts else np.array([], dtype=dtype)
+    return list(vocabulary), concat(term_ids, np.int32), concat(row_ids, np.int32), concat(frequencies, np.float32), concat(doc_lengths, np.float32)
+
+def build_postings(terms, term_ids, row_ids, frequencies, doc_lengths, k1=1.2, b=0.75):
+    """
+    Sorts the vocabulary, computes BM25 impacts and groups postings by term, each term's
+    postings ordered by impact (highest first). Returns (sorted terms, offsets, row ids, impacts).
+    """
+    n_docs = len(doc_lengths)
+    # Renumber terms so ids follow the sorted vocabulary (the reader looks terms up by binary search)
+    order = np.argsort(np.asarray(terms, dtype=object)).astype(np.int64)
+    new_id = np.empty(len(terms), dtype=np.int64)
+    new_id[order] = np.arange(len(terms))
+    term_ids = new_id[term_ids]
+    sorted_terms = [terms[i] for i in order]
+
+    document_frequencies = np.bincount(term_ids, minlength=len(terms))
+    impacts = lexical_index.bm25_impacts(
+        frequencies, doc_lengths[row_ids], document_frequencies[term_ids], n_docs,
+        avgdl=float(doc_lengths.mean()) if n_docs else 1.0, k1=k1, b=b
+    ).astype(np.float32)
+
+    postings = np.lexsort((row_ids, -impacts, term_ids)) # By term, then impact descending, then row
+    offsets = np.concatenate(([0], np.cumsum(document_frequencies))).astype(np.int64)
+    return sorted_terms, offsets, row_ids[postings], impacts[postings]
+
+def main():
+    """Main function to orchestrate building the lexical (BM25) index."""
+    logging.info("Starting lexical index building process...")
+    config = load_config()
+    paths_config = config['paths']
+    hybrid_config = config.get('hybrid_search') or {}
+    field_weights = hybrid_config.get('field_weights') or DEFAULT_FIELD_WEIGHTS
+    k1, b = hybrid_config.get('k1', 1.2), hybrid_config.get('b', 0.75)
+
+    terms, term_ids, row_ids, frequencies, doc_lengths = count_terms(
+        paths_config['processed_data'], field_weights, hybrid_config.get('batch_size', 50000)
+    )
+    if len(doc_lengths) == 0:
+        logging.warning("No processed records found. Cannot build lexical index.")
+        return
+
+    sorted_terms, offsets, posting_rows, impacts = build_postings(terms, term_ids, row_ids, frequencies, doc_lengths, k1, b)
+    lexical_index.write_lexical_index(
+        paths_config['lexical_index'], sorted_terms, offsets, posting_rows, impacts,
+        meta={
+            'n_docs': int(len(doc_lengths)),
+            'n_terms': len(sorted_terms),
+            'n_postings': int(len(posting_rows)),
+            'avgdl': float(doc_lengths.mean()),
+            'k1': k1,
+            'b': b,
+            'field_weights': field_weights,
+            'source': str(paths_config['processed_data']),
+        }
+    )
+    logging.info("Lexical index building process finished successfully.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# preprocessing/6_build_neighbor_table.py
+import numpy as np
+import faiss
+import yaml
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from pathlib import Path
+import sys
+
+# Get the parent directory of the current script
+parent_dir = Path(__file__).parent.parent
+
+# The embedding store, FAISS helpers and table format are shared with the app
+sys.path.insert(0, str(parent_dir / "app"))
+import embedding_store
+import neighbor_table
+import search_engine
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def load_config(config_path=parent_dir / "config.yaml"):
+    """Loads the YAML configuration file."""
+    with open(config_path, 'r') as f:
+        return yaml.safe_load(f)
+
+def load_index(index_path):
+    """Opens the stage 3 FAISS index memory-mapped, with its tuned search parameters."""
+    index, _ = search_engine.read_faiss_index(index_path, mmap=True)
+    params_path = Path(index_path).with_suffix('.params.json')
+    if params_path.exists():
+        with open(params_path, 'r') as f:
+            search_engine.apply_search_params(index, json.load(f).get('search_params'))
+    return index
+
+def drop_self(indices, scores, row_ids, k):
+    """
+    Removes each row itself from its search results and keeps k neighbors.
+    Approximate indexes (and duplicate articles) do not always return the row first, or at all;
+    rows that did not come back get their last result dropped instead.
+    """
+    is_self = indices == row_ids[:, None]
+    not_found = ~is_self.any(axis=1)
+    is_self[not_found, -1] = True
+    keep = ~is_self
+    return indices[keep].reshape(len(row_ids), k), scores[keep].reshape(len(row_ids), k)
+
+# Per-process state for the worker pool, opened once by init_worker
+_worker = {}
+
+def init_worker(index_path, embeddings_path, table_directory, k, batch_size, faiss_threads):
+    """Opens the (memory-mapped, so shared) index and embeddings in a worker process."""
+    if faiss_threads:
+        faiss.omp_set_num_threads(faiss_threads)
+    _worker.update(
+        index=load_index(index_path),
+        embeddings=embedding_store.open_embeddings(embeddings_path),
+        table_directory=table_directory, k=k, batch_size=batch_size,
+    )
+
+def search_chunk(bounds):
+    """Searches rows [start, stop) in batches and writes their neighbors into the table. Returns the row count."""
+    start, stop = bounds
+    index, embeddings, k = _worker['index'], _worker['embeddings'], _worker['k']
+    for batch_start in range(start, stop, _worker['batch_size']):
+        batch_stop = min(batch_start + _worker['batch_size'], stop)
+        queries = np.ascontiguousarray(embeddings[batch_start:batch_stop], dtype=np.float32)
+        scores, indices = index.search(queries, k + 1) # +1 for the row itself
+        indices, scores = drop_self(indices, scores, np.arange(batch_start, batch_stop), k)
+        scores = np.where(indices >= 0, scores, 0.0) # FAISS fills missing results with +-inf/max scores
+        neighbor_table.write_rows(_worker['table_directory'], batch_start, indices.astype(np.int32), scores.astype(np.float16))
+    return stop - start
+
+def build_neighbor_table(embeddings_path, index_path, table_directory, k=50, batch_size=4096, chunk_size=65536, n_workers=1):
+    """
+    Computes the k nearest neighbors of every stored embedding with the FAISS index and
+    writes them to table_directory. Rows are split into chunks of chunk_size, searched in
+    batches of batch_size by n_workers processes that each write their rows straight into
+    the memory-mapped output, so memory use does not grow with the corpus.
+    """
+    n_rows = len(embedding_store.open_embeddings(embeddings_path))
+    tmp_directory = neighbor_table.create_table(table_directory, n_rows, k)
+    chunks = [(start, min(start + chunk_size, n_rows)) for start in range(0, n_rows, chunk_size)]
+    faiss_threads = max(1, (os.cpu_count() or 1) // n_workers) if n_workers > 1 else None # Otherwise FAISS uses every core
+
+    init_args = (index_path, embeddings_path, tmp_directory, k, batch_size, faiss_threads)
+    done = 0
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker, initargs=init_args) as executor:
+            for rows in executor.map(search_chunk, chunks):
+                done += rows
+                logging.info(f"Neighbor table: {done}/{n_rows} rows searched.")
+    else:
+        init_worker(*init_args)
+        for chunk in chunks:
+            done += search_chunk(chunk)
+            logging.info(f"Neighbor table: {done}/{n_rows} rows searched.")
+
+    metric_type = load_index(index_path).metric_type # Memory-mapped, so this is cheap
+    neighbor_table.finish_table(table_directory, {
+        'n_rows': int(n_rows),
+        'k': int(k),
+        'metric': 'inner_product' if metric_type == faiss.METRIC_INNER_PRODUCT else 'l2',
+        'index_mtime': os.path.getmtime(index_path),
+        'embeddings_mtime': os.path.getmtime(embeddings_path),
+    })
+
+def main():
+    """Main function to orchestrate building the neighbor table."""
+    logging.info("Starting neighbor table building process...")
+    config = load_config()
+    paths_config = config['paths']
+    table_config = config.get('neighbor_table') or {}
+
+    if not os.path.exists(paths_config['faiss_index']):
+        logging.error(f"FAISS index not found: {paths_config['faiss_index']}. Run 3_build_index.py first.")
+        return
+    build_neighbor_table(
+        paths_config['embeddings'],
+        paths_config['faiss_index'],
+        paths_config['neighbor_table'],
+        k=table_config.get('k', 50),
+        batch_size=table_config.get('batch_size', 4096),
+        chunk_size=table_config.get('chunk_size', 65536),
+        n_workers=table_config.get('n_workers') or 1
+    )
+    logging.info("Neighbor table building process finished successfully.")
+
+if __name__ == "__main__":
+    main()
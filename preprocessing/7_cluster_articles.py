@@ -0,0 +1,227 @@
+# preprocessing/7_cluster_articles.py
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import faiss
+import yaml
+import json
+import logging
+import os
+
+from scipy import sparse
+
+from pathlib import Path
+import sys
+
+# Get the parent directory of the current script
+parent_dir = Path(__file__).parent.parent
+
+# The embedding store format, the tokenizer and the cluster column names are shared with the app
+sys.path.insert(0, str(parent_dir / "app"))
+import embedding_store
+import lexical_index
+import topic_clusters
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def load_config(config_path=parent_dir / "config.yaml"):
+    """Loads the YAML configuration file."""
+    with open(config_path, 'r') as f:
+        return yaml.safe_load(f)
+
+def training_sample(n_rows, n_clusters, max_points_per_centroid=256, random_state=42):
+    """Sorted row ids of the k-means training sample: at most max_points_per_centroid rows per cluster."""
+    sample_size = min(n_rows, n_clusters * max_points_per_centroid)
+    if sample_size == n_rows:
+        return np.arange(n_rows)
+    rng = np.random.default_rng(random_state)
+    return np.sort(rng.choice(n_rows, size=sample_size, replace=False))
+
+def train_kmeans(embeddings, n_clusters, spherical=True, n_iter=20, max_points_per_centroid=256, random_state=42):
+    """
+    Trains FAISS k-means on a random sample of the stored embeddings (read from the memory
+    map), which bounds the cost by n_clusters rather than the corpus size.
+    Returns the centroids, float32 (n_clusters, dimension).
+    """
+    sample_rows = training_sample(len(embeddings), n_clusters, max_points_per_centroid, random_state)
+    sample = np.ascontiguousarray(embeddings[sample_rows], dtype=np.float32)
+    kmeans = faiss.Kmeans(
+        sample.shape[1], n_clusters, niter=n_iter, spherical=spherical, seed=random_state,
+        max_points_per_centroid=max_points_per_centroid, verbose=False
+    )
+    kmeans.train(sample)
+    logging.info(f"k-means with {n_clusters} clusters trained on {len(sample_rows)} rows (objective {kmeans.obj[-1]:.4g}).")
+    return kmeans.centroids
+
+def assign_clusters(embeddings, centroids_by_k, metric_type, batch_size=65536):
+    """
+    Assigns every stored embedding to its nearest centroid at each granularity, block by
+    block. Returns {n_clusters: int32 cluster id per row}.
+    """
+    indexes = {}
+    for n_clusters, centroids in centroids_by_k.items():
+        index = faiss.IndexFlatIP(centroids.shape[1]) if metric_type == faiss.METRIC_INNER_PRODUCT else faiss.IndexFlatL2(centroids.shape[1])
+        index.add(centroids)
+        indexes[n_clusters] = index
+    assignments = {n_clusters: np.empty(len(embeddings), dtype=np.int32) for n_clusters in centroids_by_k}
+    for start, block in embeddings.iter_blocks(batch_size):
+        block = np.ascontiguousarray(block, dtype=np.float32)
+        for n_clusters, index in indexes.items():
+            _, nearest = index.search(block, 1)
+            assignments[n_clusters][start:start + len(block)] = nearest[:, 0]
+        logging.info(f"Cluster assignment: {start + len(block)}/{len(embeddings)} rows.")
+    return assignments
+
+def cluster_term_counts(file_path, fields, assignments, batch_size=50000, min_term_length=3):
+    """
+    Counts how often each term occurs in each cluster, record batch by record batch, as a
+    sparse product: (clusters x rows one-hot) @ (rows x terms counts). Only one batch of
+    records is tokenized at a time.
+    Returns (terms, {n_clusters: CSR (n_clusters, n_terms) term counts}).
+    """
+    parquet_file = pq.ParquetFile(file_path)
+    fields = [field for field in fields if field in parquet_file.schema_arrow.names]
+    if not fields:
+        raise ValueError(f"None of the label fields are in {file_path}.")
+    tokenize = lambda text: [token for token in lexical_index.tokenize(text) if len(token) >= min_term_length and not token.isdigit()]
+
+    vocabulary = {}
+    partial_counts = {n_clusters: [] for n_clusters in assignments}
+    first_row = 0
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=fields):
+        n_rows = batch.num_rows
+        texts = [" ".join(parts) for parts in zip(*(lexical_index.field_texts(batch.column(field).to_pylist()) for field in fields))]
+        counts = lexical_index.count_batch_terms(texts, vocabulary, tokenize)
+        if counts is None: # Every text in the batch is empty or only stop words
+            first_row += n_rows
+            continue
+        counts = counts.tocsr()
+        for n_clusters, cluster_ids in assignments.items():
+            membership = sparse.csr_matrix(
+                (np.ones(n_rows, dtype=np.float32), (cluster_ids[first_row:first_row + n_rows], np.arange(n_rows))),
+                shape=(n_clusters, n_rows)
+            )
+            batch_counts = (membership @ counts).tocoo()
+            partial_counts[n_clusters].append((batch_counts.row, batch_counts.col, batch_counts.data))
+        first_row += n_rows
+        logging.info(f"Counted terms of {first_row} records ({len(vocabulary)} terms so far).")
+
+    term_counts = {}
+    for n_clusters, parts in partial_counts.items():
+        rows, cols, data = (np.concatenate(values) for values in zip(*parts)) if parts else ([], [], [])
+        # Converting to CSR sums the counts of a (cluster, term) pair found in several batches
+        term_counts[n_clusters] = sparse.csr_matrix((data, (rows, cols)), shape=(n_clusters, len(vocabulary)), dtype=np.float32)
+    return list(vocabulary), term_counts
+
+def c_tf_idf(term_counts):
+    """
+    Class-based TF-IDF: term frequency within each cluster, weighted by
+    log(1 + average terms per cluster / frequency of the term over all clusters),
+    so terms common everywhere score low. Returns a CSR matrix shaped like term_counts.
+    """
+    cluster_totals = np.asarray(term_counts.sum(axis=1)).ravel()
+    term_totals = np.asarray(term_counts.sum(axis=0)).ravel()
+    average_terms = cluster_totals.mean() if len(cluster_totals) else 0.0
+    idf = np.log1p(average_terms / np.maximum(term_totals, 1.0)).astype(np.float32)
+    tf = sparse.diags(1.0 / np.maximum(cluster_totals, 1.0)).astype(np.float32) @ term_counts
+    return (tf @ sparse.diags(idf)).tocsr()
+
+def top_terms(scores, terms, n_terms=5):
+    """The n_terms highest-scoring terms of each row (cluster) of a CSR score matrix."""
+    labels = []
+    for cluster in range(scores.shape[0]):
+        start, stop = scores.indptr[cluster], scores.indptr[cluster + 1]
+        values, columns = scores.data[start:stop], scores.indices[start:stop]
+        best = np.argsort(-values, kind='stable')[:n_terms]
+        labels.append([terms[column] for column in columns[best]])
+    return labels
+
+def cluster_labels(terms, term_counts, assignments, n_terms=5):
+    """Label, top terms and size of every cluster at each granularity, as saved to the labels file."""
+    labels = {}
+    for n_clusters, counts in term_counts.items():
+        cluster_terms = top_terms(c_tf_idf(counts), terms, n_terms)
+        sizes = np.bincount(assignments[n_clusters], minlength=n_clusters)
+        labels[topic_clusters.cluster_column(n_clusters)] = {
+            'n_clusters': int(n_clusters),
+            'clusters': [
+                {'id': cluster, 'label': ", ".join(cluster_terms[cluster][:3]) or f"Cluster {cluster}", 'terms': cluster_terms[cluster], 'size': int(sizes[cluster])}
+                for cluster in range(n_clusters)
+            ],
+        }
+    return labels
+
+def save_cluster_columns(file_path, assignments, row_group_size=None):
+    """
+    Adds (or replaces) one cluster id column per granularity in the processed records.
+    Copies the file one row group at a time with the new columns appended, so only one
+    row group is in memory. Writes then renames, so running app processes that read
+    details from the old file keep a valid file.
+    """
+    parquet_file = pq.ParquetFile(file_path)
+    kept = [name for name in parquet_file.schema_arrow.names if not name.startswith(topic_clusters.CLUSTER_COLUMN_PREFIX)]
+    new_columns = {topic_clusters.cluster_column(n_clusters): cluster_ids for n_clusters, cluster_ids in assignments.items()}
+    # Without the pandas metadata, which still lists the replaced columns
+    schema = pa.schema(
+        [parquet_file.schema_arrow.field(name) for name in kept] + [pa.field(name, pa.int32()) for name in new_columns]
+    )
+    tmp_path = f"{file_path}.tmp"
+    first_row = 0
+    with pq.ParquetWriter(tmp_path, schema) as writer:
+        for group in range(parquet_file.num_row_groups):
+            table = parquet_file.read_row_group(group, columns=kept)
+            stop = first_row + table.num_rows
+            for name, cluster_ids in new_columns.items():
+                table = table.append_column(name, pa.array(cluster_ids[first_row:stop], type=pa.int32()))
+            writer.write_table(table.replace_schema_metadata(None), row_group_size=row_group_size)
+            first_row = stop
+    os.replace(tmp_path, file_path)
+    logging.info(f"Cluster columns {', '.join(topic_clusters.cluster_column(n) for n in assignments)} saved to {file_path}")
+
+def main():
+    """Main function to orchestrate clustering and cluster labeling."""
+    logging.info("Starting article clustering process...")
+    config = load_config()
+    paths_config = config['paths']
+    cluster_config = config.get('clustering') or {}
+
+    embeddings = embedding_store.open_embeddings(paths_config['embeddings'])
+    n_rows = pq.ParquetFile(paths_config['processed_data']).metadata.num_rows
+    if len(embeddings) == 0:
+        logging.warning("No embeddings found. Cannot cluster articles.")
+        return
+    if n_rows != len(embeddings):
+        logging.error(f"Mismatch between number of records in processed data ({n_rows}) and number of embeddings ({len(embeddings)}). Aborting.")
+        return
+
+    metric_type = faiss.METRIC_L2 if (config.get('faiss_params') or {}).get('metric') == "l2" else faiss.METRIC_INNER_PRODUCT
+    granularities = sorted({min(int(k), len(embeddings)) for k in cluster_config.get('n_clusters', [20, 200])})
+    centroids = {
+        n_clusters: train_kmeans(
+            embeddings, n_clusters,
+            spherical=metric_type == faiss.METRIC_INNER_PRODUCT,
+            n_iter=cluster_config.get('n_iter', 20),
+            max_points_per_centroid=cluster_config.get('max_points_per_centroid', 256),
+            random_state=cluster_config.get('random_state', 42)
+        )
+        for n_clusters in granularities
+    }
+    assignments = assign_clusters(embeddings, centroids, metric_type, cluster_config.get('batch_size', 65536))
+
+    terms, term_counts = cluster_term_counts(
+        paths_config['processed_data'],
+        cluster_config.get('label_fields', ['title']),
+        assignments,
+        cluster_config.get('label_batch_size', 50000)
+    )
+    labels = cluster_labels(terms, term_counts, assignments, cluster_config.get('label_terms', 5))
+
+    save_cluster_columns(paths_config['processed_data'], assignments, (config.get('storage') or {}).get('row_group_size'))
+    with open(paths_config['cluster_labels'], 'w') as f:
+        json.dump(labels, f, indent=2)
+    logging.info(f"Cluster labels saved to {paths_config['cluster_labels']}")
+    logging.info("Article clustering process finished successfully.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+# service/load_test.py
+"""
+Load test for service/search_service.py: at each concurrency level, that many client
+threads send requests back to back (each over its own keep-alive connection) and the
+run reports throughput, p50/p95/p99 latency, errors and the service's mean batch sizes
+over the level. Query texts are article titles from the processed records.
+Results are written as JSON so runs (e.g. different max_batch_size / max_wait_ms) can
+be compared.
+
+Usage:
+    python service/search_service.py &
+    python service/load_test.py --concurrency 1 4 16 64 --requests 500
+    python service/load_test.py --endpoint similar --concurrency 1 8
+"""
+import argparse
+import http.client
+import json
+import logging
+import platform
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import quote, urlparse
+
+import numpy as np
+
+# Get the parent directory of the current script
+parent_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(parent_dir / "app"))
+sys.path.insert(0, str(parent_dir / "benchmarks"))
+
+from search_benchmark import latency_summary, load_query_texts
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def make_request(endpoint, item, top_k):
+    """(method, path, body) of one request for an endpoint; item is a query text, a list of them, or a row id."""
+    if endpoint == "search":
+        return "GET", f"/search?q={quote(item)}&top_k={top_k}", None
+    if endpoint == "similar":
+        return "GET", f"/similar?row={item}&top_k={top_k}", None
+    return "POST", "/search/batch", json.dumps({'queries': item, 'top_k': top_k})
+
+def get_json(url, path):
+    """GET a JSON document from the service."""
+    parsed = urlparse(url)
+    connection = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=60)
+    try:
+        connection.request("GET", path)
+        return json.loads(connection.getresponse().read())
+    finally:
+        connection.close()
+
+def run_level(url, requests, concurrency):
+    """
+    Sends requests (method, path, body tuples) from concurrency threads, each taking the
+    next unsent request until none are left. Returns (latencies in seconds, errors, wall time).
+    """
+    parsed = urlparse(url)
+    latencies, errors = [], []
+    lock = threading.Lock()
+    next_request = iter(requests)
+
+    def client():
+        connection = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=60)
+        while True:
+            with lock:
+                request = next(next_request, None)
+            if request is None:
+                break
+            method, path, body = request
+            start = time.perf_counter()
+            try:
+                connection.request(method, path, body=body, headers={'Content-Type': 'application/json'} if body else {})
+                response = connection.getresponse()
+                response.read()
+                elapsed = time.perf_counter() - start
+                with lock:
+                    if response.status == 200:
+                        latencies.append(elapsed)
+                    else:
+                        errors.append(f"HTTP {response.status}")
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                connection.close()
+                connection = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=60)
+        connection.close()
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - start
+
+def batch_delta(before, after):
+    """Mean batch size of the batches a service ran between two /health snapshots."""
+    batches = after['batches'] - before['batches']
+    return (after['items'] - before['items']) / batches if batches else 0.0
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure search service throughput and tail latency at several concurrency levels.")
+    parser.add_argument("--url", default="http://127.0.0.1:8600", help="Base URL of a running search service.")
+    parser.add_argument("--endpoint", choices=["search", "similar", "batch"], default="search")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64], help="Client threads per level.")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per concurrency level.")
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests before each level.")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=16, help="Queries per request for the batch endpoint.")
+    parser.add_argument("--unique-queries", action="store_true", help="Never repeat a query text, so the query cache does not help.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", type=Path, default=None, help="JSON results file (default: benchmarks/results/load_test_<timestamp>.json).")
+    args = parser.parse_args()
+
+    health = get_json(args.url, "/health")
+    logging.info(f"Service at {args.url}: {health['articles']} articles, encoder {health['encoder']}, hybrid {health['hybrid']}.")
+
+    n_items = (args.warmup + args.requests) * len(args.concurrency) * (args.batch_size if args.endpoint == "batch" else 1)
+    if args.endpoint == "similar":
+        rng = np.random.default_rng(args.seed)
+        items = rng.integers(0, health['articles'], size=n_items).tolist()
+    else:
+        items = load_query_texts(n_items, args.seed)
+        if args.unique_queries: # Suffixes make every text distinct while keeping realistic queries
+            items = [f"{text} {i}" for i, text in enumerate(items)]
+    if args.endpoint == "batch":
+        items = [items[i:i + args.batch_size] for i in range(0, len(items), args.batch_size)]
+    requests = [make_request(args.endpoint, item, args.top_k) for item in items]
+
+    report = {
+        'benchmark': 'search_service_load',
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'args': {key: (str(value) if isinstance(value, Path) else value) for key, value in vars(args).items()},
+        'platform': {'python': platform.python_version(), 'machine': platform.machine(), 'processor': platform.processor()},
+        'service': {key: health[key] for key in ('articles', 'encoder', 'hybrid', 'neighbor_table')},
+        'batching': {key: health['search_batches'][key] for key in ('max_batch_size', 'max_wait_ms')},
+        'results': [],
+    }
+    position = 0
+    for concurrency in args.concurrency:
+        warmup = requests[position:position + args.warmup]
+        measured = requests[position + args.warmup:position + args.warmup + args.requests]
+        position += args.warmup + args.requests
+        run_level(args.url, warmup, concurrency)
+
+        before = get_json(args.url, "/health")
+        latencies, errors, wall_time = run_level(args.url, measured, concurrency)
+        after = get_json(args.url, "/health")
+        result = {
+            'concurrency': concurrency,
+            'requests': len(measured),
+            'errors': len(errors),
+            'throughput_rps': len(latencies) / wall_time if wall_time > 0 else 0.0,
+            'mean_encode_batch': batch_delta(before['encode_batches'], after['encode_batches']),
+            'mean_search_batch': batch_delta(before['search_batches'], after['search_batches']),
+            **(latency_summary(latencies) if latencies else {}),
+        }
+        if args.endpoint == "batch":
+            result['throughput_queries_per_s'] = result['throughput_rps'] * args.batch_size
+        if errors:
+            result['first_error'] = errors[0]
+        report['results'].append(result)
+        logging.info(
+            f"concurrency {concurrency}: {result['throughput_rps']:.1f} req/s, "
+            f"p50={result.get('p50_ms', float('nan')):.1f}ms p95={result.get('p95_ms', float('nan')):.1f}ms "
+            f"p99={result.get('p99_ms', float('nan')):.1f}ms, batches encode {result['mean_encode_batch']:.1f} / "
+            f"search {result['mean_search_batch']:.1f}, {len(errors)} errors"
+        )
+
+    output_path = args.output or parent_dir / "benchmarks" / "results" / f"load_test_{datetime.now():%Y%m%d_%H%M%S}.json"
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    logging.info(f"Load test results written to {output_path}")
+
+if __name__ == "__main__":
+    main()
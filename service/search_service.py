@@ -0,0 +1,399 @@
+# service/search_service.py
+"""
+Headless HTTP search service over the app's artifacts (FAISS index, embedding store,
+processed records and, when built, the lexical index and neighbor table), for tools
+that need search without the Streamlit UI.
+
+Concurrent requests are coalesced into micro-batches: one worker thread encodes all
+pending query texts with a single model.encode call, another runs all pending vector
+searches with a single index.search call. A batch is closed when it reaches
+max_batch_size or max_wait_ms after its first request, whichever comes first. With
+max_wait_ms 0 a batch is whatever queued up while the previous one ran: no added
+latency at low load, batches that grow with the load.
+
+Endpoints (JSON responses):
+    GET  /health
+    GET  /search?q=<text>&top_k=10[&hybrid=0]      or POST /search {"query", "top_k", "hybrid"}
+    GET  /similar?id=<article id>&top_k=10         (or row=<row id>)
+    POST /search/batch {"queries": [...], "top_k": 10, "hybrid": true}
+
+Usage:
+    python service/search_service.py --port 8600 --max-batch-size 32 --max-wait-ms 0
+"""
+import argparse
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pyarrow.parquet as pq
+import yaml
+
+# Get the parent directory of the current script
+parent_dir = Path(__file__).parent.parent
+
+# The artifact formats and search functions are shared with the app
+sys.path.insert(0, str(parent_dir / "app"))
+import embedding_store
+import encoder_backend
+import lexical_index
+import neighbor_table
+import search_engine
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def load_config(config_path=parent_dir / "config.yaml"):
+    """Loads the YAML configuration file."""
+    with open(config_path, 'r') as f:
+        return yaml.safe_load(f)
+
+class MicroBatcher:
+    """
+    Collects items submitted from many threads and hands them to process_batch in
+    batches, on one worker thread. process_batch takes a list of items and returns a
+    list of results in the same order. submit returns a Future of the item's result;
+    if process_batch raises, every item of that batch gets the exception.
+    """
+
+    def __init__(self, process_batch, max_batch_size=32, max_wait_ms=0.0, name="batcher"):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def submit_many(self, items):
+        """Submits several items at once; they usually end up in the same batch."""
+        return [self.submit(item) for item in items]
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _next_batch(self):
+        """Blocks for the first item, then gathers more until the batch is full or max_wait has passed."""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                # Items already queued are taken without waiting
+                entry = self._queue.get(timeout=max(deadline - time.perf_counter(), 0)) if self.max_wait else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                self._queue.put(None) # Stop after this batch
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            items = [item for item, _ in batch]
+            try:
+                results = self.process_batch(items)
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                logging.error(f"{self._thread.name}: batch of {len(batch)} failed: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+            with self._stats_lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.largest_batch = max(self.largest_batch, len(batch))
+
+    def stats(self):
+        """Batch counters, for sizing max_batch_size and max_wait_ms."""
+        with self._stats_lock:
+            return {
+                'batches': self.batches,
+                'items': self.items,
+                'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+                'largest_batch': self.largest_batch,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+            }
+
+class SearchService:
+    """
+    Loads the search artifacts once and answers queries through two MicroBatchers:
+    one for query encoding and one for index.search. Safe to call from many threads.
+    """
+
+    def __init__(self, config, max_batch_size=32, max_wait_ms=0.0):
+        paths_config = config['paths']
+        self.model_config = model_config = config['embedding_model']
+        self.hybrid_config = config.get('hybrid_search') or {}
+        self.query_prefix = model_config.get('query_prefix', "")
+
+        self.index, _ = search_engine.read_faiss_index(paths_config['faiss_index'], mmap=config['app_settings'].get('index_mmap', False))
+        params_path = Path(paths_config['faiss_index']).with_suffix('.params.json')
+        if params_path.exists():
+            with open(params_path, 'r') as f:
+                search_engine.apply_search_params(self.index, json.load(f).get('search_params'))
+        self.model = encoder_backend.load_encoder(model_config)
+        cache_config = config.get('query_cache') or {}
+        self.cache = search_engine.QueryEmbeddingCache(
+            model_name=encoder_backend.encoder_id(model_config), # Backends differ slightly
+            max_size=cache_config.get('max_size', 1024),
+            disk_path=cache_config.get('disk_path'),
+            max_disk_size=cache_config.get('max_disk_size', 100000)
+        )
+        self.embeddings = embedding_store.open_embeddings(paths_config['embeddings']) if Path(paths_config['embeddings']).exists() else None
+
+        # Article ids and titles for the responses; Arrow keeps them compact
+        self.records = pq.read_table(paths_config['processed_data'], columns=['id', 'title'])
+        article_ids = np.asarray(self.records.column('id').to_pylist()).astype(str)
+        self._id_order = np.argsort(article_ids, kind='stable')
+        self._sorted_ids = article_ids[self._id_order]
+        if self.index.ntotal != len(self.records):
+            logging.warning(f"FAISS index has {self.index.ntotal} vectors but there are {len(self.records)} records.")
+
+        self.lexical = self._open_optional(paths_config.get('lexical_index'), lexical_index.open_lexical_index) if self.hybrid_config.get('enabled', False) else None
+        self.neighbors = self._open_optional(paths_config.get('neighbor_table'), neighbor_table.open_neighbor_table)
+        if self.neighbors is not None and neighbor_table.is_stale(self.neighbors, len(self.records), paths_config['faiss_index']):
+            logging.warning("Neighbor table is older than the FAISS index. Searching live.")
+            self.neighbors = None
+
+        self.encoder = MicroBatcher(self._encode_batch, max_batch_size, max_wait_ms, name="encode-batcher")
+        self.searcher = MicroBatcher(self._search_batch, max_batch_size, max_wait_ms, name="search-batcher")
+        logging.info(f"Search service ready: {len(self.records)} articles, hybrid {'on' if self.lexical is not None else 'off'}, neighbor table {'on' if self.neighbors is not None else 'off'}.")
+
+    def _open_optional(self, directory, open_function):
+        """Opens an optional artifact directory; None if it is missing, unreadable or for other records."""
+        if not directory or not (Path(directory) / "meta.json").exists():
+            return None
+        try:
+            artifact = open_function(directory)
+        except Exception as e:
+            logging.error(f"Error opening {directory}: {e}")
+            return None
+        if len(artifact) != len(self.records):
+            logging.warning(f"{directory} covers {len(artifact)} records, processed data has {len(self.records)}. Ignoring it.")
+            return None
+        return artifact
+
+    def _encode_batch(self, texts):
+        return list(search_engine.embed_queries(texts, self.model, self.query_prefix, self.cache))
+
+    def _search_batch(self, requests):
+        vectors, top_ks = zip(*requests)
+        return search_engine.search_faiss_index_batch(np.vstack(vectors), self.index, list(top_ks))
+
+    def row_for_article_id(self, article_id):
+        """Row id of an article id. Raises KeyError if there is no such article."""
+        position = np.searchsorted(self._sorted_ids, str(article_id))
+        if position >= len(self._sorted_ids) or self._sorted_ids[position] != str(article_id):
+            raise KeyError(f"Unknown article id: {article_id}")
+        return int(self._id_order[position])
+
+    def describe(self, row_ids, scores):
+        """Result list: row id, article id, title and score of each row, best first."""
+        rows = self.records.take(np.asarray(row_ids, dtype=np.int64)).to_pylist()
+        return [
+            {'row': int(row_id), 'id': record['id'], 'title': record['title'], 'score': float(score)}
+            for row_id, record, score in zip(row_ids, rows, scores)
+        ]
+
+    def search_texts(self, query_texts, top_k=10, hybrid=True):
+        """
+        Searches several query texts: all of them go through the batchers together.
+        With hybrid (and a lexical index), vector and BM25 candidates are fused by
+        reciprocal rank and the fused scores are returned.
+        """
+        hybrid = hybrid and self.lexical is not None
+        embeddings = [future.result() for future in self.encoder.submit_many(query_texts)]
+        k = max(top_k, self.hybrid_config.get('candidates', 100)) if hybrid else top_k
+        vector_results = [future.result() for future in self.searcher.submit_many([(embedding, k) for embedding in embeddings])]
+
+        results = []
+        for query_text, (distances, vector_ids) in zip(query_texts, vector_results):
+            if hybrid:
+                _, lexical_ids = self.lexical.search(query_text, top_k=k, max_postings=self.hybrid_config.get('max_postings_per_term', 10000))
+                scores, row_ids = search_engine.reciprocal_rank_fusion(
+                    [vector_ids, lexical_ids], top_k=top_k,
+                    rrf_k=self.hybrid_config.get('rrf_k', 60), weights=[1.0, self.hybrid_config.get('lexical_weight', 1.0)]
+                )
+            else:
+                scores, row_ids = distances, vector_ids
+            results.append(self.describe(row_ids, scores))
+        return results
+
+    def similar_to_row(self, row_id, top_k=10):
+        """Nearest other articles of a row: from the neighbor table when it can answer, else searched (batched)."""
+        if not 0 <= row_id < len(self.records):
+            raise KeyError(f"Unknown row id: {row_id}")
+        if self.neighbors is not None:
+            scores, row_ids = self.neighbors.neighbors(row_id, top_k=top_k)
+            if row_ids is not None:
+                return self.describe(row_ids, scores)
+        vector = search_engine.get_stored_vector(row_id, self.index, self.embeddings)
+        if vector is None:
+            raise KeyError(f"No stored vector for row {row_id}")
+        scores, row_ids = self.searcher.submit((vector, top_k + 1)).result() # +1 to exclude self
+        keep = row_ids != row_id
+        return self.describe(row_ids[keep][:top_k], scores[keep][:top_k])
+
+    def health(self):
+        return {
+            'status': 'ok',
+            'articles': len(self.records),
+            'index_vectors': int(self.index.ntotal),
+            'encoder': encoder_backend.encoder_id(self.model_config),
+            'hybrid': self.lexical is not None,
+            'neighbor_table': self.neighbors is not None,
+            'encode_batches': self.encoder.stats(),
+            'search_batches': self.searcher.stats(),
+            'query_cache': self.cache.stats(),
+        }
+
+def required(params, name):
+    """A required request parameter; a missing one is a client error (400)."""
+    if name not in params:
+        raise ValueError(f"Missing parameter: {name}")
+    return params[name]
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    """JSON endpoints over the server's SearchService (see the module docstring)."""
+    protocol_version = "HTTP/1.1" # Keep-alive, so clients reuse connections
+    disable_nagle_algorithm = True # Otherwise small responses on kept-alive connections wait ~40ms for delayed ACKs
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        if url.path == "/health":
+            self._respond(lambda: self.server.service.health())
+        elif url.path == "/search":
+            self._respond(lambda: self._search([required(params, 'q')], params)[0])
+        elif url.path == "/similar":
+            self._respond(lambda: self._similar(params))
+        else:
+            self._send_json(404, {'error': f"Unknown endpoint: {url.path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length < 0:
+                raise ValueError(length)
+        except ValueError:
+            self.close_connection = True # The body cannot be skipped without a valid length
+            self._send_json(400, {'error': f"Invalid Content-Length: {self.headers.get('Content-Length')!r}"})
+            return
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError as e:
+            self._send_json(400, {'error': f"Invalid JSON body: {e}"})
+            return
+        if url.path == "/search":
+            self._respond(lambda: self._search([required(body, 'query')], body)[0])
+        elif url.path == "/search/batch":
+            self._respond(lambda: self._search(required(body, 'queries'), body))
+        else:
+            self._send_json(404, {'error': f"Unknown endpoint: {url.path}"})
+
+    def _top_k(self, params):
+        top_k = int(params.get('top_k', self.server.default_top_k))
+        if not 1 <= top_k <= self.server.max_top_k:
+            raise ValueError(f"top_k must be between 1 and {self.server.max_top_k}.")
+        return top_k
+
+    def _search(self, queries, params):
+        if not isinstance(queries, list) or not all(isinstance(query, str) and query.strip() for query in queries):
+            raise ValueError("Queries must be non-empty strings.")
+        if len(queries) > self.server.max_batch_queries:
+            raise ValueError(f"At most {self.server.max_batch_queries} queries per request.")
+        hybrid = params.get('hybrid', True) not in (False, "0", "false")
+        results = self.server.service.search_texts(queries, self._top_k(params), hybrid)
+        return [{'query': query, 'results': query_results} for query, query_results in zip(queries, results)]
+
+    def _similar(self, params):
+        service = self.server.service
+        row_id = int(params['row']) if 'row' in params else service.row_for_article_id(required(params, 'id'))
+        return {'row': row_id, 'results': service.similar_to_row(row_id, self._top_k(params))}
+
+    def _respond(self, handler):
+        try:
+            self._send_json(200, handler())
+        except KeyError as e: # Unknown article or row
+            self._send_json(404, {'error': e.args[0] if e.args else "Not found"})
+        except (ValueError, TypeError) as e:
+            self._send_json(400, {'error': str(e)})
+        except Exception as e:
+            logging.error(f"Error handling {self.command} {self.path}: {e}")
+            self._send_json(500, {'error': str(e)})
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+class SearchServer(ThreadingHTTPServer):
+    """One thread per connection; the threads meet in the service's batchers."""
+    daemon_threads = True
+    request_queue_size = 128 # Pending connections; the default (5) drops bursts
+
+    def __init__(self, address, service, default_top_k=10, max_top_k=100, max_batch_queries=256):
+        super().__init__(address, SearchRequestHandler)
+        self.service = service
+        self.default_top_k = default_top_k
+        self.max_top_k = max_top_k
+        self.max_batch_queries = max_batch_queries
+
+def main():
+    config = load_config()
+    service_config = config.get('search_service') or {}
+    parser = argparse.ArgumentParser(description="Serve search over HTTP with micro-batched encoding and FAISS search.")
+    parser.add_argument("--host", default=service_config.get('host', "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=service_config.get('port', 8600))
+    parser.add_argument("--max-batch-size", type=int, default=service_config.get('max_batch_size', 32), help="Most queries encoded/searched per batch.")
+    parser.add_argument("--max-wait-ms", type=float, default=service_config.get('max_wait_ms', 0.0), help="Longest a batch waits for more queries after its first.")
+    args = parser.parse_args()
+
+    service = SearchService(config, args.max_batch_size, args.max_wait_ms)
+    server = SearchServer(
+        (args.host, args.port), service,
+        default_top_k=service_config.get('default_top_k', config['app_settings']['default_top_k']),
+        max_top_k=service_config.get('max_top_k', 100),
+        max_batch_queries=service_config.get('max_batch_queries', 256)
+    )
+    logging.info(f"Search service listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
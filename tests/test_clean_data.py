@@ -0,0 +1,98 @@
+# tests/test_clean_data.py
+"""
+The columnar cleaning engine must write exactly the same Parquet table (schema and
+values) as the per-record engine, on the sample data and on awkward records.
+"""
+import copy
+import importlib
+import json
+import sys
+from pathlib import Path
+
+import pyarrow.parquet as pq
+import pytest
+
+parent_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(parent_dir / "preprocessing"))
+clean_data = importlib.import_module("1_clean_data")
+
+TEXT_FIELDS = ['title', 'abstract']
+
+EDGE_CASE_RECORDS = [
+    {'title': "No id", 'abstract': "Dropped: the id is missing.", 'year': 2001},
+    {'id': "none_title", 'title': None, 'abstract': "Dropped: the title is None."},
+    {'id': "empty_title", 'title': "", 'abstract': "Dropped: the title is empty."},
+    {'id': "year_text", 'title': "  Year\tis\n text ", 'abstract': "Kept with year 0.", 'year': 'abc', 'journal': "J"},
+    {'id': "year_float", 'title': "Year is a float", 'abstract': "Kept with year 1999.", 'year': 1999.0},
+    {'id': "year_none", 'title': "Year is None", 'abstract': "Kept with year 0.", 'year': None, 'journal': ""},
+    {'id': "extra_keys", 'title': "Extra keys", 'abstract': "Has extra keys.", 'year': 2020, 'doi': "10.1/x", 'pages': 12},
+    {'id': "list_authors", 'title': "List authors", 'abstract': "Authors as a list.", 'authors': ["A, B", "C, D"]},
+    {'id': "no_abstract_key", 'title': "Only a title", 'abstract': "x", 'keywords': None},
+]
+
+def load_sample_records():
+    with open(parent_dir / "data" / "raw_records.json", 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def write_jsonl(records, path):
+    path.write_text("\n".join(json.dumps(record) for record in records), encoding='utf-8')
+    return path
+
+def write_and_read(df, path):
+    clean_data.save_processed_data(df, path)
+    return pq.read_table(path)
+
+@pytest.mark.parametrize("records", [
+    pytest.param(load_sample_records(), id="sample"),
+    pytest.param(EDGE_CASE_RECORDS, id="edge_cases"),
+    pytest.param(load_sample_records() + EDGE_CASE_RECORDS, id="sample_and_edge_cases"),
+    pytest.param(EDGE_CASE_RECORDS[::-1], id="edge_cases_reversed"),
+])
+def test_columnar_matches_python(records, tmp_path):
+    expected = write_and_read(clean_data.clean_records(copy.deepcopy(records), TEXT_FIELDS, engine="python"), tmp_path / "python.parquet")
+    actual = write_and_read(clean_data.clean_records(copy.deepcopy(records), TEXT_FIELDS, engine="columnar"), tmp_path / "columnar.parquet")
+    assert actual.schema.equals(expected.schema)
+    assert actual.equals(expected)
+
+def test_python_whitespace_matches_isspace():
+    expected = "".join(chr(code) for code in range(sys.maxunicode + 1) if chr(code).isspace())
+    assert clean_data.PYTHON_WHITESPACE == expected
+
+@pytest.mark.parametrize("engine", ["python", "columnar"])
+def test_streaming_keeps_fields_missing_from_first_chunk(engine, tmp_path):
+    records = [
+        {'id': "a", 'title': "First", 'abstract': "x", 'doi': None},
+        {'id': "b", 'title': "Second", 'abstract': "y", 'doi': None, 'authors': "Single, Author"},
+        {'id': "c", 'title': "Third", 'abstract': "z", 'year': 2001, 'journal': "J", 'authors': ["A, B"], 'doi': "10.1/c"},
+    ]
+    raw_path = write_jsonl(records, tmp_path / "raw.jsonl")
+    output_path = tmp_path / "streamed.parquet"
+
+    n_written = clean_data.clean_data_streaming(raw_path, output_path, TEXT_FIELDS, chunk_size=2, engine=engine)
+
+    table = pq.read_table(output_path)
+    assert n_written == 3
+    assert table.column('doi').to_pylist() == [None, None, "10.1/c"]
+    assert table.column('authors').to_pylist() == [None, ["Single, Author"], ["A, B"]]
+    assert table.column('year').to_pylist() == [0, 0, 2001]
+
+@pytest.mark.parametrize("engine", ["python", "columnar"])
+def test_streaming_fails_on_columns_after_the_first_chunk(engine, tmp_path):
+    records = [
+        {'id': "a", 'title': "First", 'abstract': "x"},
+        {'id': "b", 'title': "Second", 'abstract': "y", 'late': 1},
+    ]
+    raw_path = write_jsonl(records, tmp_path / "raw.jsonl")
+    output_path = tmp_path / "streamed.parquet"
+
+    with pytest.raises(ValueError, match="late"):
+        clean_data.clean_data_streaming(raw_path, output_path, TEXT_FIELDS, chunk_size=1, engine=engine)
+    assert not output_path.exists()
+    assert not Path(f"{output_path}.tmp").exists()
+
+def test_streaming_columnar_workers_match_single_process(tmp_path):
+    records = EDGE_CASE_RECORDS + load_sample_records() # Every column appears in the first chunk
+    raw_path = write_jsonl(records, tmp_path / "raw.jsonl")
+    clean_data.clean_data_streaming(raw_path, tmp_path / "single.parquet", TEXT_FIELDS, chunk_size=20, engine="columnar")
+    clean_data.clean_data_streaming(raw_path, tmp_path / "workers.parquet", TEXT_FIELDS, chunk_size=20, engine="columnar", n_workers=2)
+    assert pq.read_table(tmp_path / "workers.parquet").equals(pq.read_table(tmp_path / "single.parquet"))
@@ -0,0 +1,87 @@
+# tests/test_lexical_index.py
+"""
+BM25 scores and the per-term postings cap of the lexical index, built by
+preprocessing/5_build_lexical_index.py, and hybrid_search over it.
+"""
+import importlib
+import sys
+from pathlib import Path
+
+import faiss
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+parent_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(parent_dir / "preprocessing"))
+sys.path.insert(0, str(parent_dir / "app"))
+build_lexical_index = importlib.import_module("5_build_lexical_index")
+import lexical_index
+import search_engine
+
+TITLES = [
+    "apple banana",
+    "apple apple cherry",
+    "banana cherry cherry durian",
+    "apple",
+    "eggplant",
+]
+K1, B = 1.2, 0.75
+
+@pytest.fixture(scope="module")
+def index(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("lexical")
+    records_path = directory / "records.parquet"
+    pq.write_table(pa.table({'title': TITLES}), records_path)
+    terms, term_ids, row_ids, frequencies, doc_lengths = build_lexical_index.count_terms(records_path, {'title': 1.0})
+    sorted_terms, offsets, posting_rows, impacts = build_lexical_index.build_postings(terms, term_ids, row_ids, frequencies, doc_lengths, K1, B)
+    lexical_index.write_lexical_index(directory / "index", sorted_terms, offsets, posting_rows, impacts, meta={'n_docs': len(TITLES)})
+    return lexical_index.open_lexical_index(directory / "index")
+
+def expected_bm25(term, row):
+    """Textbook BM25 (Lucene idf) of one term in one title."""
+    documents = [title.split() for title in TITLES]
+    avgdl = np.mean([len(words) for words in documents])
+    df = sum(term in words for words in documents)
+    tf = documents[row].count(term)
+    idf = np.log(1 + (len(documents) - df + 0.5) / (df + 0.5))
+    return idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * len(documents[row]) / avgdl))
+
+def test_scores_match_bm25(index):
+    scores, row_ids = index.search("apple cherry", top_k=10)
+    expected = {row: expected_bm25("apple", row) + expected_bm25("cherry", row) for row in range(len(TITLES))}
+    expected = {row: score for row, score in expected.items() if score > 0}
+    assert sorted(row_ids.tolist()) == sorted(expected)
+    np.testing.assert_allclose(scores, [expected[row] for row in row_ids], rtol=1e-2) # Impacts are float16
+    assert list(scores) == sorted(scores, reverse=True)
+
+def test_unknown_terms_return_nothing(index):
+    scores, row_ids = index.search("zucchini", top_k=10)
+    assert len(scores) == 0 and len(row_ids) == 0
+
+def test_max_postings_keeps_highest_impact_documents(index):
+    _, all_rows = index.search("apple", top_k=10)
+    _, capped_rows = index.search("apple", top_k=10, max_postings=2)
+    assert len(all_rows) == 3
+    assert capped_rows.tolist() == all_rows[:2].tolist()
+
+def test_allowed_ids_restrict_results(index):
+    _, row_ids = index.search("apple", top_k=10, allowed_ids=np.array([0, 4]))
+    assert row_ids.tolist() == [0]
+
+def test_hybrid_search_fuses_vector_and_lexical_ranks(index):
+    # Vector ranking for the query: 3, 2, 1, 0, 4. BM25 ranking for "cherry": 2, 1.
+    vectors = np.zeros((len(TITLES), 4), dtype=np.float32)
+    vectors[:, 0] = [0.1, 0.5, 0.9, 1.0, -1.0]
+    vector_index = faiss.IndexFlatIP(4)
+    vector_index.add(vectors)
+    query = np.array([[1.0, 0, 0, 0]], dtype=np.float32)
+
+    fused_ids, distances, vector_ids = search_engine.hybrid_search("cherry", query, vector_index, index, top_k=3, candidates=5)
+    assert fused_ids.tolist() == [2, 1, 3]
+    assert vector_ids.tolist() == [3, 2, 1, 0, 4]
+    assert len(distances) == 5
+
+    fused_ids, _, _ = search_engine.hybrid_search("cherry", query, vector_index, index, top_k=3, candidates=5, allowed_ids=np.array([0, 1, 3]))
+    assert fused_ids.tolist() == [1, 3, 0]
@@ -0,0 +1,57 @@
+# tests/test_neighbor_table.py
+"""The precomputed neighbor table: stale detection and filtered lookups."""
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+parent_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(parent_dir / "app"))
+import neighbor_table
+
+IDS = np.array([[1, 2, 3], [0, 2, -1], [3, 0, 1], [2, 1, 0]], dtype=np.int32)
+SCORES = np.array([[0.9, 0.8, 0.7], [0.9, 0.5, 0.0], [0.6, 0.5, 0.4], [0.9, 0.3, 0.2]], dtype=np.float16)
+
+@pytest.fixture
+def index_path(tmp_path):
+    path = tmp_path / "index.faiss"
+    path.write_bytes(b"index")
+    os.utime(path, (1000, 1000))
+    return path
+
+@pytest.fixture
+def table(tmp_path, index_path):
+    directory = tmp_path / "neighbors"
+    tmp_directory = neighbor_table.create_table(directory, len(IDS), IDS.shape[1])
+    neighbor_table.write_rows(tmp_directory, 0, IDS[:2], SCORES[:2])
+    neighbor_table.write_rows(tmp_directory, 2, IDS[2:], SCORES[2:])
+    neighbor_table.finish_table(directory, {'n_rows': len(IDS), 'k': IDS.shape[1], 'index_mtime': os.path.getmtime(index_path)})
+    return neighbor_table.open_neighbor_table(directory)
+
+def test_fresh_table_is_not_stale(table, index_path):
+    assert not neighbor_table.is_stale(table, len(IDS), index_path)
+
+def test_table_for_other_rows_is_stale(table, index_path):
+    assert neighbor_table.is_stale(table, len(IDS) + 1, index_path)
+
+def test_table_older_than_the_index_is_stale(table, index_path):
+    os.utime(index_path, (2000, 2000)) # The index was rebuilt after the table
+    assert neighbor_table.is_stale(table, len(IDS), index_path)
+
+def test_missing_index_does_not_make_the_table_stale(table, tmp_path):
+    assert not neighbor_table.is_stale(table, len(IDS), tmp_path / "missing.faiss")
+
+def test_neighbors_are_read_back_best_first(table):
+    scores, row_ids = table.neighbors(0, top_k=2)
+    assert row_ids.tolist() == [1, 2]
+    np.testing.assert_allclose(scores, [0.9, 0.8], rtol=1e-3)
+
+def test_lookup_declines_what_it_cannot_answer_exactly(table):
+    assert table.neighbors(0, top_k=4) == (None, None) # More than the stored k
+    assert table.neighbors(0, top_k=2, allowed_ids=np.array([3])) == (None, None) # Rows beyond k may qualify
+
+def test_short_rows_answer_filtered_lookups(table):
+    _, row_ids = table.neighbors(1, top_k=2, allowed_ids=np.array([2, 3])) # Row 1 has fewer than k neighbors, so its list is complete
+    assert row_ids.tolist() == [2]
@@ -0,0 +1,62 @@
+# tests/test_query_cache.py
+"""QueryEmbeddingCache (search_engine): in-memory LRU eviction and SQLite persistence and pruning."""
+import sqlite3
+import sys
+from pathlib import Path
+
+import numpy as np
+
+parent_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(parent_dir / "app"))
+import search_engine
+
+def vector(value):
+    return np.full((1, 4), value, dtype=np.float32)
+
+def disk_queries(path):
+    with sqlite3.connect(str(path)) as db:
+        return sorted(row[0] for row in db.execute("SELECT query FROM query_embeddings"))
+
+def test_lru_evicts_least_recently_used():
+    cache = search_engine.QueryEmbeddingCache("model", max_size=2)
+    cache.put("", "a", vector(1))
+    cache.put("", "b", vector(2))
+    assert cache.get("", "a") is not None # "a" is now more recent than "b"
+    cache.put("", "c", vector(3))
+
+    assert cache.get("", "b") is None
+    assert cache.get("", "a")[0, 0] == 1
+    assert cache.get("", "c")[0, 0] == 3
+    assert cache.stats()['size'] == 2
+
+def test_hits_are_copies():
+    cache = search_engine.QueryEmbeddingCache("model")
+    original = vector(1)
+    cache.put("", "a", original)
+    original[:] = 9 # The caller's array is not the cached one
+    hit = cache.get("", "a")
+    hit[:] = 7 # Nor is a hit
+    assert cache.get("", "a")[0, 0] == 1
+
+def test_keys_include_prefix_and_model(tmp_path):
+    cache = search_engine.QueryEmbeddingCache("model", disk_path=tmp_path / "cache.sqlite")
+    cache.put("query: ", "a", vector(1))
+    assert cache.get("", "a") is None
+    assert search_engine.QueryEmbeddingCache("other", disk_path=tmp_path / "cache.sqlite").get("query: ", "a") is None
+
+def test_disk_entries_survive_restarts(tmp_path):
+    disk_path = tmp_path / "cache.sqlite"
+    search_engine.QueryEmbeddingCache("model", disk_path=disk_path).put("", "a", vector(1))
+    reopened = search_engine.QueryEmbeddingCache("model", disk_path=disk_path)
+    assert reopened.get("", "a")[0, 0] == 1
+
+def test_disk_is_pruned_to_most_recent_writes(tmp_path):
+    disk_path = tmp_path / "cache.sqlite"
+    cache = search_engine.QueryEmbeddingCache("model", disk_path=disk_path, max_disk_size=3, prune_interval=2)
+    for i, query in enumerate("abcd"):
+        cache.put("", query, vector(i))
+    assert disk_queries(disk_path) == ["b", "c", "d"] # Pruned at the 4th write
+
+    cache.put("", "b", vector(5)) # Rewriting makes "b" the most recent
+    search_engine.QueryEmbeddingCache("model", disk_path=disk_path, max_disk_size=2) # Pruned on open
+    assert disk_queries(disk_path) == ["b", "d"]
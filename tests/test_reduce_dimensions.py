@@ -0,0 +1,51 @@
+# tests/test_reduce_dimensions.py
+"""UMAP append mode (stage 4): placing new rows and the drift report, without a refit."""
+import importlib
+import math
+import sys
+from pathlib import Path
+
+import faiss
+import numpy as np
+import pandas as pd
+import pytest
+
+parent_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(parent_dir / "preprocessing"))
+reduce_dimensions = importlib.import_module("4_reduce_dimensions")
+
+def build_index(index_type, vectors):
+    dimension = vectors.shape[1]
+    if index_type == "IVFFlat":
+        index = faiss.IndexIVFFlat(faiss.IndexFlatIP(dimension), dimension, 4, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+    else:
+        index = faiss.IndexFlatIP(dimension)
+    index.add(vectors)
+    return index
+
+@pytest.mark.parametrize("index_type", ["Flat", "IVFFlat"])
+def test_append_places_new_rows_and_reports_drift(index_type, tmp_path):
+    rng = np.random.default_rng(0)
+    n_rows, n_mapped = 300, 250 # Fewer mapped rows than the baseline sample
+    vectors = rng.standard_normal((n_rows, 8)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    df = pd.DataFrame({'id': [f"a{i}" for i in range(n_rows)]})
+    pd.DataFrame({'id': df['id'][:n_mapped], 'x': rng.random(n_mapped), 'y': rng.random(n_mapped)}).to_parquet(tmp_path / "coords.parquet")
+    faiss.write_index(build_index(index_type, vectors), str(tmp_path / "index.faiss"))
+    paths_config = {'faiss_index': str(tmp_path / "index.faiss"), 'map_coordinates': str(tmp_path / "coords.parquet"), 'umap_reducer': None}
+    umap_params = {'n_components': 2, 'append': {'placement': "neighbors", 'n_neighbors': 5, 'baseline_sample_size': 2000}}
+
+    coords, drift = reduce_dimensions.append_coordinates(df, vectors, umap_params, paths_config)
+
+    assert np.isfinite(coords).all()
+    assert drift['n_new'] == n_rows - n_mapped
+    assert math.isfinite(drift['baseline_median_nn_distance']) and drift['baseline_median_nn_distance'] > 0
+    assert math.isfinite(drift['distance_ratio'])
+
+def test_exclude_self_skips_each_rows_own_hit():
+    scores = np.array([[1.0, 0.9], [0.8, 1.0], [1.0, 0.0]], dtype=np.float32)
+    indices = np.array([[0, 5], [7, 1], [2, -1]])
+    best_scores, best_indices = reduce_dimensions.exclude_self(scores, indices, np.array([0, 1, 2]))
+    assert best_indices.ravel().tolist() == [5, 7, -1]
+    assert best_scores.ravel().tolist()[:2] == pytest.approx([0.9, 0.8])
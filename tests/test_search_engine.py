@@ -0,0 +1,104 @@
+# tests/test_search_engine.py
+"""Filter-aware FAISS search (search_engine) on the index types the pipeline builds."""
+import sys
+from pathlib import Path
+
+import faiss
+import numpy as np
+import pytest
+
+parent_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(parent_dir / "app"))
+import search_engine
+
+DIMENSION = 16
+
+def make_index(index_type, vectors):
+    if index_type == "Flat":
+        index = faiss.IndexFlatIP(DIMENSION)
+    elif index_type == "IVFFlat":
+        index = faiss.IndexIVFFlat(faiss.IndexFlatIP(DIMENSION), DIMENSION, 8, faiss.METRIC_INNER_PRODUCT)
+        index.nprobe = 8 # Every list, so results are exact
+    elif index_type == "IVFPQ":
+        index = faiss.IndexIVFPQ(faiss.IndexFlatIP(DIMENSION), DIMENSION, 8, 4, 4, faiss.METRIC_INNER_PRODUCT)
+        index.nprobe = 8
+    elif index_type == "HNSW":
+        index = faiss.IndexHNSWFlat(DIMENSION, 16, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efSearch = 128
+    else:
+        index = faiss.index_factory(DIMENSION, index_type, faiss.METRIC_INNER_PRODUCT)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+@pytest.fixture(scope="module")
+def vectors():
+    return np.random.default_rng(0).standard_normal((1000, DIMENSION)).astype(np.float32)
+
+@pytest.mark.parametrize("index_type", ["Flat", "IVFFlat", "IVFPQ", "HNSW", "PCA8,IVF8,Flat"])
+def test_filtered_search_only_returns_allowed_rows(index_type, vectors):
+    index = make_index(index_type, vectors)
+    allowed = np.arange(0, len(vectors), 7)
+
+    distances, indices = search_engine.search_faiss_index(vectors[3], index, top_k=10, allowed_ids=allowed)
+
+    assert indices is not None
+    assert len(indices) == 10
+    assert np.isin(indices, allowed).all()
+    assert len(distances) == len(indices)
+
+def test_id_selector_accepts_unsorted_int32_ids():
+    selector = search_engine.build_id_selector(np.array([40, 5, 9], dtype=np.int32))
+    assert [selector.is_member(row) for row in (5, 6, 9, 40, 41)] == [True, False, True, True, False]
+
+def test_filter_smaller_than_top_k_returns_only_allowed_rows(vectors):
+    index = make_index("Flat", vectors)
+    distances, indices = search_engine.search_faiss_index(vectors[0], index, top_k=10, allowed_ids=np.array([5, 9, 40]))
+    assert sorted(indices.tolist()) == [5, 9, 40] # No -1 padding
+    assert len(distances) == 3
+
+@pytest.mark.parametrize("index_type", ["IVFFlat", "HNSW"])
+def test_filtered_search_keeps_tuned_parameters(index_type, vectors):
+    index = make_index(index_type, vectors)
+    params = search_engine.filtered_search_params(index, search_engine.build_id_selector([1, 2, 3]))
+    if index_type == "IVFFlat":
+        assert params.nprobe == index.nprobe
+    else:
+        assert params.efSearch == index.hnsw.efSearch
+
+def test_exact_filtered_search_matches_brute_force(vectors):
+    index = make_index("Flat", vectors)
+    allowed = np.arange(500, 1000)
+    _, indices = search_engine.search_faiss_index(vectors[0], index, top_k=5, allowed_ids=allowed)
+    expected = allowed[np.argsort(-(vectors[allowed] @ vectors[0]), kind='stable')[:5]]
+    assert indices.tolist() == expected.tolist()
+
+def test_filter_excluding_everything_returns_no_results(vectors):
+    index = make_index("IVFFlat", vectors)
+    distances, indices = search_engine.search_faiss_index(vectors[0], index, top_k=5, allowed_ids=np.array([], dtype=np.int64))
+    assert len(distances) == 0 and len(indices) == 0
+
+@pytest.mark.parametrize("index_type,expected", [("Flat", False), ("HNSW", False), ("IVFFlat", True), ("PCA8,IVF8,Flat", True)])
+def test_mmap_without_ifc_flag_only_reports_ivf_as_mapped(index_type, expected, vectors, tmp_path, monkeypatch):
+    index_path = tmp_path / "index.faiss"
+    faiss.write_index(make_index(index_type, vectors), str(index_path))
+    monkeypatch.delattr(faiss, 'IO_FLAG_MMAP_IFC', raising=False) # As in faiss 1.7.4
+    index, mmapped = search_engine.read_faiss_index(index_path, mmap=True)
+    assert mmapped == expected
+    assert index.ntotal == len(vectors)
+
+def test_reciprocal_rank_fusion_sums_weighted_reciprocal_ranks():
+    scores, row_ids = search_engine.reciprocal_rank_fusion([[1, 2, 3], [3, 1]], top_k=10, rrf_k=60, weights=[1.0, 2.0])
+    expected = {1: 1 / 61 + 2 / 62, 2: 1 / 62, 3: 1 / 63 + 2 / 61}
+    assert row_ids.tolist() == [3, 1, 2]
+    np.testing.assert_allclose(scores, [expected[row] for row in row_ids], rtol=1e-6)
+
+def test_reciprocal_rank_fusion_breaks_ties_by_row_id_and_cuts_at_top_k():
+    scores, row_ids = search_engine.reciprocal_rank_fusion([[7, 4], [4, 7]], top_k=1)
+    assert row_ids.tolist() == [4]
+    assert len(scores) == 1
+
+def test_reciprocal_rank_fusion_of_empty_lists():
+    scores, row_ids = search_engine.reciprocal_rank_fusion([np.array([], dtype=np.int64), []], top_k=5)
+    assert len(scores) == 0 and len(row_ids) == 0
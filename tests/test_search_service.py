@@ -0,0 +1,136 @@
+# tests/test_search_service.py
+"""
+MicroBatcher and the HTTP error handling of service/search_service.py. The handler
+tests serve a stand-in for SearchService, so no model or index is loaded.
+"""
+import http.client
+import json
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+parent_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(parent_dir / "service"))
+import search_service
+
+def test_batcher_returns_results_in_submission_order():
+    batcher = search_service.MicroBatcher(lambda items: [item * 2 for item in items], max_batch_size=4)
+    futures = batcher.submit_many(range(10))
+    assert [future.result(timeout=5) for future in futures] == [item * 2 for item in range(10)]
+    batcher.close()
+    stats = batcher.stats()
+    assert stats['items'] == 10
+    assert stats['largest_batch'] <= 4
+
+def test_batcher_coalesces_queued_items():
+    release = threading.Event()
+    batch_sizes = []
+    def process(items):
+        release.wait(5) # Hold the first batch so the rest queue up behind it
+        batch_sizes.append(len(items))
+        return items
+    batcher = search_service.MicroBatcher(process, max_batch_size=32)
+    first = batcher.submit(0)
+    rest = batcher.submit_many(range(1, 6))
+    release.set()
+    assert [future.result(timeout=5) for future in [first] + rest] == list(range(6))
+    batcher.close()
+    assert sum(batch_sizes) == 6
+    assert len(batch_sizes) <= 2 # The queued items went in one batch
+
+def test_batcher_fails_every_item_of_a_failed_batch():
+    def process(items):
+        raise RuntimeError("encoder down")
+    batcher = search_service.MicroBatcher(process)
+    futures = batcher.submit_many(["a", "b"])
+    for future in futures:
+        with pytest.raises(RuntimeError, match="encoder down"):
+            future.result(timeout=5)
+    batcher.close()
+
+class FakeService:
+    """Answers like SearchService over the articles "a" (row 0) and "b" (row 1)."""
+
+    def search_texts(self, query_texts, top_k=10, hybrid=True):
+        return [[{'row': 0, 'id': "a", 'title': query_text, 'score': 1.0}] for query_text in query_texts]
+
+    def row_for_article_id(self, article_id):
+        if article_id not in ("a", "b"):
+            raise KeyError(f"Unknown article id: {article_id}")
+        return ["a", "b"].index(article_id)
+
+    def similar_to_row(self, row_id, top_k=10):
+        if not 0 <= row_id < 2:
+            raise KeyError(f"Unknown row id: {row_id}")
+        return [{'row': 1 - row_id, 'id': "ba"[row_id], 'title': "", 'score': 0.5}]
+
+    def health(self):
+        return {'status': 'ok'}
+
+@pytest.fixture(scope="module")
+def server():
+    server = search_service.SearchServer(("127.0.0.1", 0), FakeService(), default_top_k=10, max_top_k=20, max_batch_queries=2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def request(server, method, path, body=None, headers=None):
+    connection = http.client.HTTPConnection(*server.server_address, timeout=5)
+    try:
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+def test_valid_requests_succeed(server):
+    assert request(server, "GET", "/search?q=graphs&top_k=3")[0] == 200
+    assert request(server, "GET", "/similar?id=b")[1]['row'] == 1
+    status, payload = request(server, "POST", "/search/batch", json.dumps({'queries': ["a", "b"]}))
+    assert status == 200 and len(payload) == 2
+
+@pytest.mark.parametrize("method,path,body", [
+    ("GET", "/search", None), # Missing q
+    ("GET", "/search?q=graphs&top_k=0", None),
+    ("GET", "/search?q=graphs&top_k=21", None),
+    ("GET", "/search?q=graphs&top_k=many", None),
+    ("GET", "/search?q=%20", None), # Blank query
+    ("GET", "/similar", None), # Neither id nor row
+    ("GET", "/similar?row=x", None),
+    ("POST", "/search", "{not json"),
+    ("POST", "/search", json.dumps({'top_k': 3})), # Missing query
+    ("POST", "/search/batch", json.dumps({'queries': "graphs"})), # Not a list
+    ("POST", "/search/batch", json.dumps({'queries': ["a", "b", "c"]})), # Over max_batch_queries
+])
+def test_bad_requests_get_400(server, method, path, body):
+    status, payload = request(server, method, path, body)
+    assert status == 400
+    assert payload['error']
+
+@pytest.mark.parametrize("content_length", ["abc", "-1"])
+def test_invalid_content_length_gets_400(server, content_length):
+    connection = http.client.HTTPConnection(*server.server_address, timeout=5)
+    try:
+        connection.putrequest("POST", "/search")
+        connection.putheader("Content-Length", content_length)
+        connection.endheaders()
+        response = connection.getresponse()
+        assert response.status == 400
+        assert "Content-Length" in json.loads(response.read())['error']
+    finally:
+        connection.close()
+
+@pytest.mark.parametrize("method,path,body", [
+    ("GET", "/nowhere", None),
+    ("POST", "/nowhere", "{}"),
+    ("GET", "/similar?id=zzz", None), # Unknown article
+    ("GET", "/similar?row=5", None), # Unknown row
+])
+def test_unknown_endpoints_and_articles_get_404(server, method, path, body):
+    status, payload = request(server, method, path, body)
+    assert status == 404
+    assert payload['error']